@@ -0,0 +1,102 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+ACCEPTED = "accepted"
+THROTTLED = "throttled"
+DUPLICATE = "duplicate"
+
+
+class VoteAdmission:
+    """Per-client rate limit and one-vote-per-window check in front of /vote.
+
+    Every client (a logged-in user, otherwise an address) has a token
+    bucket refilling at `rate` per second up to `burst`; take() spends one
+    per attempt, so a script hammering /vote is turned away before its
+    site is even looked up. claim() then lets the client through once per
+    site per window: the time of its counted vote is remembered and
+    further votes inside the window are duplicates.
+
+    Both tables are LRUs capped at `max_clients` entries, so a flood from
+    many addresses costs bounded memory; an evicted client simply starts
+    over with a full bucket. The state is per worker process, so with N
+    workers a client can get at most N votes counted per window.
+    """
+
+    def __init__(self, rate=0.2, burst=5, max_clients=100000):
+        self.rate = float(rate)
+        self.burst = float(burst)
+        self.max_clients = max_clients
+        self._lock = threading.Lock()
+        self._buckets = OrderedDict()
+        self._voted = OrderedDict()
+        self.accepted = 0
+        self.throttled = 0
+        self.duplicates = 0
+        self.evicted = 0
+
+    def take(self, client):
+        """ACCEPTED, or THROTTLED when the client is out of tokens."""
+        now = time.monotonic()
+        with self._lock:
+            bucket = self._buckets.get(client)
+            if bucket is None:
+                bucket = self._buckets[client] = [self.burst, now]
+                self._trim(self._buckets)
+            else:
+                self._buckets.move_to_end(client)
+                bucket[0] = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+                bucket[1] = now
+            if bucket[0] < 1:
+                self.throttled += 1
+                return THROTTLED
+            bucket[0] -= 1
+            return ACCEPTED
+
+    def claim(self, client, site_id, window_seconds):
+        """ACCEPTED or DUPLICATE; an accepted vote is recorded."""
+        now = time.monotonic()
+        with self._lock:
+            key = (client, site_id)
+            voted_at = self._voted.get(key)
+            if voted_at is not None and now - voted_at < window_seconds:
+                self.duplicates += 1
+                return DUPLICATE
+            self._voted[key] = now
+            self._voted.move_to_end(key)
+            self._trim(self._voted)
+            self.accepted += 1
+            return ACCEPTED
+
+    def release(self, client, site_id):
+        # The vote was admitted but could not be queued; let the client retry.
+        with self._lock:
+            if self._voted.pop((client, site_id), None) is not None:
+                self.accepted -= 1
+
+    def retry_after(self, client):
+        """Seconds until `client` has a token again."""
+        with self._lock:
+            bucket = self._buckets.get(client)
+            if bucket is None:
+                return 0.0
+            tokens = min(self.burst, bucket[0] + (time.monotonic() - bucket[1]) * self.rate)
+            return max(0.0, (1 - tokens) / self.rate)
+
+    def _trim(self, table):
+        while len(table) > self.max_clients:
+            table.popitem(last=False)
+            self.evicted += 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                "accepted": self.accepted,
+                "throttled": self.throttled,
+                "duplicates": self.duplicates,
+                "evicted": self.evicted,
+                "clients": len(self._buckets),
+                "votes_tracked": len(self._voted),
+                "max_clients": self.max_clients,
+            }
@@ -1,23 +1,168 @@
-
 from flask import Flask, render_template, request, redirect, session
-from flask import jsonify
-import requests
-import sqlite3
+from flask import jsonify, Response, stream_with_context
+from werkzeug.middleware.proxy_fix import ProxyFix
 from datetime import datetime, timedelta, timezone
-import mysql.connector
-from indic_transliteration import sanscript
-from indic_transliteration.sanscript import transliterate
-import threading
-import time
+import hmac
 
+import api_key
 from api_key import location_iq, owm, mysql as mysql_config
+from tally import SiteTallies, ranked
+import compaction
+from compaction import PollCompactor
+from ingest import VoteIngestor
+import admission
+from admission import VoteAdmission
+from mysql_pool import MySQLPool
+from weather import WeatherService
+import geocode
+from geocode import Geocoder, RateLimited, UpstreamError
+from translit import Transliterator
+from trends import TrendReader, BUCKETS, DEFAULT_SPANS, GROUPINGS, EXPORT_FIELDS
+from trends import encode_csv, encode_ndjson, parse_time, utcnow
+from snapshot import VersionedSnapshot, SectionedSnapshot, SnapshotGroup, ENCODINGS
+from events import ChangeDetector
+import settings
+from settings import RuntimeSettings
+from expiry import ExpiryScheduler
+import monitor_data
+from monitor_data import MonitorSnapshot
+import outbox
+import replica
+import sites
+from sites import SiteIndex, DEFAULT_SITE_ID
+from replica import MonitorReplica
+from outbox import MySQLOutbox, mysql_now, parse_mysql_time
+from sqlite_db import SQLiteManager
+from metrics import Registry, gauge_lines
+from assets import AssetBundler, AssetLoader, ResponseCompressor, accepts
 
 app = Flask(__name__)
 app.secret_key = "secret123"  # change later
 
+# Reverse proxies in front of the app, from `trusted_proxy_hops` in
+# api_key.py. With N > 0, remote_addr comes from X-Forwarded-For N hops
+# back so vote admission sees the real client behind nginx. Leave it at 0
+# unless a known proxy is in front: served directly, the header is the
+# client's own and would let it dodge the vote limits.
+TRUSTED_PROXY_HOPS = getattr(api_key, "trusted_proxy_hops", 0)
+if TRUSTED_PROXY_HOPS:
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=TRUSTED_PROXY_HOPS, x_proto=TRUSTED_PROXY_HOPS)
+
 LOCATIONIQ_KEY = location_iq
 OWM_KEY = owm
 
+# -------------------- METRICS --------------------
+
+# Requests slower than this are printed with a per-phase breakdown
+# (sqlite / mysql / owm / other). None turns the log off.
+SLOW_REQUEST_MS = 500
+
+# A scraper sends "Authorization: Bearer <metrics_token>" (set in
+# api_key.py); without one, /metrics is open to the admin session only.
+METRICS_TOKEN = getattr(api_key, "metrics_token", None)
+
+metrics = Registry()
+request_seconds = metrics.histogram(
+    "radio_request_seconds", "Request latency by route.", ("method", "route", "status")
+)
+sqlite_seconds = metrics.histogram(
+    "radio_sqlite_statement_seconds", "SQLite statement execution time.", ("statement",)
+)
+mysql_seconds = metrics.histogram(
+    "radio_mysql_seconds", "MySQL connect and query round-trips.", ("op",)
+)
+upstream_seconds = metrics.histogram(
+    "radio_upstream_seconds", "Outbound HTTP latency.", ("upstream",)
+)
+upstream_errors = metrics.counter(
+    "radio_upstream_errors_total", "Failed outbound HTTP calls.", ("upstream",)
+)
+
+
+def _observe_sqlite(sql, seconds):
+    # Statements are parameterised, so the text itself is a bounded label.
+    sqlite_seconds.observe(seconds, statement=" ".join(sql.split())[:80])
+    metrics.add_phase("sqlite", seconds)
+
+
+def _observe_mysql(op, seconds):
+    mysql_seconds.observe(seconds, op=op)
+    metrics.add_phase("mysql", seconds)
+
+
+def _upstream_observer(service):
+    def observe(endpoint, seconds, ok):
+        upstream = f"{service}_{endpoint}"
+        upstream_seconds.observe(seconds, upstream=upstream)
+        if not ok:
+            upstream_errors.inc(upstream=upstream)
+        metrics.add_phase(service, seconds)
+    return observe
+
+
+def observe_request(method, route, status, seconds, phases):
+    # Time a long-poll spent waiting for a change is not latency.
+    seconds -= phases.pop("wait", 0.0)
+    request_seconds.observe(seconds, method=method, route=route, status=status)
+    if SLOW_REQUEST_MS is None or seconds * 1000 < SLOW_REQUEST_MS:
+        return
+    parts = sorted(phases.items()) + [("other", seconds - sum(phases.values()))]
+    breakdown = " ".join(f"{name}={value * 1000:.0f}ms" for name, value in parts)
+    print(f"Slow request {method} {route} {status} {seconds * 1000:.0f}ms: {breakdown}")
+
+
+@app.before_request
+def _begin_request_metrics():
+    metrics.begin_request()
+
+
+@app.after_request
+def _end_request_metrics(response):
+    seconds, phases = metrics.end_request()
+    if seconds is not None:
+        route = request.url_rule.rule if request.url_rule else "unmatched"
+        observe_request(request.method, route, response.status_code, seconds, phases)
+    return response
+
+
+@app.teardown_request
+def _abort_request_metrics(exc):
+    # after_request is skipped when a view raises.
+    seconds, phases = metrics.end_request()
+    if seconds is not None and exc is not None:
+        route = request.url_rule.rule if request.url_rule else "unmatched"
+        observe_request(request.method, route, 500, seconds, phases)
+
+
+# -------------------- ASSETS --------------------
+
+# Inline CSS/JS in the templates is served from content-hashed bundles, so
+# a dashboard refresh only re-sends the markup around the data.
+asset_bundler = AssetBundler(url_prefix="/assets")
+app.jinja_loader = AssetLoader(app.jinja_loader, asset_bundler)
+asset_bundler.build(app.jinja_env)
+compress_response = ResponseCompressor(mimetypes=("text/html",), min_size=1024)
+
+
+@app.route("/assets/<filename>")
+def assets(filename):
+    response = asset_bundler.response(
+        filename,
+        request.headers.get("Accept-Encoding"),
+        request.headers.get("If-None-Match"),
+    )
+    if response is None:
+        return "Not found", 404
+    return response
+
+
+@app.after_request
+def _compress_response(response):
+    return compress_response(response, request.headers.get("Accept-Encoding"))
+
+
+weather_service = WeatherService(OWM_KEY, ttl=600, stale_ttl=3600, error_ttl=60, observe=_upstream_observer("owm"))
+
 
 def _deg_to_compass(deg):
     if deg is None:
@@ -57,14 +202,257 @@ def _fmt_local_time(epoch_seconds, tz_offset_seconds):
     except Exception:
         return None
 
+
+def _weather_summary(payload):
+    if not payload:
+        return None
+    data = payload["weather"]
+    w0 = data["weather"][0] or {}
+    main = data.get("main") or {}
+    return {
+        "name": data.get("name"),
+        "desc": w0.get("description"),
+        "icon": w0.get("icon"),
+        "temp": main.get("temp"),
+        "feels": main.get("feels_like"),
+        "humidity": main.get("humidity"),
+    }
+
+
+def _weather_details(payload):
+    if not payload:
+        return None
+    data = payload["weather"]
+    tz_offset = data.get("timezone")
+    main = data.get("main") or {}
+    wind = data.get("wind") or {}
+    sys = data.get("sys") or {}
+    clouds = data.get("clouds") or {}
+    rain = data.get("rain") or {}
+    snow = data.get("snow") or {}
+    coord = data.get("coord") or {}
+    weather0 = data["weather"][0] or {}
+
+    weather = {
+        # Identity / location
+        "name": data.get("name"),
+        "country": sys.get("country"),
+        "lat": coord.get("lat"),
+        "lon": coord.get("lon"),
+        "timezone_offset": tz_offset,
+        # Conditions
+        "condition": weather0.get("main"),
+        "desc": weather0.get("description"),
+        "icon": weather0.get("icon"),
+        # Temperature
+        "temp": main.get("temp"),
+        "feels": main.get("feels_like"),
+        "temp_min": main.get("temp_min"),
+        "temp_max": main.get("temp_max"),
+        # Atmosphere
+        "humidity": main.get("humidity"),
+        "pressure": main.get("pressure"),
+        "sea_level": main.get("sea_level"),
+        "ground_level": main.get("grnd_level"),
+        "visibility_m": data.get("visibility"),
+        # Wind / clouds / precip
+        "wind_speed": wind.get("speed"),
+        "wind_deg": wind.get("deg"),
+        "wind_dir": _deg_to_compass(wind.get("deg")),
+        "wind_gust": wind.get("gust"),
+        "cloudiness": clouds.get("all"),
+        "rain_1h": rain.get("1h"),
+        "rain_3h": rain.get("3h"),
+        "snow_1h": snow.get("1h"),
+        "snow_3h": snow.get("3h"),
+        # Sun / time
+        "observed_at": _fmt_local_time(data.get("dt"), tz_offset),
+        "sunrise": _fmt_local_time(sys.get("sunrise"), tz_offset),
+        "sunset": _fmt_local_time(sys.get("sunset"), tz_offset),
+    }
+
+    # Optional: Air Quality (AQI + pollutants)
+    aq_data = payload.get("air")
+    if aq_data:
+        aqi0 = aq_data["list"][0] or {}
+        weather["air"] = {
+            "aqi": (aqi0.get("main") or {}).get("aqi"),
+            "components": aqi0.get("components") or {},
+            "observed_at": _fmt_local_time(aqi0.get("dt"), tz_offset),
+        }
+    return weather
+
+
+sqlite_db = SQLiteManager("database.db", busy_timeout_ms=5000, on_statement=_observe_sqlite)
+
+
 def get_db():
-    conn = sqlite3.connect("database.db")
-    conn.row_factory = sqlite3.Row
-    return conn
+    # The calling thread's connection; released by the request teardown.
+    # Do not close() it.
+    return sqlite_db.get()
+
+
+@app.teardown_appcontext
+def _release_db(exc):
+    sqlite_db.release()
+
+
+# Per worker process; size it so workers x MYSQL_POOL_SIZE stays under the
+# server's max_connections.
+MYSQL_POOL_SIZE = 5
+
+# Sessions run in UTC, so NOW() on the server agrees with the mysql_now()
+# timestamps the outbox writes and with the expiry/retention cutoffs.
+MYSQL_TIME_ZONE = "+00:00"
+
+mysql_pool = MySQLPool(
+    dict(mysql_config, time_zone=MYSQL_TIME_ZONE), size=MYSQL_POOL_SIZE, borrow_timeout=5.0, observe=_observe_mysql
+)
 
 
 def get_mysql():
-    return mysql.connector.connect(**mysql_config)
+    return mysql_pool.connection()
+
+
+# status_server, music and the newest alerts in one round-trip, shared by
+# /monitor, /admin, /user_alert and the live event stream.
+monitor_snapshot = MonitorSnapshot(get_mysql, ttl=3.0)
+
+# -------------------- MYSQL OUTBOX --------------------
+
+# Control writes (status, user alerts, alert deletes and expiries) are queued
+# in database.db and applied to MySQL in the background, so an operator's
+# request never waits on the remote link. Each operation is an apply step
+# for MySQL plus an overlay that shows it on the dashboards while pending.
+
+ALERT_LISTS = {"ai_alert": "ai_alerts", "user_alert": "user_alerts"}
+
+
+def _apply_set_status(cur, args):
+    cur.execute(
+        """
+        INSERT INTO status_server (id, status, last_updated)
+        VALUES (1, %s, %s)
+        ON DUPLICATE KEY UPDATE
+            status=VALUES(status),
+            last_updated=VALUES(last_updated)
+        """,
+        (args["status"], args["last_updated"]),
+    )
+
+
+def _overlay_set_status(state, args):
+    row = dict(state.get("status") or {"id": 1})
+    row.update(status=args["status"], last_updated=parse_mysql_time(args["last_updated"]), pending=True)
+    state["status"] = row
+
+
+def _apply_upsert_user_alert(cur, args):
+    cur.execute(
+        """
+        INSERT INTO user_alert (id, user_id, message, source, last_updated)
+        VALUES (1, %s, %s, %s, %s)
+        ON DUPLICATE KEY UPDATE
+            user_id=VALUES(user_id),
+            message=VALUES(message),
+            source=VALUES(source),
+            last_updated=VALUES(last_updated)
+        """,
+        (args["user_id"], args["message"], args["source"], args["last_updated"]),
+    )
+
+
+def _overlay_upsert_user_alert(state, args):
+    row = {
+        "id": 1,
+        "user_id": args["user_id"],
+        "message": args["message"],
+        "source": args["source"],
+        "last_updated": parse_mysql_time(args["last_updated"]),
+        "pending": True,
+    }
+    state["user_alerts"] = [row] + [u for u in state["user_alerts"] if u.get("id") != 1]
+
+
+def _apply_delete_alerts(cur, args):
+    # ids=None clears the whole table.
+    table, ids = args["table"], args["ids"]
+    if ids is None:
+        cur.execute(f"DELETE FROM {table}")
+    elif ids:
+        placeholders = ", ".join(["%s"] * len(ids))
+        cur.execute(f"DELETE FROM {table} WHERE id IN ({placeholders})", ids)
+
+
+def _overlay_delete_alerts(state, args):
+    key, ids = ALERT_LISTS[args["table"]], args["ids"]
+    if ids is None:
+        state[key] = []
+    else:
+        removed = set(ids)
+        state[key] = [row for row in state[key] if row.get("id") not in removed]
+
+
+def _apply_expire_alerts(cur, args):
+    # Conditional on last_updated so a newer alert written to the same id
+    # after this one was scheduled is left alone.
+    keys = args["keys"]
+    placeholders = ", ".join(["(%s, %s)"] * len(keys))
+    params = [value for key in keys for value in key]
+    cur.execute(f"DELETE FROM {args['table']} WHERE (id, last_updated) IN ({placeholders})", params)
+
+
+def _overlay_expire_alerts(state, args):
+    key = ALERT_LISTS[args["table"]]
+    expired = {(row_id, version) for row_id, version in args["keys"]}
+    state[key] = [row for row in state[key] if (row.get("id"), str(row.get("last_updated"))) not in expired]
+
+
+def _outbox_applied():
+    # Pull the applied rows into the local replica before they leave the
+    # outbox, so offline reads do not briefly lose them.
+    monitor_replica.refresh()
+    _live_changed(mysql=True)
+
+
+mysql_outbox = MySQLOutbox(get_db, get_mysql, batch_size=50, interval=1.0, on_applied=_outbox_applied)
+mysql_outbox.register("set_status", _apply_set_status, _overlay_set_status)
+mysql_outbox.register("upsert_user_alert", _apply_upsert_user_alert, _overlay_upsert_user_alert)
+mysql_outbox.register("delete_alerts", _apply_delete_alerts, _overlay_delete_alerts)
+mysql_outbox.register("expire_alerts", _apply_expire_alerts, _overlay_expire_alerts)
+
+
+# -------------------- MONITOR REPLICA --------------------
+
+# Local copy of the monitor tables, synced in the background; it is what
+# the offline and mix dafetch modes read.
+monitor_replica = MonitorReplica(get_db, get_mysql, interval=10.0)
+
+LIVE_FRESHNESS = {"source": "mysql", "synced_at": None, "age_seconds": 0, "remote_ok": True}
+
+
+def _monitor_state():
+    # online reads MySQL, offline reads the replica, and mix reads MySQL
+    # unless the link is known to be down or the read fails. Each result
+    # carries a "freshness" tag saying which it was, and this site's
+    # not-yet-applied writes are overlaid on top.
+    mode = runtime_settings.get("dafetch_mode")
+    if mode == "offline" or (mode == "mix" and monitor_replica.remote_ok is False):
+        state = monitor_replica.snapshot()
+    elif mode == "mix":
+        try:
+            state = dict(monitor_snapshot.get(), freshness=LIVE_FRESHNESS)
+        except Exception as e:
+            monitor_replica.mark_down(e)
+            state = monitor_replica.snapshot()
+    else:
+        state = dict(monitor_snapshot.get(), freshness=LIVE_FRESHNESS)
+    return mysql_outbox.overlay(state)
+
+
+def _request_idempotency_key():
+    key = (request.headers.get("Idempotency-Key") or "").strip()
+    return key if 0 < len(key) <= outbox.KEY_MAX_LENGTH else None
 
 
 def _pick_winner(votes, field, threshold, fallback_value):
@@ -79,38 +467,43 @@ def _pick_winner(votes, field, threshold, fallback_value):
     return top.get(field) or fallback_value
 
 
-def _get_current_preference(window_minutes=30, threshold=5):
-    conn = get_db()
-    cur = conn.cursor()
+ALLOWED_LANGUAGES = {"any", "english", "malayalam", "tamil"}
+ALLOWED_GENRES = {"romantic", "chill", "happy", "sad", "energetic", "focus", "travel"}
+DAFETCH_MODES = {"online", "offline", "mix"}
 
-    cur.execute(
-        """
-        SELECT language, COUNT(*) as c
-        FROM polls
-        WHERE created_at > datetime('now', ?)
-        GROUP BY language
-        ORDER BY c DESC
-        """,
-        (f"-{int(window_minutes)} minutes",),
-    )
-    lang_votes = [dict(row) for row in cur.fetchall()]
+# Windows whose language x genre matrices are kept up to date incrementally;
+# any other window up to the capacity is summed from minute buckets.
+VOTE_WINDOWS = (5, 30, 60)
 
-    cur.execute(
-        """
-        SELECT genre, COUNT(*) as c
-        FROM polls
-        WHERE created_at > datetime('now', ?)
-        GROUP BY genre
-        ORDER BY c DESC
-        """,
-        (f"-{int(window_minutes)} minutes",),
-    )
-    genre_votes = [dict(row) for row in cur.fetchall()]
+# One sliding window per site; votes are counted towards the site they
+# were cast for.
+vote_tallies = SiteTallies(ALLOWED_LANGUAGES, ALLOWED_GENRES, windows=VOTE_WINDOWS, window_minutes=30, capacity=60)
+
+runtime_settings = RuntimeSettings(sqlite_db.connect, {
+    "dafetch_mode": {"default": "online", "type": str, "choices": DAFETCH_MODES},
+    "poll_window_minutes": {"default": 30, "type": int, "min": 1, "max": vote_tallies.capacity},
+    "poll_threshold": {"default": 5, "type": int, "min": 1},
+    "fallback_language": {"default": "malayalam", "type": str, "choices": ALLOWED_LANGUAGES},
+    "fallback_genre": {"default": "romantic", "type": str, "choices": ALLOWED_GENRES},
+})
+
+
+def _get_current_preference(window_minutes=None, threshold=None, site_id=DEFAULT_SITE_ID):
+    if window_minutes is None:
+        window_minutes = runtime_settings.get("poll_window_minutes")
+    if threshold is None:
+        threshold = runtime_settings.get("poll_threshold")
+
+    # Served from the in-memory sliding window; refresh() only reads rows
+    # inserted by other workers since the last catch-up.
+    vote_tallies.refresh_if_stale(sqlite_db.connect)
+    matrix = vote_tallies.matrix(site_id, window_minutes)
 
-    conn.close()
+    lang_votes = ranked(matrix["language_totals"], "language")
+    genre_votes = ranked(matrix["genre_totals"], "genre")
 
-    language = _pick_winner(lang_votes, "language", threshold, "malayalam")
-    genre = _pick_winner(genre_votes, "genre", threshold, "romantic")
+    language = _pick_winner(lang_votes, "language", threshold, runtime_settings.get("fallback_language"))
+    genre = _pick_winner(genre_votes, "genre", threshold, runtime_settings.get("fallback_genre"))
 
     return {
         "language": language,
@@ -119,11 +512,17 @@ def _get_current_preference(window_minutes=30, threshold=5):
         "genre_votes": genre_votes,
         "window_minutes": window_minutes,
         "threshold": threshold,
+        "matrix": matrix,
+        "site_id": site_id,
     }
 
+
+def _window_totals(site_id=DEFAULT_SITE_ID):
+    return {w: sum(vote_tallies.cells(site_id, w)) for w in VOTE_WINDOWS}
+
 # -------------------- CREATE TABLES --------------------
 
-with get_db() as db:
+with sqlite_db.connect() as db:
     # Users table (already exists)
     db.execute("""
     CREATE TABLE IF NOT EXISTS users (
@@ -134,7 +533,7 @@ with get_db() as db:
     )
     """)
 
-    # Location table (single row system config)
+    # Location table (one row per transmitter site)
     db.execute("""
     CREATE TABLE IF NOT EXISTS location (
         id INTEGER PRIMARY KEY,
@@ -154,8 +553,74 @@ with get_db() as db:
     )
     """)
 
- # --- DAFETCH MODE GLOBAL ---
-dafetch_mode = "online"  # default
+    compaction.ensure_schema(db)
+    settings.ensure_schema(db)
+    geocode.ensure_schema(db)
+    outbox.ensure_schema(db)
+    replica.ensure_schema(db)
+    sites.ensure_schema(db)
+    vote_tallies.rebuild(db)
+db.close()
+
+poll_compactor = PollCompactor(sqlite_db.connect, horizon_minutes=24 * 60, interval_seconds=3600)
+
+
+# Transmitter sites; receivers and voters are matched to the nearest one.
+site_index = SiteIndex(get_db, cell_degrees=1.0, check_interval=1.0)
+
+
+def _on_vote_insert(row_id, site_id, language, genre, ts):
+    vote_tallies.record(row_id, site_id, language, genre, ts)
+    databack_snapshots.invalidate(site_id)
+    live_events.poke()
+
+
+# Set to True to make every /vote wait for its commit (clients can also
+# opt in per request with sync=1).
+VOTE_SYNC_DURABILITY = False
+
+vote_ingestor = VoteIngestor(
+    sqlite_db.connect,
+    on_insert=_on_vote_insert,
+    max_queue=10000,
+    flush_interval_ms=50,
+    flush_batch=500,
+    sync_durability=VOTE_SYNC_DURABILITY,
+)
+
+# Admission runs before a vote is queued: each client gets a token bucket
+# and one counted vote per site per poll window.
+vote_admission = VoteAdmission(rate=0.2, burst=5, max_clients=100000)
+
+
+def _vote_client(user, address):
+    return f"user:{user}" if user else f"ip:{address}"
+
+
+# Both run before any SQLite work, so a flood is turned away from memory.
+
+def _throttle_vote(client):
+    """None if the client may vote now, else (status, message, retry_after)."""
+    if vote_admission.take(client) == admission.THROTTLED:
+        return 429, "too many votes, try again later", vote_admission.retry_after(client)
+    return None
+
+
+def _claim_vote(client, site_id):
+    """None if the vote may be queued, else (status, message, retry_after)."""
+    window = runtime_settings.cached("poll_window_minutes") * 60
+    if vote_admission.claim(client, site_id, window) == admission.DUPLICATE:
+        return 409, "already voted in this window", None
+    return None
+
+
+@app.before_request
+def _start_background_jobs():
+    poll_compactor.start()
+    vote_ingestor.start()
+    # Picks up writes left queued by a previous run.
+    mysql_outbox.start()
+    monitor_replica.start()
 
 # -------------------- DAFETCH MODE SETTER --------------------
 @app.route("/monitor/dafetch_mode", methods=["POST"])
@@ -164,13 +629,44 @@ def monitor_set_dafetch_mode():
         return redirect("/monitor")
 
     mode = (request.form.get("dafetch_mode") or "").strip().lower()
-    allowed = {"online", "offline", "mix"}
-    if mode not in allowed:
+    if mode not in DAFETCH_MODES:
         return redirect("/monitor")
 
-    global dafetch_mode
-    dafetch_mode = mode
+    _set_dafetch_mode(mode)
     return redirect("/monitor")
+
+
+def _set_dafetch_mode(mode):
+    runtime_settings.set("dafetch_mode", mode)
+    databack_snapshots.invalidate()
+    _live_changed()
+
+
+# -------------------- RUNTIME SETTINGS --------------------
+@app.route("/admin/settings", methods=["GET", "POST"])
+def admin_settings():
+    if session.get("role") != "admin":
+        return redirect("/")
+
+    if request.method == "POST":
+        updates = request.get_json(silent=True) or request.form.to_dict()
+        if not isinstance(updates, dict):
+            return jsonify({"status": "error", "message": "expected an object of setting: value"}), 400
+        try:
+            # Validate everything before writing anything.
+            for key, value in updates.items():
+                runtime_settings.validate(key, value)
+        except KeyError as e:
+            return jsonify({"status": "error", "message": f"unknown setting {e}"}), 400
+        except ValueError as e:
+            return jsonify({"status": "error", "message": str(e)}), 400
+        for key, value in updates.items():
+            runtime_settings.set(key, value)
+        databack_snapshots.invalidate()
+        _live_changed()
+
+    return jsonify({"status": "ok", "settings": runtime_settings.all()})
+
 # -------------------- AUTH --------------------
 
 @app.route("/", methods=["GET", "POST"])
@@ -223,8 +719,15 @@ def register():
 def dashboard():
     if "user" not in session:
         return redirect("/")
-    current_pref = _get_current_preference()
-    return render_template("dashboard.html", user=session["user"], current_pref=current_pref)
+    site = site_index.get(request.args.get("site", type=int)) or site_index.default()
+    current_pref = _get_current_preference(site_id=site.id if site else DEFAULT_SITE_ID)
+    return render_template(
+        "dashboard.html",
+        user=session["user"],
+        current_pref=current_pref,
+        site=site,
+        sites=site_index.all(),
+    )
 
 
 @app.route("/admin")
@@ -235,129 +738,517 @@ def admin():
     db = get_db()
     users = db.execute("SELECT username, role FROM users").fetchall()
 
-    # Location preview (SQLite)
-    loc = db.execute("SELECT * FROM location WHERE id=1").fetchone()
+    # Location preview (SQLite); ?site= picks which one
+    loc = site_index.get(request.args.get("site", type=int)) or site_index.default()
+    site_id = loc.id if loc else DEFAULT_SITE_ID
 
     # Weather preview (OWM)
     weather = None
     if loc and loc[2] is not None and loc[3] is not None:
-        lat = loc[2]
-        lon = loc[3]
-        url = (
-            "https://api.openweathermap.org/data/2.5/weather"
-            f"?lat={lat}&lon={lon}&appid={OWM_KEY}&units=metric"
-        )
-        try:
-            res = requests.get(url, timeout=8)
-            data = res.json()
-            if res.ok and "main" in data and "weather" in data and data["weather"]:
-                w0 = data["weather"][0] or {}
-                main = data.get("main") or {}
-                weather = {
-                    "name": data.get("name"),
-                    "desc": w0.get("description"),
-                    "icon": w0.get("icon"),
-                    "temp": main.get("temp"),
-                    "feels": main.get("feels_like"),
-                    "humidity": main.get("humidity"),
-                }
-        except Exception:
-            weather = None
-    current_pref = _get_current_preference()
+        weather = _weather_summary(weather_service.current(loc[2], loc[3]))
+    current_pref = _get_current_preference(site_id=site_id)
 
     # Monitor preview (MySQL)
     status = None
     last_ai = None
     last_user = None
     try:
-        conn = get_mysql()
-        cur = conn.cursor(dictionary=True)
-        cur.execute("SELECT * FROM status_server WHERE id=1")
-        status = cur.fetchone()
-        cur.execute("SELECT * FROM ai_alert ORDER BY last_updated DESC LIMIT 1")
-        last_ai = cur.fetchone()
-        cur.execute("SELECT * FROM user_alert ORDER BY last_updated DESC LIMIT 1")
-        last_user = cur.fetchone()
-        conn.close()
+        snap = _monitor_state()
+        status = snap["status"]
+        last_ai = snap["ai_alerts"][0] if snap["ai_alerts"] else None
+        last_user = snap["user_alerts"][0] if snap["user_alerts"] else None
     except Exception:
         status = None
         last_ai = None
         last_user = None
 
-    # Get live vote results (grouped by language and genre, with counts)
-    db2 = get_db()
-    vote_results = db2.execute(
-        """
-        SELECT language, genre, COUNT(*) as count
-        FROM polls
-        WHERE created_at > datetime('now', ?)
-        GROUP BY language, genre
-        ORDER BY count DESC
-        """,
-        (f"-{current_pref['window_minutes']} minutes",)
-    ).fetchall()
-    db2.close()
+    # Live vote results: every non-empty cell of the window's matrix
+    matrix = current_pref["matrix"]
+    vote_results = sorted(
+        (
+            {"language": language, "genre": genre, "count": count}
+            for language, row in zip(matrix["languages"], matrix["counts"])
+            for genre, count in zip(matrix["genres"], row)
+            if count
+        ),
+        key=lambda r: r["count"],
+        reverse=True,
+    )
 
     return render_template(
         "admin.html",
         users=users,
         loc=loc,
+        sites=site_index.all(),
         weather=weather,
         status=status,
         last_ai=last_ai,
         last_user=last_user,
         current_pref=current_pref,
         vote_results=vote_results,
+        vote_matrix=matrix,
+        window_totals=_window_totals(site_id),
+        compaction=poll_compactor.last_report,
+        outbox=mysql_outbox.stats(),
+    )
+
+
+@app.route("/admin/stats")
+def admin_stats():
+    if session.get("role") != "admin":
+        return redirect("/")
+
+    return jsonify({
+        "compaction": poll_compactor.last_report,
+        "vote_ingest": vote_ingestor.stats(),
+        "vote_admission": vote_admission.stats(),
+        "mysql_pool": mysql_pool.stats(),
+        "weather": weather_service.stats(),
+        "sites": site_index.stats(),
+        "databack": {
+            site_id: {"version": snapshot.version, "rebuilds": snapshot.rebuilds}
+            for site_id, snapshot in databack_snapshots.items()
+        },
+        "live_events": live_events.stats(),
+        "settings": runtime_settings.stats(),
+        "alert_expiry": alert_expiry.stats(),
+        "sqlite": sqlite_db.stats(),
+        "monitor_snapshot": monitor_snapshot.stats(),
+        "geocode": geocoder.stats(),
+        "transliteration": transliterator.stats(),
+        "assets": asset_bundler.stats(),
+        "compression": compress_response.stats(),
+        "mysql_outbox": mysql_outbox.stats(),
+        "monitor_replica": monitor_replica.stats(),
+        "sync": {site_id: snapshot.stats() for site_id, snapshot in sync_snapshots.items()},
+        "vote_history": trend_reader.stats(),
+    })
+
+
+@metrics.collect
+def _component_metrics():
+    ingest = vote_ingestor.stats()
+    admitted = vote_admission.stats()
+    db = sqlite_db.stats()
+    pool = mysql_pool.stats()
+    queued = mysql_outbox.stats()
+    mirror = monitor_replica.stats()
+    return (
+        gauge_lines("radio_votes_total", "Votes by ingest outcome.", [
+            ({"outcome": key}, ingest[key]) for key in ("accepted", "rejected", "written", "dropped")
+        ], kind="counter")
+        + gauge_lines("radio_vote_admission_total", "Votes by admission outcome.", [
+            ({"outcome": "accepted"}, admitted["accepted"]),
+            ({"outcome": "throttled"}, admitted["throttled"]),
+            ({"outcome": "duplicate"}, admitted["duplicates"]),
+        ], kind="counter")
+        + gauge_lines("radio_vote_admission_clients", "Clients tracked by vote admission.", [
+            ({}, admitted["clients"])
+        ])
+        + gauge_lines("radio_vote_queue_depth", "Votes waiting for the writer.", [({}, ingest["queue_depth"])])
+        + gauge_lines("radio_vote_flushes_total", "Vote writer group commits.", [({}, ingest["batches"])], kind="counter")
+        + gauge_lines("radio_sqlite_opens_total", "SQLite connections opened.", [({}, db["opens"])], kind="counter")
+        + gauge_lines("radio_sqlite_lock_waits_total", "Writes that waited for the SQLite write lock.", [
+            ({}, db["lock_waits"])
+        ], kind="counter")
+        + gauge_lines("radio_mysql_pool_in_use", "Borrowed MySQL connections.", [({}, pool["in_use"])])
+        + gauge_lines("radio_mysql_outbox_depth", "Control writes waiting for MySQL.", [({}, queued["depth"])])
+        + gauge_lines("radio_mysql_outbox_lag_seconds", "Age of the oldest queued control write.", [
+            ({}, queued["lag_seconds"])
+        ])
+        + gauge_lines("radio_mysql_outbox_applied_total", "Control writes applied to MySQL.", [
+            ({}, queued["applied"])
+        ], kind="counter")
+        + gauge_lines("radio_mysql_outbox_dead", "Control writes parked after repeated row errors.", [
+            ({}, queued["dead"])
+        ])
+        + gauge_lines("radio_monitor_replica_age_seconds", "Seconds since the monitor replica last synced.", [
+            ({}, mirror["age_seconds"])
+        ] if mirror["age_seconds"] is not None else [])
     )
 
+
+def _metrics_token_ok():
+    scheme, _, token = (request.headers.get("Authorization") or "").partition(" ")
+    if not METRICS_TOKEN or scheme.lower() != "bearer":
+        return False
+    return hmac.compare_digest(token.strip().encode(), METRICS_TOKEN.encode())
+
+
+@app.route("/metrics")
+def metrics_endpoint():
+    if session.get("role") != "admin" and not _metrics_token_ok():
+        return redirect("/")
+    return Response(metrics.render(), content_type="text/plain; version=0.0.4; charset=utf-8")
+
+
+@app.route("/admin/compact", methods=["POST"])
+def admin_compact():
+    if session.get("role") != "admin":
+        return redirect("/")
+
+    try:
+        report = poll_compactor.run()
+    except Exception as e:
+        return jsonify({"status": "error", "message": str(e)}), 500
+
+    if "text/html" in (request.headers.get("Accept") or ""):
+        return redirect("/admin")
+
+    return jsonify({"status": "ok", **report})
+
+
+@app.route("/admin/mysql_indexes", methods=["POST"])
+def admin_mysql_indexes():
+    if session.get("role") != "admin":
+        return redirect("/")
+
+    try:
+        with get_mysql() as conn:
+            created = monitor_data.ensure_indexes(conn)
+    except Exception as e:
+        return jsonify({"status": "error", "message": str(e)}), 500
+
+    if "text/html" in (request.headers.get("Accept") or ""):
+        return redirect("/admin")
+
+    return jsonify({"status": "ok", "created": created})
+
+
+# -------------------- VOTE HISTORY --------------------
+
+# Streams read on their own connections, a slice at a time; two per worker
+# at most so exports cannot crowd out page renders.
+trend_reader = TrendReader(sqlite_db.connect, chunk_size=1000, export_page=5000, max_streams=2)
+
+HISTORY_FORMATS = {"ndjson": "application/x-ndjson", "csv": "text/csv"}
+
+
+def _history_range(default_span):
+    until = parse_time(request.args["until"]) if request.args.get("until") else utcnow()
+    since = parse_time(request.args["since"]) if request.args.get("since") else until - default_span
+    if since >= until:
+        raise ValueError("since must be before until")
+    return since, until
+
+
+def _history_response(rows, fields, fmt, filename):
+    body = encode_csv(rows, fields) if fmt == "csv" else encode_ndjson(rows)
+    response = Response(stream_with_context(body), mimetype=HISTORY_FORMATS[fmt])
+    # Runs however the response ends, even if the body was never started.
+    response.call_on_close(trend_reader.release)
+    response.headers["Content-Disposition"] = f'attachment; filename="{filename}.{fmt}"'
+    response.headers["Cache-Control"] = "no-store"
+    return response
+
+
+def _history_busy():
+    response = jsonify({"status": "error", "message": "too many exports running, try again shortly"})
+    response.headers["Retry-After"] = "5"
+    return response, 429
+
+
+@app.route("/admin/trends")
+def admin_trends():
+    if session.get("role") != "admin":
+        return redirect("/")
+
+    bucket = request.args.get("bucket", "hour")
+    grouping = request.args.get("by", "cell")
+    fmt = request.args.get("format", "ndjson")
+    if bucket not in BUCKETS or grouping not in GROUPINGS or fmt not in HISTORY_FORMATS:
+        return jsonify({
+            "status": "error",
+            "message": f"bucket must be one of {sorted(BUCKETS)}, by one of {sorted(GROUPINGS)}, "
+                       f"format one of {sorted(HISTORY_FORMATS)}",
+        }), 400
+    try:
+        since, until = _history_range(DEFAULT_SPANS[bucket])
+    except ValueError as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
+
+    if not trend_reader.acquire():
+        return _history_busy()
+    fields = ("bucket",) + GROUPINGS[grouping] + ("count",)
+    rows = trend_reader.trends(bucket, since, until, grouping)
+    return _history_response(rows, fields, fmt, f"trends-{bucket}-{since:%Y%m%d}-{until:%Y%m%d}")
+
+
+@app.route("/admin/export")
+def admin_export():
+    if session.get("role") != "admin":
+        return redirect("/")
+
+    # Raw votes only reach back to the compaction horizon; older history
+    # is in the hourly trends.
+    fmt = request.args.get("format", "ndjson")
+    if fmt not in HISTORY_FORMATS:
+        return jsonify({"status": "error", "message": f"format must be one of {sorted(HISTORY_FORMATS)}"}), 400
+    try:
+        since, until = _history_range(timedelta(minutes=poll_compactor.horizon_minutes))
+    except ValueError as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
+
+    if not trend_reader.acquire():
+        return _history_busy()
+    rows = trend_reader.export(since, until)
+    return _history_response(rows, EXPORT_FIELDS, fmt, f"votes-{since:%Y%m%d%H%M}-{until:%Y%m%d%H%M}")
+
+
 @app.route("/vote", methods=["POST"])
 def vote():
     language = (request.form.get("language") or "").strip().lower()
     genre = (request.form.get("genre") or "").strip().lower()
 
-    allowed_languages = {"any", "english", "malayalam", "tamil"}
-    allowed_genres = {"romantic", "chill", "happy", "sad", "energetic", "focus", "travel"}
-
-    if language not in allowed_languages or genre not in allowed_genres:
+    if language not in ALLOWED_LANGUAGES or genre not in ALLOWED_GENRES:
         return jsonify({"status": "error", "message": "invalid vote"}), 400
-
-    conn = get_db()
-    cur = conn.cursor()
-    cur.execute(
-        "INSERT INTO polls (language, genre) VALUES (?, ?)",
-        (language, genre),
-    )
-    conn.commit()
-    conn.close()
+    try:
+        site_args = _site_args(request.values.get)
+    except ValueError as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
+
+    client = _vote_client(session.get("user"), request.remote_addr)
+    rejected = _throttle_vote(client)
+    if rejected is None:
+        site_id = _resolve_site_id(*site_args)
+        if site_id is None:
+            return jsonify({"status": "error", "message": "unknown site"}), 404
+        rejected = _claim_vote(client, site_id)
+    if rejected is not None:
+        status, message, retry_after = rejected
+        response = jsonify({"status": "error", "message": message})
+        if retry_after is not None:
+            response.headers["Retry-After"] = str(max(1, int(retry_after + 0.999)))
+        return response, status
+
+    sync = request.values.get("sync") in ("1", "true", "yes")
+    try:
+        queued = vote_ingestor.submit(language, genre, sync=sync or None, site_id=site_id)
+    except TimeoutError as e:
+        return jsonify({"status": "error", "message": f"vote not saved: {e}"}), 503
+    except Exception as e:
+        vote_admission.release(client, site_id)
+        return jsonify({"status": "error", "message": f"vote not saved: {e}"}), 503
+    if not queued:
+        vote_admission.release(client, site_id)
+        return jsonify({"status": "error", "message": "busy, try again"}), 503
 
     if "text/html" in (request.headers.get("Accept") or ""):
-        return redirect("/dashboard")
+        return redirect(f"/dashboard?site={site_id}")
 
-    return jsonify({"status": "ok"})
+    return jsonify({"status": "ok", "site_id": site_id})
 
-@app.route("/databack")
-def databack():
-    conn = get_db()
-    cur = conn.cursor()
-    cur.execute("SELECT * FROM location WHERE id=1")
-    loc = cur.fetchone()
-    conn.close()
 
-    current_pref = _get_current_preference()
+def _resolve_site_id(site_id=None, lat=None, lon=None):
+    """Site id for an explicit id (None if it does not exist), else the
+    site nearest to lat/lon, else the default site."""
+    if site_id is not None:
+        return site_id if site_index.get(site_id) is not None else None
+    site = site_index.resolve(lat=lat, lon=lon)
+    return site.id if site is not None else DEFAULT_SITE_ID
+
+
+def _site_args(get):
+    """(site, lat, lon) read through get(name), None where missing.
+
+    Raises ValueError when one is given but malformed, rather than falling
+    back to the default site.
+    """
+    args = []
+    for name, cast in (("site", int), ("lat", float), ("lon", float)):
+        raw = get(name)
+        if raw is None or raw == "":
+            args.append(None)
+            continue
+        try:
+            args.append(cast(raw))
+        except ValueError:
+            raise ValueError(f"invalid {name} {raw!r}")
+    return tuple(args)
+
+
+def _request_site_id():
+    return _resolve_site_id(*_site_args(request.values.get))
+
+
+def _databack_payload(site_id=DEFAULT_SITE_ID):
+    loc = site_index.get(site_id)
+
+    current_pref = _get_current_preference(site_id=site_id)
 
     latitude = loc[2] if loc else None
     longitude = loc[3] if loc else None
     placename = loc[1] if loc else None
 
-    global dafetch_mode
-    return jsonify({
+    return {
+        "site_id": site_id,
         "latitude": latitude,
         "longitude": longitude,
         "placename": placename,
         "language": current_pref["language"],
         "genre": current_pref["genre"],
-        "dafetch_mode": dafetch_mode,
-    })
+        "dafetch_mode": runtime_settings.get("dafetch_mode"),
+    }
+
+
+# One snapshot per site. Receivers pass ?site=<id>, or ?lat=&lon= to be
+# served by the nearest site; neither means the default site.
+databack_snapshots = SnapshotGroup(
+    lambda site_id: VersionedSnapshot(lambda: _databack_payload(site_id), max_age=1.0)
+)
+
+DATABACK_MAX_WAIT = 60
+
+
+@app.route("/databack")
+def databack():
+    try:
+        site_id = _request_site_id()
+    except ValueError as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
+    if site_id is None:
+        return jsonify({"status": "error", "message": "unknown site"}), 404
+    snapshot = databack_snapshots[site_id]
+    since = request.args.get("since", type=int)
+    wait = request.args.get("wait", type=float)
+    if wait and since is not None:
+        with metrics.waiting():
+            body, etag, version = snapshot.wait_for_change(
+                since, min(max(wait, 0), DATABACK_MAX_WAIT)
+            )
+    else:
+        body, etag, version = snapshot.get()
+
+    if etag in request.if_none_match or (since is not None and version <= since):
+        response = Response(status=304)
+    else:
+        response = Response(body, mimetype="application/json")
+    response.set_etag(etag)
+    response.headers["X-Data-Version"] = str(version)
+    response.headers["X-Site-Id"] = str(site_id)
+    response.headers["Cache-Control"] = "no-cache"
+    return response
+
+# -------------------- RECEIVER SYNC --------------------
+
+def _sync_sections(site_id=DEFAULT_SITE_ID):
+    # Everything a receiver needs in offline/mix mode. A section whose
+    # source fails is left out and keeps its last value.
+    config = _databack_payload(site_id)
+    sections = {"config": config}
+    if config["latitude"] is not None and config["longitude"] is not None:
+        try:
+            sections["weather"] = _weather_details(weather_service.current(config["latitude"], config["longitude"]))
+        except Exception as e:
+            print(f"Sync bundle without weather: {e}")
+    try:
+        snap = _monitor_state()
+        sections["status"] = snap["status"]
+        sections["music"] = snap["music"]
+        sections["user_alert"] = snap["user_alerts"][0] if snap["user_alerts"] else None
+    except Exception as e:
+        print(f"Sync bundle without monitor data: {e}")
+    return sections
+
+
+sync_snapshots = SnapshotGroup(
+    lambda site_id: SectionedSnapshot(lambda: _sync_sections(site_id), max_age=2.0, gzip_min_size=512)
+)
+databack_snapshots.listeners.append(sync_snapshots.invalidate)
+
+
+@app.route("/sync")
+def sync():
+    try:
+        site_id = _request_site_id()
+    except ValueError as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
+    if site_id is None:
+        return jsonify({"status": "error", "message": "unknown site"}), 404
+    since = request.args.get("since", type=int)
+    encoding = (request.args.get("format") or "").strip().lower()
+    if not encoding:
+        wants_msgpack = "msgpack" in (request.headers.get("Accept") or "")
+        encoding = "msgpack" if wants_msgpack and "msgpack" in ENCODINGS else "json"
+    if encoding not in ENCODINGS:
+        return jsonify({"status": "error", "message": f"format must be one of {sorted(ENCODINGS)}"}), 406
+
+    body, version, names, gzipped = sync_snapshots[site_id].delta(
+        since, encoding, accepts(request.headers.get("Accept-Encoding"), "gzip")
+    )
+    if body is None:
+        response = Response(status=304)
+    else:
+        response = Response(body, mimetype=ENCODINGS[encoding][0])
+        if gzipped:
+            response.headers["Content-Encoding"] = "gzip"
+    response.vary.add("Accept-Encoding")
+    response.headers["X-Data-Version"] = str(version)
+    response.headers["X-Sync-Sections"] = ",".join(names)
+    response.headers["X-Site-Id"] = str(site_id)
+    response.headers["Cache-Control"] = "no-cache"
+    return response
+
+# -------------------- LIVE EVENTS --------------------
+
+def _collect_live_state():
+    current_pref = _get_current_preference()
+    state = {
+        "votes": {
+            "language": current_pref["language"],
+            "genre": current_pref["genre"],
+            "lang_votes": current_pref["lang_votes"],
+            "genre_votes": current_pref["genre_votes"],
+            "counts": current_pref["matrix"]["counts"],
+            "window_totals": _window_totals(),
+        },
+        "dafetch_mode": runtime_settings.get("dafetch_mode"),
+    }
+
+    # MySQL-backed topics come from the shared monitor snapshot, so however
+    # many votes wake the detector they cost at most one round-trip per TTL.
+    try:
+        snap = _monitor_state()
+        state.update({
+            "status": snap["status"],
+            "ai_alert": snap["ai_alerts"],
+            "user_alert": snap["user_alerts"],
+            "freshness": {key: snap["freshness"][key] for key in ("source", "synced_at", "remote_ok")},
+        })
+    except Exception:
+        pass
+    return state
+
+
+live_events = ChangeDetector(_collect_live_state, interval=3.0)
+EVENTS_POLL_MS = 5000
+
+
+def _live_changed(mysql=False):
+    if mysql:
+        monitor_snapshot.invalidate()
+    sync_snapshots.invalidate()
+    live_events.poke()
+
+
+@app.route("/events")
+def events():
+    if session.get("role") != "admin":
+        return redirect("/")
+
+    # A sync worker (gunicorn's default) serves one request at a time, so
+    # an open stream per tab would stall the site; there each connection
+    # gets the snapshot and ends, and the browser polls every
+    # EVENTS_POLL_MS instead. Threaded, gevent and ASGI servers stream.
+    if request.environ.get("wsgi.multithread"):
+        body = live_events.stream()
+    else:
+        body = live_events.poll(EVENTS_POLL_MS)
+    return Response(
+        stream_with_context(body),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
 
 # -------------------- LOCATION SYSTEM --------------------
 
@@ -366,141 +1257,117 @@ def location_page():
     if session.get("role") != "admin":
         return redirect("/")
 
-    db = get_db()
-    loc = db.execute("SELECT * FROM location WHERE id=1").fetchone()
+    # ?site=<id> edits that site, ?site=new adds one.
+    if request.args.get("site") == "new":
+        loc = None
+        site_id = ""
+    else:
+        loc = site_index.get(request.args.get("site", type=int)) or site_index.default()
+        site_id = loc.id if loc else DEFAULT_SITE_ID
 
     weather = None
     if loc and loc[2] is not None and loc[3] is not None:
-        lat = loc[2]
-        lon = loc[3]
-        url = (
-            "https://api.openweathermap.org/data/2.5/weather"
-            f"?lat={lat}&lon={lon}&appid={OWM_KEY}&units=metric"
-        )
-        try:
-            res = requests.get(url, timeout=8)
-            data = res.json()
-
-            if res.ok and "main" in data and "weather" in data and data["weather"]:
-                tz_offset = data.get("timezone")
-                main = data.get("main") or {}
-                wind = data.get("wind") or {}
-                sys = data.get("sys") or {}
-                clouds = data.get("clouds") or {}
-                rain = data.get("rain") or {}
-                snow = data.get("snow") or {}
-                coord = data.get("coord") or {}
-                weather0 = data["weather"][0] or {}
-
-                weather = {
-                    # Identity / location
-                    "name": data.get("name"),
-                    "country": sys.get("country"),
-                    "lat": coord.get("lat"),
-                    "lon": coord.get("lon"),
-                    "timezone_offset": tz_offset,
-                    # Conditions
-                    "condition": weather0.get("main"),
-                    "desc": weather0.get("description"),
-                    "icon": weather0.get("icon"),
-                    # Temperature
-                    "temp": main.get("temp"),
-                    "feels": main.get("feels_like"),
-                    "temp_min": main.get("temp_min"),
-                    "temp_max": main.get("temp_max"),
-                    # Atmosphere
-                    "humidity": main.get("humidity"),
-                    "pressure": main.get("pressure"),
-                    "sea_level": main.get("sea_level"),
-                    "ground_level": main.get("grnd_level"),
-                    "visibility_m": data.get("visibility"),
-                    # Wind / clouds / precip
-                    "wind_speed": wind.get("speed"),
-                    "wind_deg": wind.get("deg"),
-                    "wind_dir": _deg_to_compass(wind.get("deg")),
-                    "wind_gust": wind.get("gust"),
-                    "cloudiness": clouds.get("all"),
-                    "rain_1h": rain.get("1h"),
-                    "rain_3h": rain.get("3h"),
-                    "snow_1h": snow.get("1h"),
-                    "snow_3h": snow.get("3h"),
-                    # Sun / time
-                    "observed_at": _fmt_local_time(data.get("dt"), tz_offset),
-                    "sunrise": _fmt_local_time(sys.get("sunrise"), tz_offset),
-                    "sunset": _fmt_local_time(sys.get("sunset"), tz_offset),
-                }
-
-                # Optional: Air Quality (AQI + pollutants)
-                try:
-                    aq_url = (
-                        "https://api.openweathermap.org/data/2.5/air_pollution"
-                        f"?lat={lat}&lon={lon}&appid={OWM_KEY}"
-                    )
-                    aq_res = requests.get(aq_url, timeout=8)
-                    aq_data = aq_res.json()
-                    if aq_res.ok and (aq_data.get("list") or []):
-                        aqi0 = aq_data["list"][0] or {}
-                        weather["air"] = {
-                            "aqi": (aqi0.get("main") or {}).get("aqi"),
-                            "components": aqi0.get("components") or {},
-                            "observed_at": _fmt_local_time(aqi0.get("dt"), tz_offset),
-                        }
-                except Exception:
-                    pass
-        except Exception:
-            weather = None
+        weather = _weather_details(weather_service.current(loc[2], loc[3]))
 
     return render_template(
         "location.html",
         loc=loc,
+        site_id=site_id,
+        sites=site_index.all(),
         weather=weather,
-        locationiq_key=LOCATIONIQ_KEY,
     )
 
-@app.route("/monitor")
-def monitor():
+
+# Operator searches are served from the persistent cache; at most
+# `rate` LocationIQ calls per second leave this process.
+geocoder = Geocoder(LOCATIONIQ_KEY, get_db, rate=2.0, burst=4, observe=_upstream_observer("locationiq"))
+
+
+def _geocode_response(lookup, *args):
+    try:
+        result = lookup(*args)
+    except RateLimited as e:
+        return jsonify({"error": str(e)}), 429
+    except UpstreamError as e:
+        return jsonify({"error": f"geocoding failed: {e}"}), 502
+    if result is None:
+        return jsonify({"error": "Unable to geocode"}), 404
+    return jsonify(result)
+
+
+@app.route("/geocode")
+def geocode_search():
     if session.get("role") != "admin":
         return redirect("/")
 
-    conn = get_mysql()
-    cur = conn.cursor(dictionary=True)
+    query = (request.args.get("q") or "").strip()
+    if not query or len(query) > 200:
+        return jsonify({"error": "missing or invalid query"}), 400
+    return _geocode_response(geocoder.search, query)
 
-    # Status
-    cur.execute("SELECT * FROM status_server WHERE id=1")
-    status = cur.fetchone()
 
-    # Music
-    cur.execute("SELECT * FROM music WHERE id=1")
-    music = cur.fetchone()
+@app.route("/reverse_geocode")
+def reverse_geocode():
+    if session.get("role") != "admin":
+        return redirect("/")
 
-    # AI Alerts
-    cur.execute("SELECT * FROM ai_alert ORDER BY last_updated DESC LIMIT 5")
-    ai_alerts = cur.fetchall()
+    lat = request.args.get("lat", type=float)
+    lon = request.args.get("lon", type=float)
+    if lat is None or lon is None or not (-90 <= lat <= 90 and -180 <= lon <= 180):
+        return jsonify({"error": "invalid coordinates"}), 400
+    return _geocode_response(geocoder.reverse, lat, lon)
 
-    # User Alerts
-    cur.execute("SELECT * FROM user_alert ORDER BY last_updated DESC LIMIT 10")
-    user_alerts = cur.fetchall()
+@app.route("/monitor")
+def monitor():
+    if session.get("role") != "admin":
+        return redirect("/")
 
-    conn.close()
+    snap = _monitor_state()
 
-    global dafetch_mode
     return render_template(
         "monitor.html",
-        status=status,
-        music=music,
-        ai_alerts=ai_alerts,
-        user_alerts=user_alerts,
-        dafetch_mode=dafetch_mode
+        status=snap["status"],
+        music=snap["music"],
+        ai_alerts=snap["ai_alerts"][:5],
+        user_alerts=snap["user_alerts"][:10],
+        dafetch_mode=runtime_settings.get("dafetch_mode"),
+        freshness=snap["freshness"],
     )
 
+# Seconds a broadcast user alert stays live; a form can ask for its own
+# `ttl` up to USER_ALERT_MAX_TTL.
+USER_ALERT_TTL = 5
+USER_ALERT_MAX_TTL = 3600
+
+
+def _expire_alerts(table, keys):
+    # Queued behind the write that created the alert, so it cannot reach
+    # MySQL first even while the outbox is backed up.
+    mysql_outbox.enqueue("expire_alerts", {"table": table, "keys": [list(key) for key in keys]})
+    _live_changed()
+
+
+alert_expiry = ExpiryScheduler(_expire_alerts, batch_window=0.25)
+
+# Announcements that go out over and over; converted once at startup so
+# the first broadcast of the day does not pay for the sanscript import.
+ALERT_WARM_PHRASES = [
+    ("shraddhikkuka", "malayalam"),
+    ("kAlAvasthA munnaRiyippu", "malayalam"),
+    ("shakthamAya mazha", "malayalam"),
+    ("nanni", "malayalam"),
+]
+ALERT_TRANSLIT_BATCH = 100
+
+transliterator = Transliterator(maxsize=2048)
+transliterator.warm(ALERT_WARM_PHRASES)
+
+
 @app.route("/user_alert", methods=["GET", "POST"])
 def user_alert_page():
     if session.get("role") != "admin":
         return redirect("/")
 
-    conn = get_mysql()
-    cur = conn.cursor(dictionary=True)
-
     if request.method == "POST":
         message = (request.form.get("message") or "").strip()
         language = (request.form.get("language") or "").strip()
@@ -508,76 +1375,86 @@ def user_alert_page():
         sender = session.get("user") or "admin"
 
         if message:
-            # Store the message as typed. Preferred language is stored in 'source'.
-            # If 'malayalam' is selected, message should be typed in Malayalam script.
-            # If 'english' is selected, message should be typed in English.
-            cur.execute(
-                """
-                INSERT INTO user_alert (id, user_id, message, last_updated)
-                VALUES (1, %s, %s, NOW())
-                ON DUPLICATE KEY UPDATE
-                    user_id=VALUES(user_id),
-                    message=VALUES(message),
-                    last_updated=VALUES(last_updated)
-                """,
-                (sender, message),
-            )
-            # Store the preferred language in the `source` column
-            cur.execute(
-                "UPDATE user_alert SET source=%s WHERE id=1",
-                (language,),
-            )
-            conn.commit()
-
-            # Start a thread to delete the alert after 5 seconds
-            def delete_user_alert_after_delay():
-                time.sleep(5)
-                try:
-                    conn2 = get_mysql()
-                    cur2 = conn2.cursor()
-                    cur2.execute("DELETE FROM user_alert WHERE id=1")
-                    conn2.commit()
-                    conn2.close()
-                except Exception as e:
-                    print(f"Error deleting user_alert: {e}")
-
-            threading.Thread(target=delete_user_alert_after_delay, daemon=True).start()
-
-    cur.execute("SELECT * FROM user_alert ORDER BY last_updated DESC LIMIT 20")
-    alerts = cur.fetchall()
-    conn.close()
+            # Stored in the script of the selected language (kept in
+            # 'source'): ITRANS typed for a Malayalam alert is converted
+            # to Malayalam script here, so playout never has to.
+            message = transliterator.for_language(message, language)
+            # The write's own timestamp is its version, known before MySQL
+            # has applied it.
+            version = mysql_now()
+            queued = mysql_outbox.enqueue("upsert_user_alert", {
+                "user_id": sender,
+                "message": message,
+                "source": language,
+                "last_updated": version,
+            }, key=_request_idempotency_key())
+            _live_changed()
+
+            # Remove this exact alert once its TTL has passed. A retried
+            # request was not queued again, and its fresh version would
+            # replace the original timer with one that never matches.
+            if queued:
+                ttl = request.form.get("ttl", type=float) or USER_ALERT_TTL
+                ttl = min(max(ttl, 1), USER_ALERT_MAX_TTL)
+                alert_expiry.schedule("user_alert", 1, version, ttl)
+
+    alerts = _monitor_state()["user_alerts"]
 
     from datetime import datetime
     today = datetime.now().strftime('%Y-%m-%d')
     return render_template("user_alert.html", alerts=alerts, today=today)
 
 
+@app.route("/user_alert/transliterate", methods=["POST"])
+def user_alert_transliterate():
+    if session.get("role") != "admin":
+        return redirect("/")
+
+    data = request.get_json(silent=True) or {}
+    language = (data.get("language") or "").strip().lower()
+    texts = data.get("texts")
+    if (
+        not isinstance(texts, list)
+        or len(texts) > ALERT_TRANSLIT_BATCH
+        or not all(isinstance(t, str) and len(t) <= 500 for t in texts)
+    ):
+        return jsonify({"status": "error", "message": f"texts must be up to {ALERT_TRANSLIT_BATCH} strings"}), 400
+    return jsonify({"status": "ok", "language": language, "texts": transliterator.convert_many(texts, language)})
+
+
+# -------------------- MONITOR CONTROLS --------------------
+
+MONITOR_STATUSES = {"net", "freq", "both", "stop"}
+MONITOR_ALERT_TABLES = ("ai_alert", "user_alert")
+# Most alert ids one bulk delete accepts.
+MONITOR_BULK_LIMIT = 500
+
+
+def _set_monitor_status(new_status, key=None):
+    row = {"status": new_status, "last_updated": mysql_now()}
+    mysql_outbox.enqueue("set_status", row, key=key)
+    _live_changed()
+    return row
+
+
+def _delete_alerts(table, ids=None, key=None):
+    # ids=None clears the whole table.
+    if ids is not None and not ids:
+        return
+    mysql_outbox.enqueue("delete_alerts", {"table": table, "ids": ids}, key=key)
+    _live_changed()
+
+
 @app.route("/monitor/status", methods=["POST"])
 def monitor_set_status():
     if session.get("role") != "admin":
         return redirect("/")
 
     new_status = (request.form.get("status") or "").strip().lower()
-    allowed = {"net", "freq", "both", "stop"}
-    if new_status not in allowed:
+    if new_status not in MONITOR_STATUSES:
         return redirect("/monitor")
 
-    conn = get_mysql()
-    cur = conn.cursor()
-    # Ensure row exists (id=1), then update
-    cur.execute(
-        """
-        INSERT INTO status_server (id, status, last_updated)
-        VALUES (1, %s, NOW())
-        ON DUPLICATE KEY UPDATE
-            status=VALUES(status),
-            last_updated=VALUES(last_updated)
-        """,
-        (new_status,),
-    )
-    conn.commit()
-    conn.close()
-
+    _set_monitor_status(new_status)
     return redirect("/monitor")
 
 
@@ -592,11 +1469,7 @@ def monitor_delete_ai_alert():
     except (TypeError, ValueError):
         return redirect("/monitor")
 
-    conn = get_mysql()
-    cur = conn.cursor()
-    cur.execute("DELETE FROM ai_alert WHERE id=%s", (alert_id_int,))
-    conn.commit()
-    conn.close()
+    _delete_alerts("ai_alert", [alert_id_int])
     return redirect("/monitor")
 
 
@@ -605,11 +1478,7 @@ def monitor_clear_ai_alerts():
     if session.get("role") != "admin":
         return redirect("/")
 
-    conn = get_mysql()
-    cur = conn.cursor()
-    cur.execute("DELETE FROM ai_alert")
-    conn.commit()
-    conn.close()
+    _delete_alerts("ai_alert")
     return redirect("/monitor")
 
 
@@ -624,11 +1493,7 @@ def monitor_delete_user_alert():
     except (TypeError, ValueError):
         return redirect("/monitor")
 
-    conn = get_mysql()
-    cur = conn.cursor()
-    cur.execute("DELETE FROM user_alert WHERE id=%s", (alert_id_int,))
-    conn.commit()
-    conn.close()
+    _delete_alerts("user_alert", [alert_id_int])
     return redirect("/monitor")
 
 
@@ -637,39 +1502,116 @@ def monitor_clear_user_alerts():
     if session.get("role") != "admin":
         return redirect("/")
 
-    conn = get_mysql()
-    cur = conn.cursor()
-    cur.execute("DELETE FROM user_alert")
-    conn.commit()
-    conn.close()
+    _delete_alerts("user_alert")
     return redirect("/monitor")
 
 
+# JSON versions of the controls above for the monitor page's scripts. Each
+# answers with just the state it changed, so the page patches itself in
+# place instead of following a redirect into a full re-render. Writes are
+# queued in the MySQL outbox ("pending": true); an Idempotency-Key header
+# makes a retried request a no-op.
+
+@app.route("/monitor/api/status", methods=["POST"])
+def monitor_api_status():
+    if session.get("role") != "admin":
+        return jsonify({"status": "error", "message": "admin session required"}), 403
+
+    data = request.get_json(silent=True) or {}
+    new_status = str(data.get("status") or "").strip().lower()
+    if new_status not in MONITOR_STATUSES:
+        return jsonify({"status": "error", "message": f"status must be one of {sorted(MONITOR_STATUSES)}"}), 400
+
+    row = _set_monitor_status(new_status, key=_request_idempotency_key())
+    return jsonify({"status": "ok", "server_status": row, "pending": True})
+
+
+@app.route("/monitor/api/dafetch_mode", methods=["POST"])
+def monitor_api_dafetch_mode():
+    if session.get("role") != "admin":
+        return jsonify({"status": "error", "message": "admin session required"}), 403
+
+    data = request.get_json(silent=True) or {}
+    mode = str(data.get("dafetch_mode") or "").strip().lower()
+    if mode not in DAFETCH_MODES:
+        return jsonify({"status": "error", "message": f"dafetch_mode must be one of {sorted(DAFETCH_MODES)}"}), 400
+
+    _set_dafetch_mode(mode)
+    return jsonify({"status": "ok", "dafetch_mode": mode})
+
+
+@app.route("/monitor/api/<table>/delete", methods=["POST"])
+def monitor_api_delete_alerts(table):
+    if session.get("role") != "admin":
+        return jsonify({"status": "error", "message": "admin session required"}), 403
+    if table not in MONITOR_ALERT_TABLES:
+        return jsonify({"status": "error", "message": "unknown alert table"}), 404
+
+    data = request.get_json(silent=True) or {}
+    ids = data.get("ids")
+    if (
+        not isinstance(ids, list)
+        or len(ids) > MONITOR_BULK_LIMIT
+        or not all(isinstance(i, int) and not isinstance(i, bool) for i in ids)
+    ):
+        return jsonify({"status": "error", "message": f"ids must be a list of up to {MONITOR_BULK_LIMIT} integers"}), 400
+
+    ids = sorted(set(ids))
+    _delete_alerts(table, ids, key=_request_idempotency_key())
+    return jsonify({"status": "ok", "table": table, "removed": ids, "pending": True})
+
+
+@app.route("/monitor/api/<table>/clear", methods=["POST"])
+def monitor_api_clear_alerts(table):
+    if session.get("role") != "admin":
+        return jsonify({"status": "error", "message": "admin session required"}), 403
+    if table not in MONITOR_ALERT_TABLES:
+        return jsonify({"status": "error", "message": "unknown alert table"}), 404
+
+    _delete_alerts(table, key=_request_idempotency_key())
+    return jsonify({"status": "ok", "table": table, "cleared": True, "pending": True})
+
+
 @app.route("/save_location", methods=["POST"])
 def save_location():
     if session.get("role") != "admin":
         return redirect("/")
 
     place = request.form["place_name"]
-    lat = request.form["latitude"]
-    lon = request.form["longitude"]
+    try:
+        lat = float(request.form["latitude"])
+        lon = float(request.form["longitude"])
+    except ValueError:
+        return jsonify({"status": "error", "message": "invalid coordinates"}), 400
 
-    db = get_db()
-    existing = db.execute("SELECT * FROM location WHERE id=1").fetchone()
-
-    if existing:
-        db.execute("""
-            UPDATE location
-            SET place_name=?, latitude=?, longitude=?
-            WHERE id=1
-        """, (place, lat, lon))
-    else:
-        db.execute("""
-            INSERT INTO location (id, place_name, latitude, longitude)
-            VALUES (1, ?, ?, ?)
-        """, (place, lat, lon))
+    # A form without site_id predates multi-site and edits the default
+    # site; an empty one adds a new site.
+    site_id = request.form.get("site_id", str(DEFAULT_SITE_ID)).strip()
+    site_id = int(site_id) if site_id.isdigit() else None
+    previous = site_index.get(site_id) if site_id is not None else None
+
+    site_id = site_index.save(site_id, place, lat, lon)
+
+    # Weather is cached per coordinates, so only this site's entries go.
+    if previous is not None and previous[2] is not None and previous[3] is not None:
+        weather_service.invalidate(previous[2], previous[3])
+    weather_service.invalidate(lat, lon)
+    databack_snapshots.invalidate(site_id)
+    return redirect(f"/location?site={site_id}")
+
+
+@app.route("/delete_location", methods=["POST"])
+def delete_location():
+    if session.get("role") != "admin":
+        return redirect("/")
 
-    db.commit()
+    site_id = request.form.get("site_id", type=int)
+    site = site_index.get(site_id)
+    if site is not None and site_index.delete(site_id):
+        if site[2] is not None and site[3] is not None:
+            weather_service.invalidate(site[2], site[3])
+        databack_snapshots.discard(site_id)
+        sync_snapshots.discard(site_id)
     return redirect("/location")
 
 # -------------------- LOGOUT --------------------
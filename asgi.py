@@ -0,0 +1,575 @@
+# Async serving mode:
+#
+#     uvicorn asgi:application --host 0.0.0.0 --workers 2
+#
+# /databack and /vote are answered on the event loop, so one process can hold
+# thousands of receiver long-polls. Every other URL is handed to the Flask app
+# unchanged, on a pool of threads, and an async MySQL pool and HTTP client
+# keep the monitor snapshot and weather cache warm so those pages rarely
+# block on the WAN.
+#
+# Behind nginx, set trusted_proxy_hops = 1 in api_key.py so votes are keyed
+# on the forwarded client address (see TRUSTED_PROXY_HOPS in app.py).
+import asyncio
+import json
+import threading
+import time
+from http.cookies import CookieError, SimpleCookie
+from concurrent.futures import ThreadPoolExecutor
+from tempfile import SpooledTemporaryFile
+from urllib.parse import parse_qs
+
+import aiomysql
+import httpx
+from asgiref.wsgi import WsgiToAsgiInstance
+from pymysql.constants import CLIENT
+
+import app as web
+import monitor_data
+from api_key import owm, mysql as mysql_config
+from weather import OWM_BASE, build_payload
+
+
+SQLITE_WORKERS = 8
+
+# Threads running Flask requests; an open /events stream or export holds one.
+FLASK_THREADS = 32
+
+# Pages read within this many seconds get their data refreshed ahead of time.
+PREFETCH_IDLE = 30.0
+PREFETCH_INTERVAL = 1.0
+PREFETCH_ERROR_BACKOFF = 30.0
+WEATHER_PREFETCH_MARGIN = 30.0
+
+MAX_FORM_BYTES = 64 * 1024
+
+
+class AsyncServices:
+    """Event-loop side resources: MySQL pool, HTTP client, SQLite executor."""
+
+    def __init__(self, sqlite_workers=SQLITE_WORKERS, mysql_size=web.MYSQL_POOL_SIZE, http_timeout=8):
+        self.sqlite = ThreadPoolExecutor(max_workers=sqlite_workers, thread_name_prefix="sqlite")
+        self.mysql_size = mysql_size
+        self.http_timeout = http_timeout
+        self.mysql = None
+        self.http = None
+        self._tasks = []
+        self._retry_at = {}
+        self.prefetches = 0
+        self.prefetch_errors = 0
+
+    async def start(self):
+        self.http = httpx.AsyncClient(
+            timeout=self.http_timeout,
+            limits=httpx.Limits(max_connections=20, max_keepalive_connections=5),
+        )
+        web.poll_compactor.start()
+        web.vote_ingestor.start()
+        # Picks up writes left queued by a previous run.
+        web.mysql_outbox.start()
+        web.monitor_replica.start()
+        self._tasks.append(asyncio.create_task(self._prefetch_loop()))
+        self._tasks.append(asyncio.create_task(databack_watcher.run()))
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        if self.http is not None:
+            await self.http.aclose()
+        if self.mysql is not None:
+            self.mysql.close()
+            await self.mysql.wait_closed()
+        self.sqlite.shutdown(wait=False)
+
+    async def run_sqlite(self, fn, *args):
+        return await asyncio.get_running_loop().run_in_executor(self.sqlite, fn, *args)
+
+    # -------------------- MYSQL --------------------
+
+    async def _mysql_pool(self):
+        # Created on first use so an unreachable MySQL does not fail startup.
+        if self.mysql is None:
+            self.mysql = await aiomysql.create_pool(
+                host=mysql_config["host"],
+                port=mysql_config.get("port", 3306),
+                user=mysql_config["user"],
+                password=mysql_config["password"],
+                db=mysql_config["database"],
+                connect_timeout=mysql_config.get("connection_timeout", 10),
+                minsize=1,
+                maxsize=self.mysql_size,
+                autocommit=True,
+                client_flag=CLIENT.MULTI_STATEMENTS,
+                init_command=f"SET time_zone='{web.MYSQL_TIME_ZONE}'",
+                pool_recycle=300,
+            )
+        return self.mysql
+
+    async def fetch_monitor(self):
+        pool = await self._mysql_pool()
+        async with pool.acquire() as conn:
+            async with conn.cursor(aiomysql.DictCursor) as cur:
+                await cur.execute(monitor_data.SNAPSHOT_SQL)
+                sets = [await cur.fetchall()]
+                while await cur.nextset():
+                    sets.append(await cur.fetchall())
+        return monitor_data.from_result_sets(sets)
+
+    # -------------------- HTTP --------------------
+
+    async def fetch_weather(self, lat, lon):
+        params = {"lat": lat, "lon": lon, "appid": owm}
+        weather, air = await asyncio.gather(
+            self._get_json("weather", dict(params, units="metric")),
+            self._get_json("air_pollution", params),
+            return_exceptions=True,
+        )
+        if isinstance(weather, Exception):
+            raise weather
+        if isinstance(air, Exception):
+            air = None
+        return build_payload(weather, air)
+
+    async def _get_json(self, endpoint, params):
+        started = time.perf_counter()
+        ok = False
+        try:
+            res = await self.http.get(f"{OWM_BASE}/{endpoint}", params=params)
+            data = res.json()
+            if not res.is_success:
+                raise ValueError(data.get("message") or f"HTTP {res.status_code}")
+            ok = True
+            return data
+        finally:
+            observe = web.weather_service.observe
+            if observe is not None:
+                observe(endpoint, time.perf_counter() - started, ok)
+
+    # -------------------- PREFETCH --------------------
+
+    async def _prefetch_loop(self):
+        while True:
+            await asyncio.sleep(PREFETCH_INTERVAL)
+            for name, job in (("monitor", self._prefetch_monitor), ("weather", self._prefetch_weather)):
+                if time.monotonic() < self._retry_at.get(name, 0.0):
+                    continue
+                try:
+                    await job()
+                except Exception as e:
+                    self.prefetch_errors += 1
+                    self._retry_at[name] = time.monotonic() + PREFETCH_ERROR_BACKOFF
+                    print(f"Error prefetching {name}: {e}")
+
+    async def _prefetch_monitor(self):
+        snapshot = web.monitor_snapshot
+        if time.monotonic() - snapshot.last_read > PREFETCH_IDLE or snapshot.expires_in() > PREFETCH_INTERVAL:
+            return
+        generation = snapshot.generation
+        snapshot.put(await self.fetch_monitor(), generation)
+        self.prefetches += 1
+
+    async def _prefetch_weather(self):
+        # Every site whose weather was read recently is refreshed ahead of
+        # expiry, each under its own cache entry.
+        for lat, lon in web.weather_service.due(WEATHER_PREFETCH_MARGIN, PREFETCH_IDLE):
+            data = await self.fetch_weather(lat, lon)
+            web.weather_service.put(lat, lon, data)
+            self.prefetches += 1
+
+
+class SnapshotWatcher:
+    """Follows a SnapshotGroup of VersionedSnapshots (one per site) from the event loop.
+
+    Long-polls wait on one shared asyncio event per key instead of a thread
+    each; the watcher re-reads the snapshots someone is waiting on whenever
+    the group is invalidated, and every `interval` seconds while anyone is
+    waiting (to catch other workers).
+    """
+
+    def __init__(self, snapshots, interval=1.0):
+        self.snapshots = snapshots
+        self.interval = interval
+        self.current = {}
+        self.waiters = {}
+        self._loop = None
+        self._wake = None
+        self._changed = {}
+        snapshots.listeners.append(self._on_invalidate)
+
+    def _on_invalidate(self, key=None):
+        if self._loop is None:
+            return
+        try:
+            self._loop.call_soon_threadsafe(self._wake.set)
+        except RuntimeError:
+            pass
+
+    async def run(self):
+        self._loop = asyncio.get_running_loop()
+        self._wake = asyncio.Event()
+        while True:
+            try:
+                await asyncio.wait_for(self._wake.wait(), self.interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+            for key in [key for key, count in self.waiters.items() if count]:
+                try:
+                    await self.refresh(key)
+                except Exception as e:
+                    print(f"Error refreshing databack snapshot for site {key}: {e}")
+
+    async def refresh(self, key):
+        result = await services.run_sqlite(self.snapshots[key].get)
+        current = self.current.get(key)
+        if current is None or result[2] != current[2]:
+            self.current[key] = result
+            changed = self._changed.pop(key, None)
+            if changed is not None:
+                changed.set()
+        return result
+
+    async def wait_for_change(self, key, since, timeout):
+        deadline = time.monotonic() + timeout
+        result = await self.refresh(key)
+        while result[2] <= since:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0 or self._loop is None:
+                break
+            changed = self._changed.setdefault(key, asyncio.Event())
+            self.waiters[key] = self.waiters.get(key, 0) + 1
+            try:
+                await asyncio.wait_for(changed.wait(), remaining)
+            except asyncio.TimeoutError:
+                pass
+            finally:
+                self.waiters[key] -= 1
+                if not self.waiters[key]:
+                    del self.waiters[key]
+            result = self.current[key]
+        return result
+
+
+services = AsyncServices()
+databack_watcher = SnapshotWatcher(web.databack_snapshots, interval=1.0)
+
+# -------------------- HTTP HELPERS --------------------
+
+
+def _header(scope, name):
+    name = name.encode("latin-1")
+    for key, value in scope["headers"]:
+        if key == name:
+            return value.decode("latin-1")
+    return ""
+
+
+def _if_none_match(scope):
+    tags = set()
+    for tag in _header(scope, "if-none-match").split(","):
+        tag = tag.strip()
+        if tag.startswith("W/"):
+            tag = tag[2:]
+        tags.add(tag.strip('"'))
+    return tags
+
+
+def _session_user(scope):
+    # Reads Flask's signed session cookie, so a logged-in voter is the same
+    # client here as on the Flask route.
+    try:
+        cookie = SimpleCookie(_header(scope, "cookie")).get(web.app.config["SESSION_COOKIE_NAME"])
+    except CookieError:
+        return None
+    if cookie is None:
+        return None
+    serializer = web.app.session_interface.get_signing_serializer(web.app)
+    try:
+        return serializer.loads(cookie.value).get("user")
+    except Exception:
+        return None
+
+
+def _client_address(scope):
+    # Same address ProxyFix gives the Flask routes; X-Forwarded-For is
+    # ignored unless TRUSTED_PROXY_HOPS says a proxy is in front.
+    hops = web.TRUSTED_PROXY_HOPS
+    forwarded = [part.strip() for part in _header(scope, "x-forwarded-for").split(",") if part.strip()]
+    if hops and len(forwarded) >= hops:
+        return forwarded[-hops]
+    client = scope.get("client")
+    return client[0] if client else None
+
+
+def _first(values, name):
+    return (values.get(name) or [None])[0]
+
+
+def _arg(values, name, cast):
+    try:
+        return cast(values[name][0])
+    except (KeyError, IndexError, ValueError):
+        return None
+
+
+async def _read_body(receive):
+    body = b""
+    more = True
+    while more:
+        message = await receive()
+        body += message.get("body", b"")
+        more = message.get("more_body", False)
+        if len(body) > MAX_FORM_BYTES:
+            raise ValueError("request body too large")
+    return body
+
+
+async def _respond(send, status, body=b"", headers=()):
+    await send({
+        "type": "http.response.start",
+        "status": status,
+        "headers": [(k.encode("latin-1"), v.encode("latin-1")) for k, v in headers],
+    })
+    await send({"type": "http.response.body", "body": body})
+
+
+async def _respond_json(send, status, payload):
+    body = json.dumps(payload, separators=(",", ":")).encode("utf-8")
+    await _respond(send, status, body, [("content-type", "application/json")])
+
+# -------------------- ASYNC ROUTES --------------------
+
+
+async def databack(scope, receive, send):
+    query = parse_qs(scope["query_string"].decode("latin-1"))
+    try:
+        site_args = web._site_args(lambda name: _first(query, name))
+    except ValueError as e:
+        await _respond_json(send, 400, {"status": "error", "message": str(e)})
+        return
+    site_id = await services.run_sqlite(web._resolve_site_id, *site_args)
+    if site_id is None:
+        await _respond_json(send, 404, {"status": "error", "message": "unknown site"})
+        return
+    since = _arg(query, "since", int)
+    wait = _arg(query, "wait", float)
+    if wait and since is not None:
+        waited = time.perf_counter()
+        body, etag, version = await databack_watcher.wait_for_change(
+            site_id, since, min(max(wait, 0), web.DATABACK_MAX_WAIT)
+        )
+        # Left out of the request's latency by _observed().
+        scope["radio.waited"] = time.perf_counter() - waited
+    else:
+        body, etag, version = await services.run_sqlite(web.databack_snapshots[site_id].get)
+
+    headers = [
+        ("etag", f'"{etag}"'),
+        ("x-data-version", str(version)),
+        ("x-site-id", str(site_id)),
+        ("cache-control", "no-cache"),
+    ]
+    if etag in _if_none_match(scope) or (since is not None and version <= since):
+        await _respond(send, 304, headers=headers)
+        return
+    await _respond(send, 200, body.encode("utf-8"), headers + [("content-type", "application/json")])
+
+
+async def vote(scope, receive, send):
+    try:
+        form = parse_qs((await _read_body(receive)).decode("utf-8", "replace"))
+    except ValueError as e:
+        await _respond_json(send, 413, {"status": "error", "message": str(e)})
+        return
+    query = parse_qs(scope["query_string"].decode("latin-1"))
+    language = ((form.get("language") or [""])[0]).strip().lower()
+    genre = ((form.get("genre") or [""])[0]).strip().lower()
+
+    if language not in web.ALLOWED_LANGUAGES or genre not in web.ALLOWED_GENRES:
+        await _respond_json(send, 400, {"status": "error", "message": "invalid vote"})
+        return
+
+    values = dict(query, **form)
+    try:
+        site_args = web._site_args(lambda name: _first(values, name))
+    except ValueError as e:
+        await _respond_json(send, 400, {"status": "error", "message": str(e)})
+        return
+
+    client = web._vote_client(_session_user(scope), _client_address(scope))
+    rejected = web._throttle_vote(client)
+    if rejected is None:
+        site_id = await services.run_sqlite(web._resolve_site_id, *site_args)
+        if site_id is None:
+            await _respond_json(send, 404, {"status": "error", "message": "unknown site"})
+            return
+        rejected = web._claim_vote(client, site_id)
+    if rejected is not None:
+        status, message, retry_after = rejected
+        body = json.dumps({"status": "error", "message": message}, separators=(",", ":")).encode("utf-8")
+        headers = [("content-type", "application/json")]
+        if retry_after is not None:
+            headers.append(("retry-after", str(max(1, int(retry_after + 0.999)))))
+        await _respond(send, status, body, headers)
+        return
+
+    sync = ((form.get("sync") or query.get("sync") or [""])[0]) in ("1", "true", "yes")
+    try:
+        # Off the loop: a saturated queue or a sync vote blocks until the
+        # writer catches up.
+        queued = await asyncio.get_running_loop().run_in_executor(
+            None, web.vote_ingestor.submit, language, genre, sync or None, site_id
+        )
+    except TimeoutError as e:
+        await _respond_json(send, 503, {"status": "error", "message": f"vote not saved: {e}"})
+        return
+    except Exception as e:
+        web.vote_admission.release(client, site_id)
+        await _respond_json(send, 503, {"status": "error", "message": f"vote not saved: {e}"})
+        return
+    if not queued:
+        web.vote_admission.release(client, site_id)
+        await _respond_json(send, 503, {"status": "error", "message": "busy, try again"})
+        return
+
+    if "text/html" in _header(scope, "accept"):
+        await _respond(send, 302, headers=[("location", f"/dashboard?site={site_id}"), ("content-length", "0")])
+        return
+
+    await _respond_json(send, 200, {"status": "ok", "site_id": site_id})
+
+
+ROUTES = {
+    ("GET", "/databack"): databack,
+    ("POST", "/vote"): vote,
+}
+
+class ThreadedWsgi:
+    """ASGI wrapper running a WSGI app on a bounded thread pool.
+
+    asgiref's WsgiToAsgi runs every request on one shared thread, so a
+    single open /events stream would hold up every other Flask route.
+    Here each request takes a pool thread of its own. A streamed response
+    stops at its next chunk once the client disconnects, and its iterable
+    is always closed, so call_on_close() cleanup runs.
+    """
+
+    def __init__(self, wsgi_application, threads=FLASK_THREADS):
+        self.wsgi_application = wsgi_application
+        self.executor = ThreadPoolExecutor(max_workers=threads, thread_name_prefix="flask")
+
+    async def __call__(self, scope, receive, send):
+        await _ThreadedWsgiInstance(self.wsgi_application, self.executor)(scope, receive, send)
+
+
+class _ThreadedWsgiInstance(WsgiToAsgiInstance):
+    # Reuses asgiref's environ and start_response handling.
+
+    def __init__(self, wsgi_application, executor):
+        super().__init__(wsgi_application)
+        self.executor = executor
+        self.disconnected = threading.Event()
+
+    async def __call__(self, scope, receive, send):
+        self.scope = scope
+        loop = asyncio.get_running_loop()
+        with SpooledTemporaryFile(max_size=65536) as body:
+            while True:
+                message = await receive()
+                if message["type"] == "http.disconnect":
+                    return
+                body.write(message.get("body", b""))
+                if not message.get("more_body"):
+                    break
+            body.seek(0)
+            self.sync_send = lambda message: asyncio.run_coroutine_threadsafe(send(message), loop).result()
+            watcher = asyncio.create_task(self._watch_disconnect(receive))
+            try:
+                await loop.run_in_executor(self.executor, self.run_wsgi_app, body)
+            finally:
+                watcher.cancel()
+
+    async def _watch_disconnect(self, receive):
+        while (await receive())["type"] != "http.disconnect":
+            pass
+        self.disconnected.set()
+
+    def run_wsgi_app(self, body):
+        try:
+            environ = self.build_environ(self.scope, body)
+        except ValueError:
+            # Too many duplicate headers.
+            self.sync_send({"type": "http.response.start", "status": 400,
+                            "headers": [(b"content-type", b"text/plain")]})
+            self.sync_send({"type": "http.response.body", "body": b"Bad Request"})
+            return
+        iterable = self.wsgi_application(environ, self.start_response)
+        try:
+            for output in iterable:
+                if self.disconnected.is_set():
+                    return
+                if not self.response_started:
+                    self.response_started = True
+                    self.sync_send(self.response_start)
+                if output:
+                    self.sync_send({"type": "http.response.body", "body": output, "more_body": True})
+        finally:
+            close = getattr(iterable, "close", None)
+            if close is not None:
+                close()
+        if not self.response_started:
+            self.response_started = True
+            self.sync_send(self.response_start)
+        self.sync_send({"type": "http.response.body"})
+
+
+flask_app = ThreadedWsgi(web.app)
+
+
+async def _lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message["type"] == "lifespan.startup":
+            await services.start()
+            await send({"type": "lifespan.startup.complete"})
+        elif message["type"] == "lifespan.shutdown":
+            await services.stop()
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+
+async def _observed(handler, scope, receive, send):
+    started = time.perf_counter()
+    status = [500]
+
+    async def send_with_status(message):
+        if message["type"] == "http.response.start":
+            status[0] = message["status"]
+        await send(message)
+
+    try:
+        await handler(scope, receive, send_with_status)
+    finally:
+        # Phases are tracked per thread, so async routes report totals
+        # only, less any long-poll wait.
+        phases = {"wait": scope["radio.waited"]} if "radio.waited" in scope else {}
+        web.observe_request(scope["method"], scope["path"], status[0], time.perf_counter() - started, phases)
+
+
+async def application(scope, receive, send):
+    if scope["type"] == "lifespan":
+        await _lifespan(receive, send)
+        return
+
+    if scope["type"] == "http":
+        handler = ROUTES.get((scope["method"], scope["path"]))
+        if handler is vote and not _header(scope, "content-type").startswith("application/x-www-form-urlencoded"):
+            # Multipart and other encodings keep going through Flask's parser.
+            handler = None
+        if handler is not None:
+            await _observed(handler, scope, receive, send)
+            return
+
+    await flask_app(scope, receive, send)
@@ -0,0 +1,207 @@
+import gzip
+import hashlib
+import posixpath
+import re
+import threading
+
+from flask import Response
+from jinja2 import BaseLoader
+
+try:
+    import brotli
+except ImportError:  # optional; bundles are still served gzipped
+    brotli = None
+
+
+INLINE_BLOCK = re.compile(r"<(style|script)\b([^>]*)>(.*?)</\1\s*>", re.DOTALL | re.IGNORECASE)
+JINJA_SYNTAX = re.compile(r"\{[{%#]")
+
+CONTENT_TYPES = {
+    "css": "text/css; charset=utf-8",
+    "js": "application/javascript; charset=utf-8",
+}
+
+IMMUTABLE = "public, max-age=31536000, immutable"
+
+
+def accepts(accept_encoding, coding):
+    """True if an Accept-Encoding header allows `coding` (q=0 refuses it)."""
+    for part in (accept_encoding or "").split(","):
+        name, _, params = part.strip().partition(";")
+        if name.strip().lower() != coding:
+            continue
+        q = params.strip()
+        return not (q.startswith("q=") and q[2:].strip() in ("0", "0.0", "0.00", "0.000"))
+    return False
+
+
+class _Bundle:
+    def __init__(self, kind, body):
+        self.kind = kind
+        self.body = body
+        self.etag = hashlib.sha256(body).hexdigest()[:16]
+        self.gzip = gzip.compress(body, compresslevel=9, mtime=0)
+        self.brotli = brotli.compress(body) if brotli is not None else None
+
+
+class AssetBundler:
+    """Moves inline <style>/<script> blocks out of templates into static bundles.
+
+    Blocks that contain Jinja syntax, or scripts that already have a src,
+    stay inline; everything else is replaced by a <link>/<script src> to
+    `{url_prefix}/{template}.{hash}.{css|js}`. The hash is of the content,
+    so a bundle's URL only changes when its text does and it can be cached
+    forever. Each bundle is compressed once (gzip, plus brotli when the
+    module is installed) and served from memory.
+
+    build() runs the extraction over every template up front so that any
+    worker can answer for a bundle before it has rendered the page.
+    """
+
+    def __init__(self, url_prefix="/assets", min_size=256):
+        self.url_prefix = url_prefix.rstrip("/")
+        self.min_size = min_size
+        self._lock = threading.Lock()
+        self._bundles = {}
+        self.inline_kept = 0
+        self.served = 0
+        self.not_modified = 0
+
+    # -------------------- EXTRACT --------------------
+
+    def extract(self, template, source):
+        stem = posixpath.splitext(template)[0].replace("/", "-")
+        seen = {}
+
+        def replace(match):
+            tag, attrs, body = match.group(1).lower(), match.group(2), match.group(3)
+            if (tag == "script" and "src=" in attrs.lower()) or not body.strip():
+                return match.group(0)
+            if JINJA_SYNTAX.search(body) or len(body) < self.min_size:
+                with self._lock:
+                    self.inline_kept += 1
+                return match.group(0)
+            kind = "css" if tag == "style" else "js"
+            seen[kind] = seen.get(kind, 0) + 1
+            name = stem if seen[kind] == 1 else f"{stem}-{seen[kind]}"
+            url = self._register(name, kind, body.strip("\n").encode("utf-8") + b"\n")
+            if kind == "css":
+                return f'<link rel="stylesheet"{attrs} href="{url}">'
+            return f'<script{attrs} src="{url}"></script>'
+
+        return INLINE_BLOCK.sub(replace, source)
+
+    def _register(self, name, kind, body):
+        bundle = _Bundle(kind, body)
+        filename = f"{name}.{bundle.etag[:10]}.{kind}"
+        with self._lock:
+            self._bundles.setdefault(filename, bundle)
+        return f"{self.url_prefix}/{filename}"
+
+    def build(self, env):
+        """Extract the bundles of every template the environment can find."""
+        for name in env.list_templates(extensions=("html",)):
+            env.loader.get_source(env, name)
+
+    # -------------------- SERVE --------------------
+
+    def response(self, filename, accept_encoding, if_none_match=None):
+        with self._lock:
+            bundle = self._bundles.get(filename)
+        if bundle is None:
+            return None
+        headers = {
+            "Cache-Control": IMMUTABLE,
+            "ETag": f'"{bundle.etag}"',
+            "Vary": "Accept-Encoding",
+        }
+        if if_none_match and bundle.etag in if_none_match:
+            with self._lock:
+                self.not_modified += 1
+            return Response(status=304, headers=headers)
+        if bundle.brotli is not None and accepts(accept_encoding, "br"):
+            body, headers["Content-Encoding"] = bundle.brotli, "br"
+        elif accepts(accept_encoding, "gzip"):
+            body, headers["Content-Encoding"] = bundle.gzip, "gzip"
+        else:
+            body = bundle.body
+        with self._lock:
+            self.served += 1
+        return Response(body, content_type=CONTENT_TYPES[bundle.kind], headers=headers)
+
+    def stats(self):
+        with self._lock:
+            bundles = list(self._bundles.values())
+            return {
+                "bundles": len(bundles),
+                "bytes": sum(len(b.body) for b in bundles),
+                "gzip_bytes": sum(len(b.gzip) for b in bundles),
+                "brotli_bytes": sum(len(b.brotli) for b in bundles) if brotli is not None else None,
+                "inline_kept": self.inline_kept,
+                "served": self.served,
+                "not_modified": self.not_modified,
+            }
+
+
+class AssetLoader(BaseLoader):
+    """Template loader that runs every source through AssetBundler.extract()."""
+
+    def __init__(self, loader, bundler):
+        self.loader = loader
+        self.bundler = bundler
+
+    def get_source(self, environment, template):
+        source, filename, uptodate = self.loader.get_source(environment, template)
+        return self.bundler.extract(template, source), filename, uptodate
+
+    def list_templates(self):
+        return self.loader.list_templates()
+
+
+class ResponseCompressor:
+    """gzips rendered pages for clients that accept it.
+
+    Only complete (non-streamed) responses of the listed mimetypes that are
+    at least `min_size` bytes are touched; the event stream and anything
+    already encoded pass through.
+    """
+
+    def __init__(self, mimetypes=("text/html",), min_size=1024, level=6):
+        self.mimetypes = set(mimetypes)
+        self.min_size = min_size
+        self.level = level
+        self._lock = threading.Lock()
+        self.compressed = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+
+    def __call__(self, response, accept_encoding):
+        if (
+            response.status_code != 200
+            or response.direct_passthrough
+            or response.is_streamed
+            or response.mimetype not in self.mimetypes
+            or "Content-Encoding" in response.headers
+            or not accepts(accept_encoding, "gzip")
+        ):
+            return response
+        body = response.get_data()
+        if len(body) < self.min_size:
+            return response
+        compressed = gzip.compress(body, compresslevel=self.level)
+        response.set_data(compressed)
+        response.headers["Content-Encoding"] = "gzip"
+        response.vary.add("Accept-Encoding")
+        with self._lock:
+            self.compressed += 1
+            self.bytes_in += len(body)
+            self.bytes_out += len(compressed)
+        return response
+
+    def stats(self):
+        with self._lock:
+            return {
+                "compressed": self.compressed,
+                "bytes_in": self.bytes_in,
+                "bytes_out": self.bytes_out,
+            }
@@ -0,0 +1,444 @@
+# Load-test harness for the receiver, voting and admin workloads.
+#
+#     python bench.py --scenario mixed --duration 20 --concurrency 32 > run.json
+#     python bench.py --scenario receivers --compare run.json
+#
+# The Flask app is booted in-process against a throwaway database.db and an
+# SQLite-backed stand-in for the remote MySQL tables, so runs need no network
+# and are comparable across commits.
+import argparse
+import json
+import os
+import random
+import re
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import mysql.connector
+
+
+# -------------------- FAKE MYSQL --------------------
+
+FAKE_MYSQL_SCHEMA = """
+CREATE TABLE IF NOT EXISTS status_server (
+    id INTEGER PRIMARY KEY,
+    status TEXT,
+    last_updated TIMESTAMP
+);
+CREATE TABLE IF NOT EXISTS music (
+    id INTEGER PRIMARY KEY,
+    name TEXT,
+    link TEXT,
+    ends_at TIMESTAMP,
+    last_updated TIMESTAMP
+);
+CREATE TABLE IF NOT EXISTS ai_alert (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    message TEXT,
+    severity TEXT,
+    expires_at TIMESTAMP,
+    last_updated TIMESTAMP
+);
+CREATE TABLE IF NOT EXISTS user_alert (
+    id INTEGER PRIMARY KEY,
+    user_id TEXT,
+    message TEXT,
+    source TEXT,
+    last_updated TIMESTAMP
+);
+"""
+
+ER_DUP_KEYNAME = 1061
+
+
+def translate_mysql(sql):
+    """Rewrite the MySQL dialect app.py uses into SQLite."""
+    sql = sql.replace("%s", "?").replace("NOW()", "CURRENT_TIMESTAMP")
+    sql = sql.replace("INSERT IGNORE", "INSERT OR IGNORE")
+    if "ON DUPLICATE KEY UPDATE" in sql:
+        head, tail = sql.split("ON DUPLICATE KEY UPDATE", 1)
+        tail = re.sub(r"VALUES\((\w+)\)", r"excluded.\1", tail)
+        sql = f"{head}ON CONFLICT (id) DO UPDATE SET{tail}"
+    return sql
+
+
+class FakeMySQLCursor:
+    def __init__(self, conn, dictionary=False):
+        self._conn = conn
+        self._dictionary = dictionary
+        self._sets = []
+        self.rowcount = -1
+        self.lastrowid = None
+
+    def execute(self, operation, params=None):
+        self._sets = []
+        statements = [s for s in translate_mysql(operation).split(";") if s.strip()]
+        for statement in statements:
+            try:
+                cur = self._conn.db.execute(statement, params or ())
+            except sqlite3.Error as e:
+                errno = ER_DUP_KEYNAME if "already exists" in str(e) else None
+                raise mysql.connector.DatabaseError(msg=str(e), errno=errno)
+            rows = cur.fetchall()
+            if cur.description is not None:
+                columns = [d[0] for d in cur.description]
+                rows = [dict(zip(columns, row)) if self._dictionary else tuple(row) for row in rows]
+            self._sets.append(rows)
+            self.rowcount = cur.rowcount
+            self.lastrowid = cur.lastrowid
+
+    def fetchone(self):
+        rows = self._sets[0] if self._sets else []
+        return rows.pop(0) if rows else None
+
+    def fetchall(self):
+        rows = self._sets[0] if self._sets else []
+        if self._sets:
+            self._sets[0] = []
+        return rows
+
+    def nextset(self):
+        if len(self._sets) <= 1:
+            return None
+        self._sets.pop(0)
+        return True
+
+    def close(self):
+        self._sets = []
+
+
+class FakeMySQLConnection:
+    """The slice of mysql.connector's connection API that app.py touches."""
+
+    def __init__(self, path, latency=0.0):
+        self.db = sqlite3.connect(path, timeout=10, check_same_thread=False)
+        self.latency = latency
+        self._open = True
+
+    def cursor(self, dictionary=False):
+        if self.latency:
+            # One simulated WAN round-trip per cursor.
+            time.sleep(self.latency)
+        return FakeMySQLCursor(self, dictionary=dictionary)
+
+    @property
+    def in_transaction(self):
+        return self.db.in_transaction
+
+    def commit(self):
+        self.db.commit()
+
+    def rollback(self):
+        self.db.rollback()
+
+    def is_connected(self):
+        return self._open
+
+    def close(self):
+        self._open = False
+        self.db.close()
+
+
+class FakeMySQL:
+    def __init__(self, path, latency=0.0):
+        self.path = path
+        self.latency = latency
+        db = sqlite3.connect(path)
+        db.executescript(FAKE_MYSQL_SCHEMA)
+        db.execute("INSERT OR IGNORE INTO status_server VALUES (1, 'net', CURRENT_TIMESTAMP)")
+        db.execute(
+            "INSERT OR IGNORE INTO music VALUES (1, 'Bench Track', 'https://example.invalid/track', NULL, CURRENT_TIMESTAMP)"
+        )
+        for i in range(8):
+            db.execute(
+                "INSERT INTO ai_alert (message, severity, expires_at, last_updated) "
+                "VALUES (?, 'info', NULL, datetime('now', ?))",
+                (f"bench alert {i}", f"-{i} minutes"),
+            )
+        db.commit()
+        db.close()
+
+    def connect(self, **config):
+        return FakeMySQLConnection(self.path, self.latency)
+
+
+# -------------------- BOOT --------------------
+
+CANNED_WEATHER = {
+    "weather": {
+        "name": "Bench City",
+        "weather": [{"description": "clear sky", "icon": "01d"}],
+        "main": {"temp": 27.0, "feels_like": 29.0, "humidity": 70},
+        "timezone": 19800,
+    },
+    "air": None,
+}
+
+
+# Extra transmitter sites on a rough 1.5 degree lattice around Bench City.
+BENCH_SITES = 40
+
+
+def boot(workdir, mysql_latency=0.0, seed_votes=2000):
+    """Import app.py inside `workdir` so it creates a fresh database.db there."""
+    os.chdir(workdir)
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    import app as web
+    from mysql_pool import MySQLPool
+
+    fake = FakeMySQL(os.path.join(workdir, "fake_mysql.db"), latency=mysql_latency)
+    # get_mysql() looks the pool up at call time, so every MySQL user
+    # (monitor snapshot, alert expiry, /monitor mutations) follows the swap.
+    web.mysql_pool = MySQLPool({}, size=web.MYSQL_POOL_SIZE, connect=fake.connect)
+
+    db = web.sqlite_db.connect()
+    with db:
+        db.execute(
+            "INSERT OR REPLACE INTO location (id, place_name, latitude, longitude) "
+            "VALUES (1, 'Bench City', 10.0, 76.0)"
+        )
+        db.executemany(
+            "INSERT INTO location (place_name, latitude, longitude) VALUES (?, ?, ?)",
+            [
+                (f"Bench Site {i}", 10.0 + 1.5 * (i // 8 - 2), 76.0 + 1.5 * (i % 8 - 4))
+                for i in range(BENCH_SITES)
+            ],
+        )
+        rng = random.Random(0)
+        languages = sorted(web.ALLOWED_LANGUAGES)
+        genres = sorted(web.ALLOWED_GENRES)
+        db.executemany(
+            "INSERT INTO polls (language, genre, created_at) VALUES (?, ?, datetime('now', ?))",
+            [
+                (rng.choice(languages), rng.choice(genres), f"-{rng.randint(0, 50 * 60)} seconds")
+                for _ in range(seed_votes)
+            ],
+        )
+    web.vote_tallies.rebuild(db)
+    db.close()
+
+    # Weather comes from the cache, as it does for almost every real render.
+    web.weather_service.put(10.0, 76.0, CANNED_WEATHER)
+    return web
+
+# -------------------- WORKLOADS --------------------
+
+SCENARIOS = {
+    # Receivers polling for changes while listeners trickle votes in.
+    "receivers": {"databack": 60, "databack_conditional": 30, "vote": 10},
+    # Receivers spread over the sites, located by coordinates.
+    "sites": {"databack_nearest": 70, "databack": 15, "vote": 15},
+    # One address scripting votes while receivers poll.
+    "flood": {"vote_flood": 80, "vote": 5, "databack": 15},
+    # Bursts of votes with a handful of receivers polling.
+    "votes": {"vote_burst": 80, "databack": 20},
+    # Operators refreshing the dashboards.
+    "admin": {"admin": 50, "monitor": 30, "user_alert": 10, "databack": 10},
+    "mixed": {
+        "databack": 40,
+        "databack_conditional": 25,
+        "vote": 15,
+        "vote_burst": 5,
+        "admin": 8,
+        "monitor": 7,
+    },
+}
+
+VOTE_BURST = 20
+
+
+class Worker:
+    def __init__(self, web, rng):
+        self.web = web
+        self.rng = rng
+        self.client = web.app.test_client()
+        with self.client.session_transaction() as sess:
+            sess["user"] = "admin"
+            sess["role"] = "admin"
+        # Anonymous listeners, one address per vote, so admission counts
+        # every vote; the admin session above would be a single client.
+        self.voter = web.app.test_client()
+        self.etag = None
+        self.version = None
+        self.languages = sorted(web.ALLOWED_LANGUAGES)
+        self.genres = sorted(web.ALLOWED_GENRES)
+
+    def databack(self):
+        return [self.client.get("/databack")]
+
+    def databack_nearest(self):
+        lat = 10.0 + self.rng.uniform(-4.0, 4.0)
+        lon = 76.0 + self.rng.uniform(-7.0, 7.0)
+        return [self.client.get(f"/databack?lat={lat:.4f}&lon={lon:.4f}")]
+
+    def databack_conditional(self):
+        headers = {"If-None-Match": f'"{self.etag}"'} if self.etag else {}
+        url = "/databack" if self.version is None else f"/databack?since={self.version}"
+        res = self.client.get(url, headers=headers)
+        self.etag = (res.get_etag() or (None, None))[0] or self.etag
+        self.version = res.headers.get("X-Data-Version", self.version)
+        return [res]
+
+    def vote(self, address=None):
+        address = address or f"10.{self.rng.randrange(256)}.{self.rng.randrange(256)}.{self.rng.randrange(1, 255)}"
+        return [self.voter.post("/vote", data={
+            "language": self.rng.choice(self.languages),
+            "genre": self.rng.choice(self.genres),
+        }, environ_overrides={"REMOTE_ADDR": address})]
+
+    def vote_flood(self):
+        return [self.vote("192.0.2.1")[0] for _ in range(VOTE_BURST)]
+
+    def vote_burst(self):
+        return [self.vote()[0] for _ in range(VOTE_BURST)]
+
+    def admin(self):
+        return [self.client.get("/admin")]
+
+    def monitor(self):
+        return [self.client.get("/monitor")]
+
+    def user_alert(self):
+        return [self.client.get("/user_alert")]
+
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return None
+    rank = max(int(round(pct / 100.0 * len(sorted_values) + 0.5)) - 1, 0)
+    return round(sorted_values[min(rank, len(sorted_values) - 1)], 3)
+
+
+def summarize(samples, elapsed):
+    latencies = sorted(ms for ms, _ in samples)
+    errors = sum(1 for _, status in samples if status >= 500)
+    return {
+        "requests": len(samples),
+        "errors": errors,
+        "throughput_rps": round(len(samples) / elapsed, 1) if elapsed else 0.0,
+        "p50_ms": percentile(latencies, 50),
+        "p95_ms": percentile(latencies, 95),
+        "p99_ms": percentile(latencies, 99),
+        "max_ms": round(latencies[-1], 3) if latencies else None,
+    }
+
+
+def run(web, scenario, duration, concurrency, warmup=2.0, seed=1):
+    mix = SCENARIOS[scenario]
+    ops = list(mix)
+    weights = [mix[op] for op in ops]
+    samples = {op: [] for op in ops}
+    lock = threading.Lock()
+    start_at = time.monotonic() + warmup
+    stop_at = start_at + duration
+
+    def loop(index):
+        worker = Worker(web, random.Random(seed + index))
+        local = {op: [] for op in ops}
+        while True:
+            now = time.monotonic()
+            if now >= stop_at:
+                break
+            op = worker.rng.choices(ops, weights)[0]
+            for res in _timed(getattr(worker, op)):
+                if now >= start_at:
+                    local[op].append(res)
+        with lock:
+            for op, values in local.items():
+                samples[op].extend(values)
+
+    threads = [threading.Thread(target=loop, args=(i,), daemon=True) for i in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    web.vote_ingestor.flush()
+
+    everything = [s for values in samples.values() for s in values]
+    return {
+        "scenario": scenario,
+        "mix": mix,
+        "duration_s": duration,
+        "concurrency": concurrency,
+        "commit": _git_commit(),
+        "total": summarize(everything, duration),
+        "ops": {op: summarize(values, duration) for op, values in samples.items()},
+        "server": {
+            "vote_ingest": web.vote_ingestor.stats(),
+            "vote_admission": web.vote_admission.stats(),
+            "sqlite": web.sqlite_db.stats(),
+            "mysql_pool": web.mysql_pool.stats(),
+            "monitor_snapshot": web.monitor_snapshot.stats(),
+            "databack_rebuilds": sum(snapshot.rebuilds for _, snapshot in web.databack_snapshots.items()),
+            "sites": web.site_index.stats(),
+        },
+    }
+
+
+def _timed(op):
+    # Per-response latency; a burst reports each of its requests.
+    started = time.perf_counter()
+    responses = op()
+    per_request = (time.perf_counter() - started) * 1000 / max(len(responses), 1)
+    return [(per_request, res.status_code) for res in responses]
+
+
+def _git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            capture_output=True, text=True, timeout=5,
+        ).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def compare(result, baseline):
+    """Per-op ratios against an earlier run (>1 means slower / higher)."""
+    out = {}
+    for op, current in result["ops"].items():
+        before = baseline.get("ops", {}).get(op)
+        if not before:
+            continue
+        out[op] = {
+            key: round(current[key] / before[key], 3) if before.get(key) and current.get(key) is not None else None
+            for key in ("p50_ms", "p95_ms", "p99_ms", "throughput_rps")
+        }
+    return {"baseline_commit": baseline.get("commit"), "ratios": out}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the radio app in-process.")
+    parser.add_argument("--scenario", choices=sorted(SCENARIOS), default="mixed")
+    parser.add_argument("--duration", type=float, default=10.0)
+    parser.add_argument("--warmup", type=float, default=2.0)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--mysql-latency-ms", type=float, default=0.0,
+                        help="simulated round-trip added to every fake MySQL query")
+    parser.add_argument("--seed-votes", type=int, default=2000)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--compare", metavar="JSON", help="earlier result to compare against")
+    args = parser.parse_args(argv)
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+
+    workdir = tempfile.mkdtemp(prefix="radio-bench-")
+    web = boot(workdir, mysql_latency=args.mysql_latency_ms / 1000.0, seed_votes=args.seed_votes)
+    result = run(web, args.scenario, args.duration, args.concurrency, warmup=args.warmup, seed=args.seed)
+    result["workdir"] = workdir
+    if baseline is not None:
+        result["compare"] = compare(result, baseline)
+    json.dump(result, sys.stdout, indent=2, default=str)
+    sys.stdout.write("\n")
+
+
+if __name__ == "__main__":
+    main()
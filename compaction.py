@@ -0,0 +1,110 @@
+import os
+import threading
+import time
+
+
+# Raw votes younger than this stay in `polls`; the live tally reads up to an
+# hour back, so the horizon is never allowed below that.
+MIN_HORIZON_MINUTES = 60
+
+
+def ensure_schema(conn):
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS polls_rollup (
+        bucket_start TEXT NOT NULL,
+        language TEXT NOT NULL,
+        genre TEXT NOT NULL,
+        count INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (bucket_start, language, genre)
+    )
+    """)
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_polls_created_language ON polls (created_at, language)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_polls_created_genre ON polls (created_at, genre)")
+
+
+def compact(conn, horizon_minutes=24 * 60):
+    """Roll votes older than the horizon into hourly rollup rows and prune them."""
+    horizon_minutes = max(int(horizon_minutes), MIN_HORIZON_MINUTES)
+    started = time.perf_counter()
+
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        cutoff = conn.execute(
+            "SELECT datetime('now', ?)", (f"-{horizon_minutes} minutes",)
+        ).fetchone()[0]
+        max_id = conn.execute(
+            "SELECT MAX(id) FROM polls WHERE created_at <= ?", (cutoff,)
+        ).fetchone()[0]
+
+        rows = 0
+        buckets = 0
+        if max_id is not None:
+            buckets = conn.execute(
+                """
+                INSERT INTO polls_rollup (bucket_start, language, genre, count)
+                SELECT strftime('%Y-%m-%d %H:00:00', created_at), language, genre, COUNT(*)
+                FROM polls
+                WHERE created_at <= ? AND id <= ?
+                GROUP BY 1, 2, 3
+                ON CONFLICT (bucket_start, language, genre)
+                DO UPDATE SET count = count + excluded.count
+                """,
+                (cutoff, max_id),
+            ).rowcount
+            rows = conn.execute(
+                "DELETE FROM polls WHERE created_at <= ? AND id <= ?",
+                (cutoff, max_id),
+            ).rowcount
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+
+    return {
+        "rows_compacted": rows,
+        "buckets_written": buckets,
+        "cutoff": cutoff,
+        "horizon_minutes": horizon_minutes,
+        "duration_ms": round((time.perf_counter() - started) * 1000, 2),
+        "finished_at": time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime()),
+    }
+
+
+class PollCompactor:
+    def __init__(self, connect, horizon_minutes=24 * 60, interval_seconds=3600):
+        self.connect = connect
+        self.horizon_minutes = horizon_minutes
+        self.interval_seconds = interval_seconds
+        self.last_report = None
+        self.last_error = None
+        self._run_lock = threading.Lock()
+        self._pid = None
+
+    def run(self):
+        with self._run_lock:
+            conn = self.connect()
+            try:
+                report = compact(conn, self.horizon_minutes)
+            except Exception as e:
+                self.last_error = str(e)
+                raise
+            finally:
+                conn.close()
+            self.last_report = report
+            self.last_error = None
+            return report
+
+    def start(self):
+        # Safe to call on every request: starts one thread per worker process.
+        if self._pid == os.getpid():
+            return
+        self._pid = os.getpid()
+        threading.Thread(target=self._loop, daemon=True).start()
+
+    def _loop(self):
+        while True:
+            time.sleep(self.interval_seconds)
+            try:
+                self.run()
+            except Exception as e:
+                print(f"Error compacting polls: {e}")
@@ -0,0 +1,158 @@
+import json
+import queue
+import threading
+
+
+def _encode(event, data):
+    return f"event: {event}\ndata: {json.dumps(data, default=str, separators=(',', ':'))}\n\n"
+
+
+def diff_rows(old, new):
+    """Delta between two lists of row dicts keyed by their `id` column."""
+    old_by_id = {row.get("id"): row for row in old or []}
+    new_by_id = {row.get("id"): row for row in new or []}
+    added = [row for key, row in new_by_id.items() if key not in old_by_id]
+    changed = [row for key, row in new_by_id.items() if key in old_by_id and old_by_id[key] != row]
+    removed = [key for key in old_by_id if key not in new_by_id]
+    if not (added or changed or removed):
+        return None
+    return {"added": added, "changed": changed, "removed": removed}
+
+
+class ChangeDetector:
+    """One polling loop per process that fans state deltas out to SSE clients.
+
+    `collect()` returns a dict of topic -> value. List values are treated as
+    rows keyed by `id` and published as added/changed/removed deltas; any
+    other value is published whole when it changes. A topic missing from a
+    collection (e.g. MySQL unreachable) is left untouched. The loop only
+    runs while at least one client is connected.
+    """
+
+    def __init__(self, collect, interval=3.0, heartbeat=15.0, backlog=100):
+        self.collect = collect
+        self.interval = interval
+        self.heartbeat = heartbeat
+        self.backlog = backlog
+        self._lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._subscribers = set()
+        self._running = False
+        self.state = {}
+        self.published = 0
+        self.dropped = 0
+
+    def poke(self):
+        """Collect immediately instead of waiting for the next interval."""
+        self._wake.set()
+
+    def stream(self):
+        q = queue.Queue(maxsize=self.backlog)
+        # Subscribe and copy the snapshot under the refresh lock so the
+        # client sees every later delta exactly once.
+        with self._refresh_lock:
+            with self._lock:
+                idle = not self._running
+            if idle:
+                try:
+                    self._refresh_locked()
+                except Exception as e:
+                    print(f"Error collecting live state: {e}")
+            with self._lock:
+                self._subscribers.add(q)
+                spawn = not self._running
+                self._running = True
+            snapshot = dict(self.state)
+        if spawn:
+            threading.Thread(target=self._loop, daemon=True).start()
+        try:
+            yield "retry: 5000\n\n"
+            yield _encode("snapshot", snapshot)
+            while True:
+                try:
+                    item = q.get(timeout=self.heartbeat)
+                except queue.Empty:
+                    yield ": ping\n\n"
+                    continue
+                if item is None:
+                    return
+                yield item
+        finally:
+            with self._lock:
+                self._subscribers.discard(q)
+
+    def poll(self, retry_ms):
+        """A stream that ends after the snapshot, for servers that cannot
+        hold a request open per client; EventSource reconnects after
+        `retry_ms`, so the page falls back to polling at that interval.
+        """
+        with self._refresh_lock:
+            try:
+                self._refresh_locked()
+            except Exception as e:
+                print(f"Error collecting live state: {e}")
+            snapshot = dict(self.state)
+        yield f"retry: {int(retry_ms)}\n\n"
+        yield _encode("snapshot", snapshot)
+
+    def _loop(self):
+        while True:
+            self._wake.wait(self.interval)
+            self._wake.clear()
+            with self._lock:
+                if not self._subscribers:
+                    self._running = False
+                    return
+            try:
+                self._refresh()
+            except Exception as e:
+                print(f"Error collecting live state: {e}")
+
+    def _refresh(self):
+        with self._refresh_lock:
+            self._refresh_locked()
+
+    def _refresh_locked(self):
+        new_state = self.collect()
+        events = []
+        for topic, value in new_state.items():
+            old = self.state.get(topic)
+            if isinstance(value, list):
+                delta = diff_rows(old, value)
+                if delta is not None:
+                    events.append(_encode(topic, delta))
+            elif topic not in self.state or old != value:
+                events.append(_encode(topic, value))
+            self.state[topic] = value
+        if events:
+            self._publish(events)
+
+    def _publish(self, events):
+        with self._lock:
+            subscribers = list(self._subscribers)
+        for q in subscribers:
+            try:
+                for item in events:
+                    q.put_nowait(item)
+            except queue.Full:
+                # A client that cannot keep up is cut loose; EventSource
+                # reconnects and starts again from a fresh snapshot.
+                with self._lock:
+                    self._subscribers.discard(q)
+                    self.dropped += 1
+                try:
+                    q.get_nowait()
+                    q.put_nowait(None)
+                except (queue.Empty, queue.Full):
+                    pass
+        self.published += len(events)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "subscribers": len(self._subscribers),
+                "running": self._running,
+                "published": self.published,
+                "dropped": self.dropped,
+            }
@@ -0,0 +1,108 @@
+import heapq
+import itertools
+import os
+import threading
+import time
+
+
+class ExpiryScheduler:
+    """One timer thread per process that expires rows at their due time.
+
+    Each entry carries the row's version (its `last_updated` value) so the
+    delete only removes the exact row that was scheduled; a newer write to
+    the same id survives. Scheduling the same (table, id) again supersedes
+    the earlier timer. Entries falling due within `batch_window` seconds of
+    each other are handed to `expire(table, [(id, version), ...])` together.
+    """
+
+    def __init__(self, expire, batch_window=0.25):
+        self.expire = expire
+        self.batch_window = batch_window
+        self._cond = threading.Condition()
+        self._heap = []
+        self._latest = {}
+        self._seq = itertools.count()
+        self._pid = None
+        self.executed = 0
+        self.superseded = 0
+        self.failed = 0
+        self.batches = 0
+        self.last_lateness_ms = 0.0
+        self.max_lateness_ms = 0.0
+        self.total_lateness_ms = 0.0
+
+    def schedule(self, table, row_id, version, ttl):
+        self.start()
+        due = time.monotonic() + ttl
+        seq = next(self._seq)
+        with self._cond:
+            if (table, row_id) in self._latest:
+                self.superseded += 1
+            self._latest[(table, row_id)] = seq
+            heapq.heappush(self._heap, (due, seq, table, row_id, version))
+            self._cond.notify()
+
+    def start(self):
+        if self._pid == os.getpid():
+            return
+        self._pid = os.getpid()
+        threading.Thread(target=self._loop, daemon=True).start()
+
+    def _loop(self):
+        while True:
+            due_entries = self._next_batch()
+            by_table = {}
+            now = time.monotonic()
+            for due, _, table, row_id, version in due_entries:
+                by_table.setdefault(table, []).append((row_id, version))
+                lateness_ms = max(now - due, 0) * 1000
+                with self._cond:
+                    self.last_lateness_ms = lateness_ms
+                    self.max_lateness_ms = max(self.max_lateness_ms, lateness_ms)
+                    self.total_lateness_ms += lateness_ms
+            for table, keys in by_table.items():
+                try:
+                    self.expire(table, keys)
+                    with self._cond:
+                        self.executed += len(keys)
+                        self.batches += 1
+                except Exception as e:
+                    with self._cond:
+                        self.failed += len(keys)
+                    print(f"Error expiring {table} rows: {e}")
+
+    def _next_batch(self):
+        with self._cond:
+            while True:
+                if not self._heap:
+                    self._cond.wait()
+                    continue
+                wait = self._heap[0][0] - time.monotonic()
+                if wait > 0:
+                    self._cond.wait(wait)
+                    continue
+                horizon = time.monotonic() + self.batch_window
+                batch = []
+                while self._heap and self._heap[0][0] <= horizon:
+                    entry = heapq.heappop(self._heap)
+                    key = (entry[2], entry[3])
+                    if self._latest.get(key) != entry[1]:
+                        continue
+                    del self._latest[key]
+                    batch.append(entry)
+                if batch:
+                    return batch
+
+    def stats(self):
+        with self._cond:
+            done = self.executed + self.failed
+            return {
+                "pending": len(self._latest),
+                "executed": self.executed,
+                "failed": self.failed,
+                "superseded": self.superseded,
+                "batches": self.batches,
+                "last_lateness_ms": round(self.last_lateness_ms, 2),
+                "max_lateness_ms": round(self.max_lateness_ms, 2),
+                "avg_lateness_ms": round(self.total_lateness_ms / done, 2) if done else 0.0,
+            }
@@ -0,0 +1,260 @@
+import json
+import threading
+import time
+
+import requests
+
+
+LOCATIONIQ_BASE = "https://us1.locationiq.com/v1"
+
+
+def ensure_schema(conn):
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS geocode_cache (
+        key TEXT PRIMARY KEY,
+        payload TEXT NOT NULL,
+        found INTEGER NOT NULL,
+        fetched_at REAL NOT NULL,
+        last_used REAL NOT NULL
+    )
+    """)
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_geocode_cache_last_used ON geocode_cache (last_used)")
+
+
+class RateLimited(Exception):
+    pass
+
+
+class UpstreamError(Exception):
+    pass
+
+
+class TokenBucket:
+    """Allows `rate` calls per second with bursts of up to `burst`."""
+
+    def __init__(self, rate, burst):
+        self.rate = float(rate)
+        self.burst = float(burst)
+        self._tokens = float(burst)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, timeout=0.0):
+        deadline = time.monotonic() + timeout
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return True
+                wait = (1 - self._tokens) / self.rate
+            if now + wait > deadline:
+                return False
+            time.sleep(wait)
+
+
+class _Flight:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class Geocoder:
+    """LocationIQ search/reverse lookups behind a persistent cache.
+
+    Results live in the SQLite `geocode_cache` table for `ttl` seconds
+    (`miss_ttl` for "not found"). Every 100 inserts the table is trimmed
+    back to `max_entries`, least recently used rows first. Reverse lookups
+    are keyed on coordinates rounded to `precision` decimals (~11 m at 4).
+    Concurrent
+    identical lookups share one upstream call, and upstream calls are
+    limited by a token bucket; when it is empty a stale entry is served if
+    there is one, otherwise RateLimited is raised.
+
+    `db()` returns the calling thread's connection, which is not closed here.
+    """
+
+    def __init__(self, api_key, db, ttl=30 * 86400, miss_ttl=86400, max_entries=5000, precision=4,
+                 rate=2.0, burst=4, acquire_timeout=1.0, timeout=8, observe=None):
+        self.api_key = api_key
+        self.db = db
+        self.ttl = ttl
+        self.miss_ttl = miss_ttl
+        self.max_entries = max_entries
+        self.precision = precision
+        self.acquire_timeout = acquire_timeout
+        self.timeout = timeout
+        # observe(endpoint, seconds, ok) after every upstream call.
+        self.observe = observe
+        self.bucket = TokenBucket(rate, burst)
+        self._session = requests.Session()
+        self._lock = threading.Lock()
+        self._inflight = {}
+        self._inserts = 0
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.limited = 0
+        self.errors = 0
+
+    # -------------------- LOOKUPS --------------------
+
+    def search(self, query):
+        """List of LocationIQ matches for a place name ([] when none)."""
+        query = " ".join(query.split()).lower()
+        return self._lookup(f"search:{query}", "search", {"q": query})
+
+    def reverse(self, lat, lon):
+        """LocationIQ reverse payload for the rounded coordinates, or None."""
+        lat = round(float(lat), self.precision)
+        lon = round(float(lon), self.precision)
+        key = f"reverse:{lat:.{self.precision}f},{lon:.{self.precision}f}"
+        return self._lookup(key, "reverse", {"lat": lat, "lon": lon})
+
+    def _lookup(self, key, endpoint, params):
+        cached = self._cache_get(key)
+        if cached is not None and cached[1]:
+            with self._lock:
+                self.hits += 1
+            return cached[0]
+
+        with self._lock:
+            flight = self._inflight.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._inflight[key] = _Flight()
+            else:
+                self.coalesced += 1
+        if not leader:
+            flight.done.wait(self.timeout + self.acquire_timeout + 1)
+            if flight.error is not None:
+                raise flight.error
+            return flight.result
+
+        try:
+            flight.result = self._fetch_or_stale(key, endpoint, params, cached)
+            return flight.result
+        except Exception as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+            flight.done.set()
+
+    def _fetch_or_stale(self, key, endpoint, params, cached):
+        if not self.bucket.acquire(self.acquire_timeout):
+            with self._lock:
+                self.limited += 1
+            if cached is not None:
+                with self._lock:
+                    self.stale_hits += 1
+                return cached[0]
+            raise RateLimited("geocoding rate limit reached, try again shortly")
+        with self._lock:
+            self.misses += 1
+        try:
+            result, found = self._fetch(endpoint, params)
+        except UpstreamError:
+            with self._lock:
+                self.errors += 1
+            if cached is not None:
+                with self._lock:
+                    self.stale_hits += 1
+                return cached[0]
+            raise
+        self._cache_put(key, result, found)
+        return result
+
+    # -------------------- UPSTREAM --------------------
+
+    def _fetch(self, endpoint, params):
+        started = time.perf_counter()
+        ok = False
+        try:
+            try:
+                res = self._session.get(
+                    f"{LOCATIONIQ_BASE}/{endpoint}.php",
+                    params=dict(params, key=self.api_key, format="json"),
+                    timeout=self.timeout,
+                )
+                data = res.json()
+            except (requests.RequestException, ValueError) as e:
+                raise UpstreamError(str(e))
+            if res.status_code == 404:
+                # "Unable to geocode" is an answer worth caching.
+                ok = True
+                return ([] if endpoint == "search" else None), False
+            if not res.ok:
+                message = data.get("error") if isinstance(data, dict) else None
+                raise UpstreamError(message or f"HTTP {res.status_code}")
+            ok = True
+            return data, bool(data)
+        finally:
+            if self.observe is not None:
+                self.observe(endpoint, time.perf_counter() - started, ok)
+
+    # -------------------- CACHE --------------------
+
+    def _cache_get(self, key):
+        """(payload, fresh) or None."""
+        conn = self.db()
+        row = conn.execute(
+            "SELECT payload, found, fetched_at, last_used FROM geocode_cache WHERE key=?", (key,)
+        ).fetchone()
+        if row is None:
+            return None
+        payload, found, fetched_at, last_used = row
+        now = time.time()
+        fresh = now - fetched_at < (self.ttl if found else self.miss_ttl)
+        if fresh and now - last_used > 60:
+            # Recency only needs minute resolution for LRU; skip the write
+            # on most hits.
+            conn.execute("UPDATE geocode_cache SET last_used=? WHERE key=?", (now, key))
+            conn.commit()
+        return json.loads(payload), fresh
+
+    def _cache_put(self, key, result, found):
+        now = time.time()
+        conn = self.db()
+        conn.execute(
+            """
+            INSERT INTO geocode_cache (key, payload, found, fetched_at, last_used)
+            VALUES (?, ?, ?, ?, ?)
+            ON CONFLICT (key) DO UPDATE SET
+                payload = excluded.payload,
+                found = excluded.found,
+                fetched_at = excluded.fetched_at,
+                last_used = excluded.last_used
+            """,
+            (key, json.dumps(result), int(found), now, now),
+        )
+        with self._lock:
+            self._inserts += 1
+            evict = self._inserts % 100 == 0
+        if evict:
+            conn.execute(
+                """
+                DELETE FROM geocode_cache WHERE key IN (
+                    SELECT key FROM geocode_cache ORDER BY last_used DESC LIMIT -1 OFFSET ?
+                )
+                """,
+                (self.max_entries,),
+            )
+        conn.commit()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "stale_hits": self.stale_hits,
+                "misses": self.misses,
+                "coalesced": self.coalesced,
+                "rate_limited": self.limited,
+                "errors": self.errors,
+                "inflight": len(self._inflight),
+            }
@@ -0,0 +1,195 @@
+import atexit
+import os
+import queue
+import threading
+import time
+from datetime import datetime, timezone
+
+from sites import DEFAULT_SITE_ID
+
+
+class VoteIngestor:
+    """Bounded in-memory vote queue drained by one group-committing writer."""
+
+    def __init__(
+        self,
+        connect,
+        on_insert=None,
+        max_queue=10000,
+        flush_interval_ms=50,
+        flush_batch=500,
+        enqueue_timeout=0.5,
+        sync_timeout=5.0,
+        sync_durability=False,
+        max_retries=3,
+    ):
+        self.connect = connect
+        self.on_insert = on_insert
+        self.max_queue = max_queue
+        self.flush_interval = flush_interval_ms / 1000.0
+        self.flush_batch = flush_batch
+        self.enqueue_timeout = enqueue_timeout
+        self.sync_timeout = sync_timeout
+        self.sync_durability = sync_durability
+        self.max_retries = max_retries
+
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._stats_lock = threading.Lock()
+        self._local = threading.local()
+        self._pid = None
+        self.accepted = 0
+        self.rejected = 0
+        self.written = 0
+        self.dropped = 0
+        self.batches = 0
+        self.last_flush_ms = 0.0
+        self.max_flush_ms = 0.0
+        self.total_flush_ms = 0.0
+
+    # -------------------- PRODUCER --------------------
+
+    def submit(self, language, genre, sync=None, site_id=DEFAULT_SITE_ID):
+        """Queue a validated vote. Returns False when the queue is saturated."""
+        self.start()
+        sync = self.sync_durability if sync is None else sync
+        done = threading.Event() if sync else None
+        item = [language, genre, time.time(), done, None, site_id]
+        try:
+            self._queue.put(item, timeout=self.enqueue_timeout)
+        except queue.Full:
+            with self._stats_lock:
+                self.rejected += 1
+            return False
+        with self._stats_lock:
+            self.accepted += 1
+        if done is None:
+            return True
+        if not done.wait(self.sync_timeout):
+            raise TimeoutError("vote was queued but not yet committed")
+        if item[4] is not None:
+            raise item[4]
+        return True
+
+    # -------------------- WRITER --------------------
+
+    def start(self):
+        if self._pid == os.getpid():
+            return
+        self._pid = os.getpid()
+        threading.Thread(target=self._loop, daemon=True).start()
+        atexit.register(self.flush)
+
+    def _loop(self):
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.flush_batch:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            self._write_with_retry(batch)
+
+    def flush(self):
+        batch = []
+        while True:
+            try:
+                batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        if batch:
+            self._write_with_retry(batch)
+
+    def _write_with_retry(self, batch):
+        for attempt in range(self.max_retries):
+            try:
+                inserted = self._write(batch)
+            except Exception as e:
+                error = e
+                time.sleep(0.05 * (2 ** attempt))
+                continue
+            # Outside the retry: the batch is committed, so a failing
+            # callback must not get it inserted again.
+            self._committed(batch, inserted)
+            return
+        print(f"Error writing {len(batch)} votes: {error}")
+        with self._stats_lock:
+            self.dropped += len(batch)
+        for item in batch:
+            item[4] = error
+            if item[3] is not None:
+                item[3].set()
+
+    def _connection(self):
+        # The writer thread keeps one connection (and its statement cache)
+        # for its lifetime; an atexit flush gets its own.
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._local.conn = self.connect()
+        return conn
+
+    def _write(self, batch):
+        started = time.perf_counter()
+        conn = self._connection()
+        inserted = []
+        try:
+            # Take the write lock up front so time spent queued behind
+            # another writer is spent in the busy handler, not mid-batch.
+            conn.execute("BEGIN IMMEDIATE")
+            cur = conn.cursor()
+            for language, genre, ts, _, _, site_id in batch:
+                created_at = datetime.fromtimestamp(ts, tz=timezone.utc).strftime("%Y-%m-%d %H:%M:%S")
+                cur.execute(
+                    "INSERT INTO polls (site_id, language, genre, created_at) VALUES (?, ?, ?, ?)",
+                    (site_id, language, genre, created_at),
+                )
+                inserted.append((cur.lastrowid, site_id, language, genre, ts))
+            conn.commit()
+        except Exception:
+            # Start the retry on a fresh connection.
+            self._local.conn = None
+            try:
+                conn.rollback()
+            finally:
+                conn.close()
+            raise
+
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        with self._stats_lock:
+            self.written += len(batch)
+            self.batches += 1
+            self.last_flush_ms = elapsed_ms
+            self.max_flush_ms = max(self.max_flush_ms, elapsed_ms)
+            self.total_flush_ms += elapsed_ms
+        return inserted
+
+    def _committed(self, batch, inserted):
+        if self.on_insert is not None:
+            for row in inserted:
+                try:
+                    self.on_insert(*row)
+                except Exception as e:
+                    print(f"Error in vote insert callback for row {row[0]}: {e}")
+        for item in batch:
+            if item[3] is not None:
+                item[3].set()
+
+    # -------------------- STATS --------------------
+
+    def stats(self):
+        with self._stats_lock:
+            return {
+                "queue_depth": self._queue.qsize(),
+                "max_queue": self.max_queue,
+                "accepted": self.accepted,
+                "rejected": self.rejected,
+                "written": self.written,
+                "dropped": self.dropped,
+                "batches": self.batches,
+                "last_flush_ms": round(self.last_flush_ms, 2),
+                "max_flush_ms": round(self.max_flush_ms, 2),
+                "avg_flush_ms": round(self.total_flush_ms / self.batches, 2) if self.batches else 0.0,
+            }
@@ -0,0 +1,142 @@
+import threading
+import time
+
+import mysql.connector
+
+
+AI_ALERT_LIMIT = 5
+USER_ALERT_LIMIT = 20
+
+# Four result sets in one round-trip. Callers slice the alert lists to the
+# length their page shows.
+SNAPSHOT_SQL = f"""
+SELECT * FROM status_server WHERE id=1;
+SELECT * FROM music WHERE id=1;
+SELECT * FROM ai_alert ORDER BY last_updated DESC LIMIT {AI_ALERT_LIMIT};
+SELECT * FROM user_alert ORDER BY last_updated DESC LIMIT {USER_ALERT_LIMIT}
+"""
+
+# Serve the alert ORDER BY last_updated DESC LIMIT reads above.
+INDEXES = [
+    ("idx_ai_alert_last_updated", "CREATE INDEX idx_ai_alert_last_updated ON ai_alert (last_updated)"),
+    ("idx_user_alert_last_updated", "CREATE INDEX idx_user_alert_last_updated ON user_alert (last_updated)"),
+]
+
+ER_DUP_KEYNAME = 1061
+
+
+def ensure_indexes(conn):
+    """Create any missing INDEXES and return the names of those created.
+
+    This is DDL on the shared remote database, so it is an admin step
+    (POST /admin/mysql_indexes) and never runs from a read.
+    """
+    created = []
+    cur = conn.cursor()
+    for name, statement in INDEXES:
+        try:
+            cur.execute(statement)
+        except mysql.connector.Error as e:
+            if e.errno != ER_DUP_KEYNAME:
+                raise
+        else:
+            created.append(name)
+    cur.close()
+    return created
+
+
+def fetch_snapshot(conn):
+    cur = conn.cursor(dictionary=True)
+    cur.execute(SNAPSHOT_SQL)
+    sets = [cur.fetchall()]
+    while cur.nextset():
+        sets.append(cur.fetchall())
+    cur.close()
+    return from_result_sets(sets)
+
+
+def from_result_sets(sets):
+    status, music, ai_alerts, user_alerts = sets
+    return {
+        "status": status[0] if status else None,
+        "music": music[0] if music else None,
+        "ai_alerts": list(ai_alerts),
+        "user_alerts": list(user_alerts),
+    }
+
+
+class MonitorSnapshot:
+    """Short-TTL cache of the monitor tables shared by /monitor and /admin.
+
+    Concurrent misses wait for a single fetch instead of each paying their
+    own WAN round-trip. Mutation routes call invalidate() so operators see
+    their own changes on the next render.
+    """
+
+    def __init__(self, borrow, ttl=3.0):
+        self.borrow = borrow
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._fetch_lock = threading.Lock()
+        self._data = None
+        self._fetched_at = 0.0
+        self._generation = 0
+        self.last_read = 0.0
+        self.hits = 0
+        self.fetches = 0
+        self.last_fetch_ms = 0.0
+
+    def get(self):
+        self.last_read = time.monotonic()
+        with self._lock:
+            if self._data is not None and time.monotonic() - self._fetched_at < self.ttl:
+                self.hits += 1
+                return self._data
+        with self._fetch_lock:
+            with self._lock:
+                # Another request may have refreshed while we waited.
+                if self._data is not None and time.monotonic() - self._fetched_at < self.ttl:
+                    self.hits += 1
+                    return self._data
+                generation = self._generation
+            started = time.perf_counter()
+            with self.borrow() as conn:
+                data = fetch_snapshot(conn)
+            with self._lock:
+                self.fetches += 1
+                self.last_fetch_ms = (time.perf_counter() - started) * 1000
+                if self._generation == generation:
+                    self._data = data
+                    self._fetched_at = time.monotonic()
+            return data
+
+    @property
+    def generation(self):
+        return self._generation
+
+    def expires_in(self):
+        with self._lock:
+            if self._data is None:
+                return 0.0
+            return self._fetched_at + self.ttl - time.monotonic()
+
+    def put(self, data, generation):
+        """Store a snapshot fetched elsewhere unless it was invalidated meanwhile."""
+        with self._lock:
+            if self._generation == generation:
+                self._data = data
+                self._fetched_at = time.monotonic()
+
+    def invalidate(self):
+        with self._lock:
+            self._data = None
+            self._generation += 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "fetches": self.fetches,
+                "last_fetch_ms": round(self.last_fetch_ms, 2),
+                "cached": self._data is not None,
+            }
@@ -0,0 +1,227 @@
+import queue
+import threading
+import time
+from contextlib import contextmanager
+
+import mysql.connector
+
+
+class PoolTimeout(Exception):
+    pass
+
+
+class _TimedCursor:
+    def __init__(self, cursor, observe):
+        self._cursor = cursor
+        self._observe = observe
+
+    def _timed(self, method, *args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return method(*args, **kwargs)
+        finally:
+            self._observe("query", time.perf_counter() - started)
+
+    def execute(self, *args, **kwargs):
+        return self._timed(self._cursor.execute, *args, **kwargs)
+
+    def fetchone(self):
+        return self._timed(self._cursor.fetchone)
+
+    def fetchall(self):
+        return self._timed(self._cursor.fetchall)
+
+    def nextset(self):
+        return self._timed(self._cursor.nextset)
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+
+class _TimedConnection:
+    def __init__(self, conn, observe):
+        self._conn = conn
+        self._observe = observe
+
+    def cursor(self, *args, **kwargs):
+        return _TimedCursor(self._conn.cursor(*args, **kwargs), self._observe)
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+
+class MySQLPool:
+    """Bounded pool of reusable mysql.connector connections.
+
+    `observe(event, seconds)`, when given, receives "connect" for every
+    handshake and "query" for every cursor execute/fetch round-trip.
+    """
+
+    def __init__(self, config, size=5, borrow_timeout=5.0, ping_after=10.0, connect=None, observe=None):
+        self.config = dict(config)
+        self.observe = observe
+        self.size = size
+        self.borrow_timeout = borrow_timeout
+        self.ping_after = ping_after
+        self._connect = connect or mysql.connector.connect
+        self._idle = queue.LifoQueue()
+        self._lock = threading.Lock()
+        self._open = 0
+        self.in_use = 0
+        self.waits = 0
+        self.wait_ms = 0.0
+        self.timeouts = 0
+        self.handshakes = 0
+        self.handshake_ms = 0.0
+        self.reconnects = 0
+        self.discarded = 0
+
+    @contextmanager
+    def connection(self):
+        conn = self._borrow()
+        broken = False
+        try:
+            yield conn if self.observe is None else _TimedConnection(conn, self.observe)
+        except mysql.connector.Error as e:
+            broken = isinstance(e, (mysql.connector.InterfaceError, mysql.connector.OperationalError))
+            raise
+        finally:
+            self._release(conn, broken)
+
+    # -------------------- CHECKOUT --------------------
+
+    def _borrow(self):
+        entry = self._take()
+        if entry is None:
+            return self._open_new()
+        conn, returned_at = entry
+        if time.monotonic() - returned_at >= self.ping_after and not self._alive(conn):
+            conn = self._reconnect(conn)
+        with self._lock:
+            self.in_use += 1
+        return conn
+
+    def _take(self):
+        deadline = time.monotonic() + self.borrow_timeout
+        waited = False
+        while True:
+            entry = self._take_idle()
+            if entry is not None:
+                return entry
+            with self._lock:
+                if self._open < self.size:
+                    self._open += 1
+                    return None
+                if not waited:
+                    self.waits += 1
+                    waited = True
+            remaining = deadline - time.monotonic()
+            started = time.perf_counter()
+            try:
+                # A None entry is a wake-up from a discarded connection.
+                entry = self._idle.get(timeout=max(remaining, 0))
+            except queue.Empty:
+                with self._lock:
+                    self.timeouts += 1
+                raise PoolTimeout(f"no MySQL connection free after {self.borrow_timeout}s")
+            finally:
+                with self._lock:
+                    self.wait_ms += (time.perf_counter() - started) * 1000
+            if entry is not None:
+                return entry
+
+    def _take_idle(self):
+        while True:
+            try:
+                entry = self._idle.get_nowait()
+            except queue.Empty:
+                return None
+            if entry is not None:
+                return entry
+
+    def _open_new(self):
+        try:
+            conn = self._handshake()
+        except Exception:
+            self._discard_slot()
+            raise
+        with self._lock:
+            self.in_use += 1
+        return conn
+
+    def _handshake(self):
+        started = time.perf_counter()
+        try:
+            conn = self._connect(**self.config)
+        finally:
+            # Failed handshakes (timeouts, DNS) cost time too.
+            if self.observe is not None:
+                self.observe("connect", time.perf_counter() - started)
+        with self._lock:
+            self.handshakes += 1
+            self.handshake_ms += (time.perf_counter() - started) * 1000
+        return conn
+
+    def _alive(self, conn):
+        try:
+            return conn.is_connected()
+        except Exception:
+            return False
+
+    def _reconnect(self, conn):
+        with self._lock:
+            self.reconnects += 1
+        try:
+            conn.close()
+        except Exception:
+            pass
+        try:
+            return self._handshake()
+        except Exception:
+            self._discard_slot()
+            raise
+
+    # -------------------- RETURN --------------------
+
+    def _release(self, conn, broken):
+        with self._lock:
+            self.in_use -= 1
+        if not broken:
+            try:
+                # Never hand out a connection holding an open transaction
+                # (or a stale REPEATABLE READ snapshot) to the next borrower.
+                if conn.in_transaction:
+                    conn.rollback()
+            except Exception:
+                broken = True
+        if broken:
+            with self._lock:
+                self.discarded += 1
+            try:
+                conn.close()
+            except Exception:
+                pass
+            self._discard_slot()
+            return
+        self._idle.put((conn, time.monotonic()))
+
+    def _discard_slot(self):
+        with self._lock:
+            self._open -= 1
+        self._idle.put(None)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "size": self.size,
+                "open": self._open,
+                "in_use": self.in_use,
+                "idle": self._open - self.in_use,
+                "waits": self.waits,
+                "wait_ms": round(self.wait_ms, 2),
+                "timeouts": self.timeouts,
+                "handshakes": self.handshakes,
+                "avg_handshake_ms": round(self.handshake_ms / self.handshakes, 2) if self.handshakes else 0.0,
+                "reconnects": self.reconnects,
+                "discarded": self.discarded,
+            }
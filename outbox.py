@@ -0,0 +1,366 @@
+import json
+import os
+import socket
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+
+import mysql.connector
+
+
+def ensure_schema(conn):
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS mysql_outbox (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        idempotency_key TEXT NOT NULL UNIQUE,
+        op TEXT NOT NULL,
+        args TEXT NOT NULL,
+        created_at REAL NOT NULL,
+        attempts INTEGER NOT NULL DEFAULT 0,
+        next_attempt REAL NOT NULL DEFAULT 0,
+        last_error TEXT,
+        dead INTEGER NOT NULL DEFAULT 0
+    )
+    """)
+    # Keys of rows already applied and removed, so a client retrying
+    # after the drain is still recognised. Kept for retention_seconds.
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS mysql_outbox_done (
+        idempotency_key TEXT PRIMARY KEY,
+        applied_at REAL NOT NULL
+    )
+    """)
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS mysql_outbox_lease (
+        id INTEGER PRIMARY KEY CHECK (id = 1),
+        owner TEXT,
+        expires_at REAL NOT NULL
+    )
+    """)
+
+
+# Remembers which outbox rows MySQL has already applied, so a batch that
+# committed remotely but was not yet removed locally is not replayed.
+REMOTE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS outbox_applied (
+    idempotency_key VARCHAR(64) PRIMARY KEY,
+    applied_at DATETIME NOT NULL
+)
+"""
+
+KEY_MAX_LENGTH = 64
+
+# Failures caused by the row itself (bad data, a constraint, malformed
+# args). Anything else - pool timeouts, dropped connections, a server
+# restart - says nothing about the row and is retried for as long as it
+# takes.
+ROW_ERRORS = (mysql.connector.DataError, mysql.connector.IntegrityError, KeyError, TypeError, ValueError)
+
+
+def mysql_now():
+    """Current UTC time as a MySQL DATETIME literal.
+
+    NOW() follows the session time zone; it only matches this because the
+    app's MySQL sessions are set to UTC (MYSQL_TIME_ZONE in app.py).
+    """
+    return datetime.now(timezone.utc).strftime("%Y-%m-%d %H:%M:%S")
+
+
+def parse_mysql_time(value):
+    return datetime.strptime(value, "%Y-%m-%d %H:%M:%S")
+
+
+class MySQLOutbox:
+    """Durable write-behind queue for control writes to the remote MySQL.
+
+    enqueue() records an operation in the local `mysql_outbox` table and
+    returns at once. A drainer thread applies pending rows to MySQL in id
+    order, up to `batch_size` per transaction, and removes them locally
+    once MySQL has committed. Each row's idempotency key is inserted into
+    the remote `outbox_applied` table in the same transaction as its
+    writes, so a retried batch skips what already landed.
+
+    Rows apply strictly in order, so a failing head row holds back the
+    whole queue. A batch that fails on a row error (ROW_ERRORS) is retried
+    one row at a time to find the bad row, which backs off exponentially
+    (capped at `max_backoff`) and after `max_attempts` such failures is
+    parked with dead=1 so the rest can go through; parked rows show in
+    stats() and /metrics. Transport errors never count towards parking:
+    while MySQL is unreachable the queue backs off and keeps every row.
+    Only the process holding the lease row drains, which keeps the apply
+    order across workers.
+
+    Operations are registered with register(name, apply, overlay):
+    `apply(cursor, args)` runs the MySQL statements and `overlay(state,
+    args)` replays a pending row onto a monitor snapshot, so overlay() can
+    show operators their own writes before MySQL has them.
+
+    `db()` returns the calling thread's SQLite connection; `borrow()` is a
+    context manager yielding a MySQL connection.
+    """
+
+    def __init__(self, db, borrow, batch_size=50, interval=1.0, lease_seconds=30, max_attempts=10,
+                 max_backoff=60, retention_seconds=86400, on_applied=None):
+        self.db = db
+        self.borrow = borrow
+        self.batch_size = batch_size
+        self.interval = interval
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self.max_backoff = max_backoff
+        self.retention_seconds = retention_seconds
+        # Called after a batch commits in MySQL, before its rows leave the
+        # outbox, so fresh reads never fall between snapshot and overlay.
+        self.on_applied = on_applied
+        self._ops = {}
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._pid = None
+        self._owner = None
+        self._lease_until = 0.0
+        self._isolate = False
+        self._outages = 0
+        self._remote_ready = False
+        self._purged_at = 0.0
+        self._local_purged_at = 0.0
+        self.enqueued = 0
+        self.deduplicated = 0
+        self.applied = 0
+        self.duplicates = 0
+        self.batches = 0
+        self.failures = 0
+        self.transport_failures = 0
+        self.parked = 0
+        self.last_error = None
+        self.last_batch_ms = 0.0
+        self.last_apply_lag_ms = 0.0
+
+    def register(self, name, apply, overlay=None):
+        self._ops[name] = (apply, overlay)
+
+    # -------------------- ENQUEUE --------------------
+
+    def enqueue(self, op, args, key=None):
+        """Queue `op(args)` for MySQL; False if `key` was seen before.
+
+        Enqueueing a key that is still queued, or was applied within
+        `retention_seconds`, is a no-op, so a client retrying a request
+        with the same key does not repeat the write. Callers skip their
+        own side effects (timers and the like) when this returns False.
+        """
+        if op not in self._ops:
+            raise KeyError(f"unknown outbox operation {op}")
+        key = key or uuid.uuid4().hex
+        conn = self.db()
+        with conn:
+            # One statement, so a drain committing in between cannot let
+            # the key through twice.
+            cur = conn.execute(
+                """
+                INSERT OR IGNORE INTO mysql_outbox (idempotency_key, op, args, created_at)
+                SELECT ?, ?, ?, ?
+                WHERE NOT EXISTS (SELECT 1 FROM mysql_outbox_done WHERE idempotency_key=?)
+                """,
+                (key, op, json.dumps(args), time.time(), key),
+            )
+        queued = cur.rowcount > 0
+        with self._lock:
+            if queued:
+                self.enqueued += 1
+            else:
+                self.deduplicated += 1
+        self.start()
+        self._wake.set()
+        return queued
+
+    def pending(self):
+        rows = self.db().execute(
+            "SELECT op, args FROM mysql_outbox WHERE dead=0 ORDER BY id"
+        ).fetchall()
+        return [(op, json.loads(args)) for op, args in rows]
+
+    def overlay(self, state):
+        """Copy of a monitor snapshot with the pending writes applied."""
+        pending = self.pending()
+        if not pending:
+            return state
+        state = {key: list(value) if isinstance(value, list) else value for key, value in state.items()}
+        for op, args in pending:
+            overlay = self._ops.get(op, (None, None))[1]
+            if overlay is not None:
+                overlay(state, args)
+        return state
+
+    # -------------------- DRAIN --------------------
+
+    def start(self):
+        if self._pid == os.getpid():
+            return
+        self._pid = os.getpid()
+        self._owner = f"{socket.gethostname()}:{self._pid}"
+        self._lease_until = 0.0
+        threading.Thread(target=self._loop, daemon=True).start()
+
+    def _loop(self):
+        while True:
+            self._wake.wait(self.interval)
+            self._wake.clear()
+            try:
+                while self.drain():
+                    pass
+            except Exception as e:
+                print(f"Error draining MySQL outbox: {e}")
+
+    def drain(self):
+        """Apply the next batch if it is due; returns the number of rows done."""
+        conn = self.db()
+        head = conn.execute(
+            "SELECT next_attempt FROM mysql_outbox WHERE dead=0 ORDER BY id LIMIT 1"
+        ).fetchone()
+        if head is None or head[0] > time.time() or not self._hold_lease(conn):
+            return 0
+        rows = conn.execute(
+            """
+            SELECT id, idempotency_key, op, args, created_at, attempts
+            FROM mysql_outbox WHERE dead=0 ORDER BY id LIMIT ?
+            """,
+            (1 if self._isolate else self.batch_size,),
+        ).fetchall()
+        if not rows:
+            return 0
+
+        started = time.perf_counter()
+        try:
+            applied, duplicates = self._apply(rows)
+        except Exception as e:
+            self._failed(conn, rows, e)
+            return 0
+        if self.on_applied is not None:
+            self.on_applied()
+        now = time.time()
+        with conn:
+            conn.executemany("DELETE FROM mysql_outbox WHERE id=?", [(row["id"],) for row in rows])
+            conn.executemany(
+                "INSERT OR REPLACE INTO mysql_outbox_done (idempotency_key, applied_at) VALUES (?, ?)",
+                [(row["idempotency_key"], now) for row in rows],
+            )
+            if time.monotonic() - self._local_purged_at > 3600:
+                conn.execute("DELETE FROM mysql_outbox_done WHERE applied_at < ?", (now - self.retention_seconds,))
+                self._local_purged_at = time.monotonic()
+
+        with self._lock:
+            self._isolate = False
+            self._outages = 0
+            self.applied += applied
+            self.duplicates += duplicates
+            self.batches += 1
+            self.last_batch_ms = (time.perf_counter() - started) * 1000
+            self.last_apply_lag_ms = (time.time() - rows[-1]["created_at"]) * 1000
+        return len(rows)
+
+    def _apply(self, rows):
+        applied = duplicates = 0
+        with self.borrow() as mysql_conn:
+            cur = mysql_conn.cursor()
+            if not self._remote_ready:
+                cur.execute(REMOTE_SCHEMA)
+                self._remote_ready = True
+            now = mysql_now()
+            for row in rows:
+                cur.execute(
+                    "INSERT IGNORE INTO outbox_applied (idempotency_key, applied_at) VALUES (%s, %s)",
+                    (row["idempotency_key"], now),
+                )
+                if cur.rowcount == 0:
+                    duplicates += 1
+                    continue
+                apply = self._ops[row["op"]][0]
+                apply(cur, json.loads(row["args"]))
+                applied += 1
+            if time.monotonic() - self._purged_at > 3600:
+                cutoff = datetime.now(timezone.utc) - timedelta(seconds=self.retention_seconds)
+                cur.execute(
+                    "DELETE FROM outbox_applied WHERE applied_at < %s",
+                    (cutoff.strftime("%Y-%m-%d %H:%M:%S"),),
+                )
+                self._purged_at = time.monotonic()
+            mysql_conn.commit()
+        return applied, duplicates
+
+    def _failed(self, conn, rows, error):
+        message = f"{type(error).__name__}: {error}"
+        if not isinstance(error, ROW_ERRORS):
+            with self._lock:
+                self.transport_failures += 1
+                self.last_error = message
+                self._outages += 1
+                backoff = min(self.max_backoff, 2 ** self._outages)
+            # Hold the queue without charging the head row an attempt.
+            with conn:
+                conn.execute(
+                    "UPDATE mysql_outbox SET next_attempt=?, last_error=? WHERE id=?",
+                    (time.time() + backoff, message, rows[0]["id"]),
+                )
+            return
+        with self._lock:
+            self.failures += 1
+            self.last_error = message
+            if len(rows) > 1:
+                # Find the row that fails by retrying them one at a time.
+                self._isolate = True
+                return
+        head = rows[0]
+        attempts = head["attempts"] + 1
+        dead = attempts >= self.max_attempts
+        with conn:
+            conn.execute(
+                "UPDATE mysql_outbox SET attempts=?, next_attempt=?, last_error=?, dead=? WHERE id=?",
+                (attempts, time.time() + min(self.max_backoff, 2 ** attempts), message, int(dead), head["id"]),
+            )
+        if dead:
+            with self._lock:
+                self.parked += 1
+            print(f"Parked MySQL outbox row {head['id']} ({head['op']}) after {attempts} attempts: {message}")
+
+    def _hold_lease(self, conn):
+        now = time.time()
+        if now < self._lease_until - self.lease_seconds / 2:
+            return True
+        with conn:
+            conn.execute("INSERT OR IGNORE INTO mysql_outbox_lease (id, owner, expires_at) VALUES (1, NULL, 0)")
+            cur = conn.execute(
+                "UPDATE mysql_outbox_lease SET owner=?, expires_at=? WHERE id=1 AND (owner=? OR expires_at < ?)",
+                (self._owner, now + self.lease_seconds, self._owner, now),
+            )
+        if cur.rowcount != 1:
+            self._lease_until = 0.0
+            return False
+        self._lease_until = now + self.lease_seconds
+        return True
+
+    def stats(self):
+        depth, oldest, dead = self.db().execute(
+            """
+            SELECT COALESCE(SUM(dead = 0), 0), MIN(CASE WHEN dead = 0 THEN created_at END), COALESCE(SUM(dead), 0)
+            FROM mysql_outbox
+            """
+        ).fetchone()
+        with self._lock:
+            return {
+                "depth": depth,
+                "lag_seconds": round(time.time() - oldest, 3) if oldest is not None else 0.0,
+                "dead": dead,
+                "enqueued": self.enqueued,
+                "deduplicated": self.deduplicated,
+                "applied": self.applied,
+                "duplicates": self.duplicates,
+                "batches": self.batches,
+                "failures": self.failures,
+                "transport_failures": self.transport_failures,
+                "parked": self.parked,
+                "last_batch_ms": round(self.last_batch_ms, 2),
+                "last_apply_lag_ms": round(self.last_apply_lag_ms, 2),
+                "last_error": self.last_error,
+                "draining": time.time() < self._lease_until,
+            }
@@ -0,0 +1,236 @@
+import json
+import os
+import threading
+import time
+
+from monitor_data import AI_ALERT_LIMIT, USER_ALERT_LIMIT
+
+
+REPLICATED_TABLES = ("status_server", "music", "ai_alert", "user_alert")
+
+
+def ensure_schema(conn):
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS replica_rows (
+        tbl TEXT NOT NULL,
+        id INTEGER NOT NULL,
+        last_updated TEXT,
+        payload TEXT NOT NULL,
+        PRIMARY KEY (tbl, id)
+    )
+    """)
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_replica_rows_updated ON replica_rows (tbl, last_updated)")
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS replica_state (
+        tbl TEXT PRIMARY KEY,
+        high_water TEXT,
+        synced_at REAL
+    )
+    """)
+
+
+class MonitorReplica:
+    """Local SQLite copy of the MySQL monitor tables.
+
+    Every `interval` seconds a background thread asks each table for rows
+    with last_updated at or after its high-water mark (the mark itself is
+    re-read so rows written later in the same second are not missed) and
+    upserts them into `replica_rows`. Deletes do not move the mark, so each
+    sync also lists the remote ids and drops local rows that are gone; the
+    alert tables are kept short by expiry, which keeps that list cheap.
+
+    snapshot() returns the same shape as monitor_data.fetch_snapshot(),
+    read from the copy and tagged with a "freshness" entry.
+
+    `db()` returns the calling thread's SQLite connection; `borrow()` is a
+    context manager yielding a MySQL connection.
+    """
+
+    def __init__(self, db, borrow, interval=10.0):
+        self.db = db
+        self.borrow = borrow
+        self.interval = interval
+        self._lock = threading.Lock()
+        self._sync_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._pid = None
+        self.remote_ok = None
+        self.syncs = 0
+        self.failures = 0
+        self.rows_upserted = 0
+        self.rows_deleted = 0
+        self.last_sync_ms = 0.0
+        self.last_error = None
+
+    # -------------------- SYNC --------------------
+
+    def start(self):
+        if self._pid == os.getpid():
+            return
+        self._pid = os.getpid()
+        threading.Thread(target=self._loop, daemon=True).start()
+
+    def poke(self):
+        self._wake.set()
+
+    def _loop(self):
+        while True:
+            self.refresh()
+            self._wake.wait(self.interval)
+            self._wake.clear()
+
+    def refresh(self):
+        """sync(), logging instead of raising; True when it succeeded."""
+        try:
+            self.sync()
+            return True
+        except Exception as e:
+            print(f"Error syncing monitor replica: {e}")
+            return False
+
+    def sync(self):
+        with self._sync_lock:
+            started = time.perf_counter()
+            conn = self.db()
+            marks = dict(conn.execute("SELECT tbl, high_water FROM replica_state").fetchall())
+            try:
+                changes = self._fetch(marks)
+            except Exception as e:
+                with self._lock:
+                    self.remote_ok = False
+                    self.failures += 1
+                    self.last_error = f"{type(e).__name__}: {e}"
+                raise
+            upserted, deleted = self._store(conn, marks, changes)
+            with self._lock:
+                self.remote_ok = True
+                self.syncs += 1
+                self.rows_upserted += upserted
+                self.rows_deleted += deleted
+                self.last_sync_ms = (time.perf_counter() - started) * 1000
+                self.last_error = None
+
+    def _fetch(self, marks):
+        changes = {}
+        with self.borrow() as mysql_conn:
+            cur = mysql_conn.cursor(dictionary=True)
+            for table in REPLICATED_TABLES:
+                mark = marks.get(table)
+                if mark is None:
+                    cur.execute(f"SELECT * FROM {table}")
+                else:
+                    cur.execute(
+                        f"SELECT * FROM {table} WHERE last_updated >= %s OR last_updated IS NULL",
+                        (mark,),
+                    )
+                rows = cur.fetchall()
+                cur.execute(f"SELECT id FROM {table}")
+                ids = {row["id"] for row in cur.fetchall()}
+                changes[table] = (rows, ids)
+            cur.close()
+        return changes
+
+    def _store(self, conn, marks, changes):
+        upserted = deleted = 0
+        now = time.time()
+        with conn:
+            for table, (rows, ids) in changes.items():
+                mark = marks.get(table)
+                for row in rows:
+                    updated = row.get("last_updated")
+                    updated = str(updated) if updated is not None else None
+                    if updated is not None and (mark is None or updated > mark):
+                        mark = updated
+                    conn.execute(
+                        """
+                        INSERT INTO replica_rows (tbl, id, last_updated, payload)
+                        VALUES (?, ?, ?, ?)
+                        ON CONFLICT (tbl, id) DO UPDATE SET
+                            last_updated = excluded.last_updated,
+                            payload = excluded.payload
+                        """,
+                        (table, row["id"], updated, json.dumps(row, default=str)),
+                    )
+                upserted += len(rows)
+
+                local_ids = [r[0] for r in conn.execute("SELECT id FROM replica_rows WHERE tbl=?", (table,))]
+                gone = [(table, row_id) for row_id in local_ids if row_id not in ids]
+                if gone:
+                    conn.executemany("DELETE FROM replica_rows WHERE tbl=? AND id=?", gone)
+                    deleted += len(gone)
+
+                conn.execute(
+                    """
+                    INSERT INTO replica_state (tbl, high_water, synced_at) VALUES (?, ?, ?)
+                    ON CONFLICT (tbl) DO UPDATE SET
+                        high_water = excluded.high_water,
+                        synced_at = excluded.synced_at
+                    """,
+                    (table, mark, now),
+                )
+        return upserted, deleted
+
+    def mark_down(self, error):
+        # A live read failed (mix mode); the next successful sync clears it.
+        with self._lock:
+            self.remote_ok = False
+            self.last_error = f"{type(error).__name__}: {error}"
+
+    # -------------------- READ --------------------
+
+    def snapshot(self):
+        conn = self.db()
+
+        def rows(table, limit):
+            return [
+                json.loads(payload)
+                for (payload,) in conn.execute(
+                    "SELECT payload FROM replica_rows WHERE tbl=? ORDER BY last_updated DESC LIMIT ?",
+                    (table, limit),
+                )
+            ]
+
+        def single(table):
+            row = conn.execute("SELECT payload FROM replica_rows WHERE tbl=? AND id=1", (table,)).fetchone()
+            return json.loads(row[0]) if row else None
+
+        return {
+            "status": single("status_server"),
+            "music": single("music"),
+            "ai_alerts": rows("ai_alert", AI_ALERT_LIMIT),
+            "user_alerts": rows("user_alert", USER_ALERT_LIMIT),
+            "freshness": self.freshness(),
+        }
+
+    def synced_at(self):
+        # The copy is only as fresh as its least recently synced table.
+        row = self.db().execute(
+            "SELECT MIN(synced_at), COUNT(*) FROM replica_state"
+        ).fetchone()
+        if row[1] < len(REPLICATED_TABLES):
+            return None
+        return row[0]
+
+    def freshness(self):
+        synced_at = self.synced_at()
+        return {
+            "source": "replica",
+            "synced_at": synced_at,
+            "age_seconds": round(time.time() - synced_at, 1) if synced_at is not None else None,
+            "remote_ok": self.remote_ok,
+        }
+
+    def stats(self):
+        freshness = self.freshness()
+        with self._lock:
+            return {
+                "synced_at": freshness["synced_at"],
+                "age_seconds": freshness["age_seconds"],
+                "remote_ok": self.remote_ok,
+                "syncs": self.syncs,
+                "failures": self.failures,
+                "rows_upserted": self.rows_upserted,
+                "rows_deleted": self.rows_deleted,
+                "last_sync_ms": round(self.last_sync_ms, 2),
+                "last_error": self.last_error,
+            }
@@ -0,0 +1,126 @@
+import json
+import threading
+import time
+
+
+def ensure_schema(conn):
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS settings (
+        key TEXT PRIMARY KEY,
+        value TEXT NOT NULL,
+        version INTEGER NOT NULL
+    )
+    """)
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_settings_version ON settings (version)")
+
+
+class RuntimeSettings:
+    """Durable runtime settings shared by every worker process.
+
+    Values live in the SQLite `settings` table and are cached in-process.
+    Every write bumps a global version; readers compare MAX(version) against
+    their cached copy at most once per `check_interval` seconds and reload
+    only when it moved, so a flip made in one gunicorn worker reaches the
+    others within that interval.
+
+    `schema` maps each key to {"default": ..., "type": ..., and optionally
+    "choices" or "min"/"max"}.
+    """
+
+    def __init__(self, connect, schema, check_interval=0.5):
+        self.connect = connect
+        self.schema = schema
+        self.check_interval = check_interval
+        self._lock = threading.Lock()
+        self._values = {key: spec["default"] for key, spec in schema.items()}
+        self._version = None
+        self._checked_at = 0.0
+        self.reloads = 0
+
+    def validate(self, key, value):
+        spec = self.schema.get(key)
+        if spec is None:
+            raise KeyError(key)
+        try:
+            value = spec.get("type", str)(value)
+        except (TypeError, ValueError):
+            raise ValueError(f"{key}: invalid value {value!r}")
+        if isinstance(value, str):
+            value = value.strip().lower()
+        if "choices" in spec and value not in spec["choices"]:
+            raise ValueError(f"{key}: must be one of {', '.join(sorted(spec['choices']))}")
+        if "min" in spec and value < spec["min"]:
+            raise ValueError(f"{key}: must be at least {spec['min']}")
+        if "max" in spec and value > spec["max"]:
+            raise ValueError(f"{key}: must be at most {spec['max']}")
+        return value
+
+    # -------------------- READ --------------------
+
+    def get(self, key):
+        self._maybe_reload()
+        return self._values[key]
+
+    def cached(self, key):
+        # No version check, so it never touches SQLite; for hot paths that
+        # can live with a value as old as the last get().
+        return self._values[key]
+
+    def all(self):
+        self._maybe_reload()
+        return dict(self._values)
+
+    def _maybe_reload(self):
+        now = time.monotonic()
+        if now - self._checked_at < self.check_interval:
+            return
+        with self._lock:
+            if now - self._checked_at < self.check_interval:
+                return
+            self._checked_at = now
+            conn = self.connect()
+            try:
+                version = conn.execute("SELECT MAX(version) FROM settings").fetchone()[0] or 0
+                if version == self._version:
+                    return
+                rows = conn.execute("SELECT key, value FROM settings").fetchall()
+            finally:
+                conn.close()
+            values = {key: spec["default"] for key, spec in self.schema.items()}
+            for key, raw in rows:
+                if key not in self.schema:
+                    continue
+                try:
+                    values[key] = self.validate(key, json.loads(raw))
+                except ValueError:
+                    pass
+            self._values = values
+            self._version = version
+            self.reloads += 1
+
+    # -------------------- WRITE --------------------
+
+    def set(self, key, value):
+        value = self.validate(key, value)
+        conn = self.connect()
+        try:
+            conn.execute(
+                """
+                INSERT INTO settings (key, value, version)
+                VALUES (?, ?, (SELECT COALESCE(MAX(version), 0) + 1 FROM settings))
+                ON CONFLICT (key) DO UPDATE SET
+                    value = excluded.value,
+                    version = excluded.version
+                """,
+                (key, json.dumps(value)),
+            )
+            conn.commit()
+        finally:
+            conn.close()
+        with self._lock:
+            # Force the next read to pick up the new version.
+            self._checked_at = 0.0
+        return value
+
+    def stats(self):
+        return {"version": self._version, "reloads": self.reloads, "values": self.all()}
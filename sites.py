@@ -0,0 +1,256 @@
+import math
+import threading
+import time
+from collections import OrderedDict, namedtuple
+
+
+# Votes and receivers that name no site belong to the original single
+# location row, so existing polls keep counting where they always did.
+DEFAULT_SITE_ID = 1
+
+EARTH_RADIUS_KM = 6371.0088
+
+# Same column order as `SELECT * FROM location`, so templates indexing
+# loc[1]..loc[3] work with either.
+Site = namedtuple("Site", "id place_name latitude longitude")
+
+
+def ensure_schema(conn):
+    location_columns = {row[1] for row in conn.execute("PRAGMA table_info(location)")}
+    if "version" not in location_columns:
+        conn.execute("ALTER TABLE location ADD COLUMN version INTEGER NOT NULL DEFAULT 0")
+    poll_columns = {row[1] for row in conn.execute("PRAGMA table_info(polls)")}
+    if "site_id" not in poll_columns:
+        conn.execute(f"ALTER TABLE polls ADD COLUMN site_id INTEGER NOT NULL DEFAULT {DEFAULT_SITE_ID}")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_polls_site_created ON polls (site_id, created_at)")
+
+
+def haversine_km(lat1, lon1, lat2, lon2):
+    lat1, lon1, lat2, lon2 = map(math.radians, (lat1, lon1, lat2, lon2))
+    a = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(a)))
+
+
+class SiteIndex:
+    """In-memory copy of the `location` table with a nearest-site grid.
+
+    Sites are bucketed into `cell_degrees` x `cell_degrees` cells.
+    nearest() searches rings of cells outwards from the query's cell and
+    stops once the closest site found is nearer than anything the next
+    ring could hold; if the rings would visit more cells than there are
+    sites it scans the rest instead, so a query far from every site stays
+    cheap. Receivers poll from fixed coordinates, so the last `memo_size`
+    answers are remembered until the sites change.
+
+    Every write bumps the row's `version`; readers compare COUNT(*) and
+    MAX(version) against their copy at most once per `check_interval`
+    seconds, so a site saved in one worker reaches the others within it.
+
+    `db()` returns the calling thread's SQLite connection.
+    """
+
+    def __init__(self, db, cell_degrees=1.0, check_interval=1.0, memo_size=4096):
+        self.db = db
+        self.cell_degrees = float(cell_degrees)
+        self.check_interval = check_interval
+        self.memo_size = memo_size
+        self._lon_cells = int(math.ceil(360.0 / self.cell_degrees))
+        self._lock = threading.Lock()
+        self._sites = {}
+        self._grid = {}
+        self._located = 0
+        self._memo = OrderedDict()
+        self._fingerprint = None
+        self._checked_at = 0.0
+        self.reloads = 0
+        self.lookups = 0
+        self.memo_hits = 0
+        self.cells_visited = 0
+        self.scans = 0
+
+    def _cell(self, lat, lon):
+        return (
+            int(math.floor(lat / self.cell_degrees)),
+            int(math.floor((lon + 180.0) / self.cell_degrees)) % self._lon_cells,
+        )
+
+    # -------------------- LOAD --------------------
+
+    def _maybe_reload(self):
+        now = time.monotonic()
+        if now - self._checked_at < self.check_interval:
+            return
+        with self._lock:
+            if now - self._checked_at < self.check_interval:
+                return
+            self._checked_at = now
+            conn = self.db()
+            fingerprint = tuple(conn.execute("SELECT COUNT(*), MAX(version) FROM location").fetchone())
+            if fingerprint == self._fingerprint:
+                return
+            self._load(conn)
+            self._fingerprint = fingerprint
+
+    def _load(self, conn):
+        sites = {}
+        grid = {}
+        for row in conn.execute("SELECT id, place_name, latitude, longitude FROM location"):
+            site = Site(*row)
+            sites[site.id] = site
+            if site.latitude is not None and site.longitude is not None:
+                grid.setdefault(self._cell(site.latitude, site.longitude), []).append(site)
+        self._sites = sites
+        self._grid = grid
+        self._located = sum(len(bucket) for bucket in grid.values())
+        self._memo = OrderedDict()
+        self.reloads += 1
+
+    def invalidate(self):
+        with self._lock:
+            self._checked_at = 0.0
+
+    # -------------------- READ --------------------
+
+    def get(self, site_id):
+        self._maybe_reload()
+        return self._sites.get(site_id)
+
+    def all(self):
+        self._maybe_reload()
+        return sorted(self._sites.values())
+
+    def default(self):
+        """The default site, or the lowest-numbered one if it was removed."""
+        self._maybe_reload()
+        sites = self._sites
+        if DEFAULT_SITE_ID in sites:
+            return sites[DEFAULT_SITE_ID]
+        return sites[min(sites)] if sites else None
+
+    def nearest(self, lat, lon):
+        """(site, distance_km) for the closest site with coordinates, or (None, None)."""
+        self._maybe_reload()
+        grid = self._grid
+        if not grid:
+            return None, None
+        lat = max(-90.0, min(90.0, float(lat)))
+        lon = (float(lon) + 180.0) % 360.0 - 180.0
+        with self._lock:
+            memo = self._memo
+            found = memo.get((lat, lon))
+            if found is not None:
+                memo.move_to_end((lat, lon))
+                self.memo_hits += 1
+                return found
+        ci, cj = self._cell(lat, lon)
+        cos_lat = math.cos(math.radians(lat))
+        located = self._located
+        best, best_km = None, None
+        visited = 0
+        ring = 0
+        while True:
+            if (2 * ring + 1) ** 2 > located:
+                # Cheaper to look at every site than at the next ring.
+                best, best_km = self._scan(grid, lat, lon, best, best_km)
+                with self._lock:
+                    self.scans += 1
+                break
+            for cell in self._ring(ci, cj, ring):
+                visited += 1
+                for site in grid.get(cell, ()):
+                    km = haversine_km(lat, lon, site.latitude, site.longitude)
+                    if best_km is None or km < best_km:
+                        best, best_km = site, km
+            # Anything outside this ring is at least `ring` cells away in
+            # latitude or longitude.
+            reach = math.radians(min(ring * self.cell_degrees, 90.0))
+            bound = EARTH_RADIUS_KM * min(reach, math.asin(min(1.0, cos_lat * math.sin(reach))))
+            if best_km is not None and best_km <= bound:
+                break
+            ring += 1
+        with self._lock:
+            self.lookups += 1
+            self.cells_visited += visited
+            memo[(lat, lon)] = (best, best_km)
+            while len(memo) > self.memo_size:
+                memo.popitem(last=False)
+        return best, best_km
+
+    def _ring(self, ci, cj, ring):
+        if ring == 0:
+            yield ci, cj
+            return
+        for dj in range(-ring, ring + 1):
+            yield ci - ring, (cj + dj) % self._lon_cells
+            yield ci + ring, (cj + dj) % self._lon_cells
+        for di in range(-ring + 1, ring):
+            yield ci + di, (cj - ring) % self._lon_cells
+            yield ci + di, (cj + ring) % self._lon_cells
+
+    @staticmethod
+    def _scan(grid, lat, lon, best, best_km):
+        for bucket in grid.values():
+            for site in bucket:
+                km = haversine_km(lat, lon, site.latitude, site.longitude)
+                if best_km is None or km < best_km:
+                    best, best_km = site, km
+        return best, best_km
+
+    def resolve(self, site_id=None, lat=None, lon=None):
+        """The site a receiver asked for: by id, else nearest to lat/lon, else the default."""
+        if site_id is not None:
+            return self.get(site_id)
+        if lat is not None and lon is not None:
+            site, _ = self.nearest(lat, lon)
+            if site is not None:
+                return site
+        return self.default()
+
+    # -------------------- WRITE --------------------
+
+    def save(self, site_id, place_name, latitude, longitude):
+        """Insert or update a site (a new one when site_id is None); returns its id."""
+        conn = self.db()
+        with conn:
+            version = conn.execute("SELECT COALESCE(MAX(version), 0) + 1 FROM location").fetchone()[0]
+            if site_id is None:
+                cur = conn.execute(
+                    "INSERT INTO location (place_name, latitude, longitude, version) VALUES (?, ?, ?, ?)",
+                    (place_name, latitude, longitude, version),
+                )
+                site_id = cur.lastrowid
+            else:
+                conn.execute(
+                    """
+                    INSERT INTO location (id, place_name, latitude, longitude, version) VALUES (?, ?, ?, ?, ?)
+                    ON CONFLICT (id) DO UPDATE SET
+                        place_name = excluded.place_name,
+                        latitude = excluded.latitude,
+                        longitude = excluded.longitude,
+                        version = excluded.version
+                    """,
+                    (site_id, place_name, latitude, longitude, version),
+                )
+        self.invalidate()
+        return site_id
+
+    def delete(self, site_id):
+        conn = self.db()
+        with conn:
+            deleted = conn.execute("DELETE FROM location WHERE id=?", (site_id,)).rowcount
+        self.invalidate()
+        return bool(deleted)
+
+    def stats(self):
+        self._maybe_reload()
+        with self._lock:
+            return {
+                "sites": len(self._sites),
+                "cells": len(self._grid),
+                "cell_degrees": self.cell_degrees,
+                "reloads": self.reloads,
+                "lookups": self.lookups,
+                "memo_hits": self.memo_hits,
+                "avg_cells_visited": round(self.cells_visited / self.lookups, 2) if self.lookups else 0.0,
+                "scans": self.scans,
+            }
@@ -0,0 +1,266 @@
+import gzip
+import hashlib
+import json
+import threading
+import time
+
+try:
+    import msgpack
+except ImportError:  # optional; /sync then only speaks JSON
+    msgpack = None
+
+
+ENCODINGS = {
+    "json": (
+        "application/json",
+        lambda payload: json.dumps(payload, sort_keys=True, separators=(",", ":")).encode("utf-8"),
+    ),
+}
+if msgpack is not None:
+    ENCODINGS["msgpack"] = ("application/msgpack", lambda payload: msgpack.packb(payload, use_bin_type=True))
+
+
+class VersionedSnapshot:
+    """A precomputed JSON payload that only changes version when its content does.
+
+    `build()` is re-run when the snapshot is invalidated or older than
+    `max_age` seconds (the latter picks up changes made by other worker
+    processes). The version is a millisecond timestamp bumped on every
+    content change, so it also increases across workers; the ETag is a
+    content hash and therefore identical on every worker. One caller
+    rebuilds at a time; the others wait for it and share the result.
+    """
+
+    def __init__(self, build, max_age=1.0):
+        self.build = build
+        self.max_age = max_age
+        self._cond = threading.Condition()
+        self._build_lock = threading.Lock()
+        self._expires = 0.0
+        self._generation = 0
+        self.payload = None
+        self.body = None
+        self.etag = None
+        self.version = 0
+        self.rebuilds = 0
+        # Called (from any thread) on every invalidate().
+        self.listeners = []
+
+    def invalidate(self):
+        with self._cond:
+            self._expires = 0.0
+            self._generation += 1
+            self._cond.notify_all()
+        for listener in self.listeners:
+            listener()
+
+    def _fresh(self):
+        with self._cond:
+            if time.monotonic() < self._expires and self.payload is not None:
+                return self.body, self.etag, self.version
+        return None
+
+    def get(self):
+        fresh = self._fresh()
+        if fresh is not None:
+            return fresh
+        with self._build_lock:
+            # Whoever held the lock before us may have just rebuilt.
+            fresh = self._fresh()
+            if fresh is not None:
+                return fresh
+            with self._cond:
+                generation = self._generation
+            payload = self.build()
+            return self._store(payload, generation)
+
+    def _store(self, payload, generation):
+        with self._cond:
+            self.rebuilds += 1
+            # An invalidate() during the build leaves the result expired.
+            if self._generation == generation:
+                self._expires = time.monotonic() + self.max_age
+            if payload != self.payload:
+                self.payload = payload
+                self.body = json.dumps(payload, sort_keys=True, separators=(",", ":"))
+                self.etag = hashlib.sha1(self.body.encode("utf-8")).hexdigest()[:16]
+                self.version = max(self.version + 1, int(time.time() * 1000))
+                self._cond.notify_all()
+            return self.body, self.etag, self.version
+
+    def wait_for_change(self, since, timeout):
+        """Block until the version is newer than `since` or `timeout` elapses."""
+        deadline = time.monotonic() + timeout
+        while True:
+            body, etag, version = self.get()
+            remaining = deadline - time.monotonic()
+            if version > since or remaining <= 0:
+                return body, etag, version
+            with self._cond:
+                if self._expires and self.version == version:
+                    self._cond.wait(min(remaining, self.max_age))
+
+
+class SectionedSnapshot:
+    """A bundle of named sections, each versioned by when it last changed.
+
+    `build()` returns {section: value}; it runs at most once per `max_age`
+    seconds or after invalidate(). A section missing from a build keeps
+    its previous value, so a source that is briefly unavailable does not
+    blank it out. Values are normalised through JSON (datetimes become
+    strings) so every encoding sees the same data.
+
+    delta(since, encoding) returns only the sections that changed after
+    version `since` (everything when `since` is None or unknown here).
+    Encoded bodies are cached per (sections, encoding, gzip) until the
+    next change, so a fleet of clients at the same version share one
+    encode.
+    """
+
+    def __init__(self, build, max_age=2.0, gzip_min_size=1024):
+        self.build = build
+        self.max_age = max_age
+        self.gzip_min_size = gzip_min_size
+        self._lock = threading.Lock()
+        self._build_lock = threading.Lock()
+        self._expires = 0.0
+        self._generation = 0
+        self.sections = {}
+        self.section_versions = {}
+        self.version = 0
+        self._bodies = {}
+        self.rebuilds = 0
+        self.changes = 0
+        self.encodes = 0
+        self.cached_hits = 0
+
+    def invalidate(self):
+        with self._lock:
+            self._expires = 0.0
+            self._generation += 1
+
+    def refresh(self):
+        with self._lock:
+            if time.monotonic() < self._expires:
+                return self.version
+        with self._build_lock:
+            with self._lock:
+                if time.monotonic() < self._expires:
+                    return self.version
+                generation = self._generation
+            built = json.loads(json.dumps(self.build(), default=str))
+            return self._store(built, generation)
+
+    def _store(self, built, generation):
+        with self._lock:
+            self.rebuilds += 1
+            if self._generation == generation:
+                self._expires = time.monotonic() + self.max_age
+            changed = [
+                name for name, value in built.items()
+                if name not in self.sections or self.sections[name] != value
+            ]
+            if changed:
+                version = max(self.version + 1, int(time.time() * 1000))
+                self.sections = dict(self.sections, **built)
+                for name in changed:
+                    self.section_versions[name] = version
+                self.version = version
+                self.changes += 1
+                self._bodies.clear()
+            return self.version
+
+    def delta(self, since=None, encoding="json", accept_gzip=False):
+        """(body, version, section names, gzipped); body is None when nothing changed."""
+        self.refresh()
+        mimetype, encode = ENCODINGS[encoding]
+        with self._lock:
+            version = self.version
+            if since is None or since > version:
+                # First sync, or a version from a newer worker or an earlier
+                # run that this process cannot diff against.
+                names = sorted(self.sections)
+                full = True
+            else:
+                names = sorted(n for n, v in self.section_versions.items() if v > since)
+                full = False
+            if not names:
+                return None, version, names, False
+            key = (tuple(names), full, encoding, accept_gzip)
+            cached = self._bodies.get(key)
+            if cached is not None:
+                self.cached_hits += 1
+                return cached[0], version, names, cached[1]
+            payload = {
+                "version": version,
+                "full": full,
+                "sections": {name: self.sections[name] for name in names},
+                "section_versions": {name: self.section_versions[name] for name in names},
+            }
+        body = encode(payload)
+        gzipped = accept_gzip and len(body) >= self.gzip_min_size
+        if gzipped:
+            body = gzip.compress(body, compresslevel=6)
+        with self._lock:
+            self.encodes += 1
+            if self.version == version:
+                self._bodies[key] = (body, gzipped)
+        return body, version, names, gzipped
+
+    def stats(self):
+        with self._lock:
+            return {
+                "version": self.version,
+                "sections": dict(self.section_versions),
+                "rebuilds": self.rebuilds,
+                "changes": self.changes,
+                "encodes": self.encodes,
+                "cached_hits": self.cached_hits,
+                "encodings": sorted(ENCODINGS),
+            }
+
+
+class SnapshotGroup:
+    """One snapshot per key (e.g. per site), made by `factory(key)` on first use.
+
+    invalidate(key) invalidates that key's snapshot, invalidate() every
+    one of them; the group's listeners are called with the key (None for
+    all) either way.
+    """
+
+    def __init__(self, factory):
+        self.factory = factory
+        self._lock = threading.Lock()
+        self._snapshots = {}
+        # Called as listener(key) (from any thread) on every invalidate().
+        self.listeners = []
+
+    def __getitem__(self, key):
+        snapshot = self._snapshots.get(key)
+        if snapshot is None:
+            with self._lock:
+                snapshot = self._snapshots.get(key)
+                if snapshot is None:
+                    snapshot = self._snapshots[key] = self.factory(key)
+        return snapshot
+
+    def items(self):
+        with self._lock:
+            return list(self._snapshots.items())
+
+    def invalidate(self, key=None):
+        if key is None:
+            for _, snapshot in self.items():
+                snapshot.invalidate()
+        else:
+            snapshot = self._snapshots.get(key)
+            if snapshot is not None:
+                snapshot.invalidate()
+        for listener in self.listeners:
+            listener(key)
+
+    def discard(self, key):
+        with self._lock:
+            self._snapshots.pop(key, None)
+        for listener in self.listeners:
+            listener(key)
@@ -0,0 +1,150 @@
+import sqlite3
+import threading
+import time
+
+
+# A BEGIN IMMEDIATE that takes longer than this spent its time in the busy
+# handler waiting for another writer.
+LOCK_WAIT_THRESHOLD_MS = 1.0
+
+
+class _Cursor(sqlite3.Cursor):
+    def execute(self, sql, *args):
+        started = time.perf_counter()
+        try:
+            return super().execute(sql, *args)
+        finally:
+            self.connection.manager._record_statement(sql, time.perf_counter() - started)
+
+    def executemany(self, sql, *args):
+        started = time.perf_counter()
+        try:
+            return super().executemany(sql, *args)
+        finally:
+            self.connection.manager._record_statement(sql, time.perf_counter() - started)
+
+
+class _Connection(sqlite3.Connection):
+    manager = None
+
+    def cursor(self, factory=_Cursor):
+        # Connection.execute() goes through here too.
+        return super().cursor(factory)
+
+    def execute(self, sql, *args):
+        if not sql.lstrip().upper().startswith("BEGIN IMMEDIATE"):
+            return super().execute(sql, *args)
+        started = time.perf_counter()
+        try:
+            return super().execute(sql, *args)
+        except sqlite3.OperationalError as e:
+            if "locked" in str(e):
+                self.manager._record_lock_timeout()
+            raise
+        finally:
+            self.manager._record_begin((time.perf_counter() - started) * 1000)
+
+
+class SQLiteManager:
+    """Opens tuned SQLite connections and reuses one per thread.
+
+    Every connection runs with WAL (readers never block the vote writer),
+    synchronous=NORMAL, a busy timeout so contending writers queue instead
+    of failing, memory-mapped reads and a larger prepared-statement cache.
+
+    `on_statement(sql, seconds)`, when given, is called after every
+    statement on a managed connection.
+
+    `get()` hands the calling thread its own connection, opening it on first
+    use; `release()` (the request teardown) rolls back anything left open so
+    the next request on that thread starts clean. Background jobs that own
+    their connection call `connect()` and close it themselves.
+    """
+
+    def __init__(self, path, busy_timeout_ms=5000, mmap_size=64 * 1024 * 1024,
+                 cached_statements=256, on_statement=None):
+        self.path = path
+        self.on_statement = on_statement
+        self.busy_timeout_ms = busy_timeout_ms
+        self.mmap_size = mmap_size
+        self.cached_statements = cached_statements
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._wal = False
+        self.opens = 0
+        self.reuses = 0
+        self.lock_waits = 0
+        self.lock_wait_ms = 0.0
+        self.lock_timeouts = 0
+
+    def connect(self):
+        conn = sqlite3.connect(
+            self.path,
+            timeout=self.busy_timeout_ms / 1000,
+            cached_statements=self.cached_statements,
+            factory=_Connection,
+            check_same_thread=False,
+        )
+        conn.manager = self
+        conn.row_factory = sqlite3.Row
+        if not self._wal:
+            # Persistent in the database file; only the first open pays for it.
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._wal = True
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute(f"PRAGMA busy_timeout={int(self.busy_timeout_ms)}")
+        conn.execute(f"PRAGMA mmap_size={int(self.mmap_size)}")
+        with self._lock:
+            self.opens += 1
+        return conn
+
+    def get(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._local.conn = self.connect()
+        else:
+            with self._lock:
+                self.reuses += 1
+        return conn
+
+    def release(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            return
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+        except sqlite3.Error:
+            conn.close()
+            self._local.conn = None
+
+    def close(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+    def _record_statement(self, sql, seconds):
+        if self.on_statement is not None:
+            self.on_statement(sql, seconds)
+
+    def _record_begin(self, elapsed_ms):
+        if elapsed_ms < LOCK_WAIT_THRESHOLD_MS:
+            return
+        with self._lock:
+            self.lock_waits += 1
+            self.lock_wait_ms += elapsed_ms
+
+    def _record_lock_timeout(self):
+        with self._lock:
+            self.lock_timeouts += 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                "opens": self.opens,
+                "reuses": self.reuses,
+                "lock_waits": self.lock_waits,
+                "lock_wait_ms": round(self.lock_wait_ms, 2),
+                "lock_timeouts": self.lock_timeouts,
+            }
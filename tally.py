@@ -0,0 +1,219 @@
+import threading
+import time
+
+
+BUCKET_SECONDS = 60
+
+
+class VoteTally:
+    """Sliding-window language x genre vote matrix kept in per-minute ring buckets.
+
+    Each bucket is a flat list of len(languages) * len(genres) counts.
+    Running matrices are maintained incrementally for every window in
+    `windows`, so reading any of them is a copy, not a scan; other windows
+    up to `capacity` minutes are summed from the buckets. Row and column
+    sums (the per-language and per-genre totals) come from the same matrix.
+    Votes outside the two axes are ignored.
+    """
+
+    def __init__(self, languages, genres, windows=(5, 30, 60), window_minutes=30, capacity=60):
+        self.languages = sorted(languages)
+        self.genres = sorted(genres)
+        self._lang_index = {key: i for i, key in enumerate(self.languages)}
+        self._genre_index = {key: i for i, key in enumerate(self.genres)}
+        self._cells = len(self.languages) * len(self.genres)
+        self.window_minutes = int(window_minutes)
+        self.windows = sorted({int(w) for w in windows} | {self.window_minutes})
+        self.capacity = max(int(capacity), self.windows[-1])
+        self._lock = threading.Lock()
+        self._slots = [None] * self.capacity
+        self._totals = {w: [0] * self._cells for w in self.windows}
+        self._head = None
+
+    # -------------------- BUCKETS --------------------
+
+    def _advance(self, minute):
+        # Subtract buckets that have slid out of each running window.
+        if self._head is None:
+            self._head = minute
+            return
+        if minute <= self._head:
+            return
+        for window, totals in self._totals.items():
+            leaving_end = min(minute - window, self._head)
+            for m in range(self._head - window + 1, leaving_end + 1):
+                slot = self._slots[m % self.capacity]
+                if slot is not None and slot[0] == m:
+                    for i, c in enumerate(slot[1]):
+                        totals[i] -= c
+        for m in range(max(self._head + 1, minute - self.capacity + 1), minute + 1):
+            self._slots[m % self.capacity] = None
+        self._head = minute
+
+    def _add(self, language, genre, ts):
+        li = self._lang_index.get(language)
+        gi = self._genre_index.get(genre)
+        if li is None or gi is None:
+            return
+        cell = li * len(self.genres) + gi
+        minute = int(ts) // BUCKET_SECONDS
+        self._advance(minute)
+        if minute <= self._head - self.capacity:
+            return
+        idx = minute % self.capacity
+        slot = self._slots[idx]
+        if slot is None or slot[0] != minute:
+            slot = (minute, [0] * self._cells)
+            self._slots[idx] = slot
+        slot[1][cell] += 1
+        for window, totals in self._totals.items():
+            if minute > self._head - window:
+                totals[cell] += 1
+
+    # -------------------- INGEST --------------------
+
+    def add(self, language, genre, ts=None):
+        """Count one vote; which rows have been counted is up to SiteTallies."""
+        with self._lock:
+            self._add(language, genre, time.time() if ts is None else ts)
+
+    # -------------------- READ --------------------
+
+    def cells(self, window_minutes=None, now=None):
+        """Flat copy of the matrix for a window, row-major by language."""
+        window = self.window_minutes if window_minutes is None else int(window_minutes)
+        if window > self.capacity:
+            raise ValueError(f"window of {window} minutes exceeds tally capacity")
+        minute = int(time.time() if now is None else now) // BUCKET_SECONDS
+        with self._lock:
+            self._advance(minute)
+            if window in self._totals:
+                return list(self._totals[window])
+            cells = [0] * self._cells
+            for m in range(self._head - window + 1, self._head + 1):
+                slot = self._slots[m % self.capacity]
+                if slot is not None and slot[0] == m:
+                    for i, c in enumerate(slot[1]):
+                        cells[i] += c
+            return cells
+
+    def matrix(self, window_minutes=None, now=None):
+        window = self.window_minutes if window_minutes is None else int(window_minutes)
+        cells = self.cells(window, now)
+        width = len(self.genres)
+        rows = [cells[i:i + width] for i in range(0, len(cells), width)]
+        return {
+            "window_minutes": window,
+            "languages": self.languages,
+            "genres": self.genres,
+            "counts": rows,
+            "language_totals": {lang: sum(row) for lang, row in zip(self.languages, rows)},
+            "genre_totals": {
+                genre: sum(row[j] for row in rows) for j, genre in enumerate(self.genres)
+            },
+            "total": sum(cells),
+        }
+
+    def counts(self, window_minutes=None, now=None):
+        m = self.matrix(window_minutes, now)
+        return m["language_totals"], m["genre_totals"]
+
+
+class SiteTallies:
+    """One VoteTally per site, all fed from a single pass over `polls`.
+
+    record() applies a vote this process just inserted. Rows written by
+    other workers leave a gap in the id sequence, so record() declines
+    them and refresh() catches them up in one query whichever site they
+    belong to. Tallies are created the first
+    time a site is voted for or read.
+    """
+
+    def __init__(self, languages, genres, refresh_interval=1.0, **options):
+        self.languages = languages
+        self.genres = genres
+        self.options = options
+        self.refresh_interval = refresh_interval
+        self._lock = threading.Lock()
+        self._tallies = {}
+        self._last_id = 0
+        self._last_refresh = 0.0
+        self.capacity = self._new().capacity
+
+    def _new(self):
+        return VoteTally(self.languages, self.genres, **self.options)
+
+    def tally(self, site_id):
+        tally = self._tallies.get(site_id)
+        if tally is None:
+            with self._lock:
+                tally = self._tallies.setdefault(site_id, self._new())
+        return tally
+
+    def sites(self):
+        return sorted(self._tallies)
+
+    # -------------------- INGEST --------------------
+
+    def record(self, row_id, site_id, language, genre, ts=None):
+        with self._lock:
+            if row_id != self._last_id + 1:
+                return False
+            self._last_id = row_id
+        self.tally(site_id).add(language, genre, ts)
+        return True
+
+    def rebuild(self, conn):
+        with self._lock:
+            self._tallies = {}
+            self._last_id = 0
+            self._catch_up(conn)
+
+    def refresh(self, conn):
+        with self._lock:
+            self._catch_up(conn)
+
+    def refresh_if_stale(self, connect):
+        now = time.monotonic()
+        if now - self._last_refresh < self.refresh_interval:
+            return
+        self._last_refresh = now
+        conn = connect()
+        try:
+            self.refresh(conn)
+        finally:
+            conn.close()
+
+    def _catch_up(self, conn):
+        max_id = conn.execute("SELECT MAX(id) FROM polls").fetchone()[0] or 0
+        if max_id <= self._last_id:
+            return
+        rows = conn.execute(
+            """
+            SELECT site_id, language, genre, CAST(strftime('%s', created_at) AS INTEGER)
+            FROM polls
+            WHERE id > ? AND id <= ? AND created_at > datetime('now', ?)
+            ORDER BY id
+            """,
+            (self._last_id, max_id, f"-{self.capacity} minutes"),
+        ).fetchall()
+        for site_id, language, genre, ts in rows:
+            tally = self._tallies.get(site_id)
+            if tally is None:
+                tally = self._tallies[site_id] = self._new()
+            tally.add(language, genre, ts)
+        self._last_id = max_id
+
+    # -------------------- READ --------------------
+
+    def cells(self, site_id, window_minutes=None, now=None):
+        return self.tally(site_id).cells(window_minutes, now)
+
+    def matrix(self, site_id, window_minutes=None, now=None):
+        return self.tally(site_id).matrix(window_minutes, now)
+
+
+def ranked(counts, field):
+    rows = [{field: key, "c": c} for key, c in counts.items() if c > 0]
+    rows.sort(key=lambda r: r["c"], reverse=True)
+    return rows
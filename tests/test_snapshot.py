@@ -0,0 +1,96 @@
+import gzip
+import json
+import threading
+import time
+
+import msgpack
+
+from snapshot import ENCODINGS, SectionedSnapshot, VersionedSnapshot
+
+
+def _snapshot(state):
+    return SectionedSnapshot(lambda: dict(state), max_age=0, gzip_min_size=64)
+
+
+def test_msgpack_is_registered():
+    assert ENCODINGS["msgpack"][0] == "application/msgpack"
+
+
+def test_msgpack_full_sync_matches_json():
+    snapshot = _snapshot({"config": {"site_id": 1, "language": "tamil"}, "status": {"status": "net"}})
+
+    packed, version, names, gzipped = snapshot.delta(None, "msgpack")
+    body, _, _, _ = snapshot.delta(None, "json")
+
+    assert not gzipped
+    assert names == ["config", "status"]
+    payload = msgpack.unpackb(packed, raw=False)
+    assert payload == json.loads(body)
+    assert payload["full"] is True
+    assert payload["version"] == version
+
+
+def test_msgpack_delta_round_trip():
+    state = {"config": {"site_id": 1, "language": "tamil"}, "status": {"status": "net"}}
+    snapshot = _snapshot(state)
+    _, since, _, _ = snapshot.delta(None, "msgpack")
+
+    state["status"] = {"status": "freq", "alerts": ["a" * 100]}
+    packed, version, names, gzipped = snapshot.delta(since, "msgpack", accept_gzip=True)
+
+    assert version > since
+    assert names == ["status"]
+    assert gzipped
+    payload = msgpack.unpackb(gzip.decompress(packed), raw=False)
+    assert payload == {
+        "version": version,
+        "full": False,
+        "sections": {"status": state["status"]},
+        "section_versions": {"status": version},
+    }
+
+    # Nothing newer than the latest version.
+    assert snapshot.delta(version, "msgpack") == (None, version, [], False)
+
+
+def test_concurrent_gets_share_one_rebuild():
+    builds = []
+
+    def build():
+        builds.append(1)
+        time.sleep(0.05)
+        return {"n": len(builds)}
+
+    snapshot = VersionedSnapshot(build, max_age=60)
+    start = threading.Barrier(16)
+    results = []
+
+    def poll():
+        start.wait()
+        results.append(snapshot.get())
+
+    threads = [threading.Thread(target=poll) for _ in range(16)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(builds) == 1
+    assert len(set(results)) == 1
+
+
+def test_invalidate_during_rebuild_is_not_lost():
+    state = {"n": 0}
+    snapshot = None
+
+    def build():
+        state["n"] += 1
+        if state["n"] == 1:
+            snapshot.invalidate()
+        return dict(state)
+
+    snapshot = VersionedSnapshot(build, max_age=60)
+    snapshot.get()
+    body, _, _ = snapshot.get()
+
+    assert json.loads(body) == {"n": 2}
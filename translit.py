@@ -0,0 +1,105 @@
+import re
+import threading
+from collections import OrderedDict
+
+
+MALAYALAM_CHARS = re.compile("[\u0D00-\u0D7F]")
+
+# Script each broadcast language is stored in; anything typed in the other
+# script is converted on the way in.
+LANGUAGE_SCRIPTS = {"malayalam": "malayalam", "english": "itrans"}
+
+
+class Transliterator:
+    """Memoised ITRANS <-> Malayalam conversion for alert text.
+
+    The sanscript tables are imported on first use (or by warm(), which
+    does it on a background thread) so they stay off the import path.
+    Converted strings are kept in an LRU of `maxsize` entries, since the
+    same station IDs and weather lines are broadcast over and over.
+    """
+
+    def __init__(self, maxsize=2048):
+        self.maxsize = maxsize
+        self._lock = threading.Lock()
+        self._import_lock = threading.Lock()
+        self._memo = OrderedDict()
+        self._sanscript = None
+        self.hits = 0
+        self.misses = 0
+        self.warmed = 0
+
+    def _module(self):
+        if self._sanscript is None:
+            with self._import_lock:
+                if self._sanscript is None:
+                    from indic_transliteration import sanscript
+                    self._sanscript = sanscript
+        return self._sanscript
+
+    # -------------------- CONVERT --------------------
+
+    def convert(self, text, source, target):
+        """Convert `text` between the "itrans" and "malayalam" schemes."""
+        if not text or source == target:
+            return text
+        key = (text, source, target)
+        with self._lock:
+            result = self._memo.get(key)
+            if result is not None:
+                self._memo.move_to_end(key)
+                self.hits += 1
+                return result
+            self.misses += 1
+        sanscript = self._module()
+        schemes = {"itrans": sanscript.ITRANS, "malayalam": sanscript.MALAYALAM}
+        result = sanscript.transliterate(text, schemes[source], schemes[target])
+        with self._lock:
+            self._memo[key] = result
+            self._memo.move_to_end(key)
+            while len(self._memo) > self.maxsize:
+                self._memo.popitem(last=False)
+        return result
+
+    def for_language(self, text, language):
+        """`text` in the script `language` is broadcast in, converting if needed."""
+        target = LANGUAGE_SCRIPTS.get(language)
+        if target is None or not text:
+            return text
+        source = "malayalam" if MALAYALAM_CHARS.search(text) else "itrans"
+        return self.convert(text, source, target)
+
+    def convert_many(self, texts, language):
+        """Batch form of for_language(); duplicates are converted once."""
+        converted = {}
+        for text in texts:
+            if text not in converted:
+                converted[text] = self.for_language(text, language)
+        return [converted[text] for text in texts]
+
+    # -------------------- WARM-UP --------------------
+
+    def warm(self, phrases=()):
+        """Import the tables and pre-convert (text, language) pairs in the background."""
+        def run():
+            try:
+                self._module()
+                for text, language in phrases:
+                    self.for_language(text, language)
+                    self.warmed += 1
+            except Exception as e:
+                print(f"Error warming transliteration: {e}")
+
+        thread = threading.Thread(target=run, daemon=True)
+        thread.start()
+        return thread
+
+    def stats(self):
+        with self._lock:
+            return {
+                "loaded": self._sanscript is not None,
+                "entries": len(self._memo),
+                "hits": self.hits,
+                "misses": self.misses,
+                "warmed": self.warmed,
+            }
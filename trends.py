@@ -0,0 +1,234 @@
+import csv
+import io
+import json
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+
+
+# strftime() pattern that truncates a timestamp to each bucket, and how
+# much time one query covers (see TrendReader).
+BUCKETS = {
+    "minute": ("%Y-%m-%d %H:%M:00", timedelta(hours=6)),
+    "hour": ("%Y-%m-%d %H:00:00", timedelta(days=7)),
+    "day": ("%Y-%m-%d 00:00:00", timedelta(days=90)),
+}
+
+# Default span of a trends request that gives no `since`.
+DEFAULT_SPANS = {"minute": timedelta(hours=6), "hour": timedelta(days=7), "day": timedelta(days=90)}
+
+GROUPINGS = {
+    "cell": ("language", "genre"),
+    "language": ("language",),
+    "genre": ("genre",),
+}
+
+EXPORT_FIELDS = ("id", "site_id", "language", "genre", "created_at")
+
+TIME_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+
+def parse_time(value):
+    """UTC datetime from "YYYY-MM-DD" or "YYYY-MM-DD HH:MM[:SS]" (a T works too)."""
+    value = value.strip().replace("T", " ").rstrip("Z")
+    for fmt in (TIME_FORMAT, "%Y-%m-%d %H:%M", "%Y-%m-%d"):
+        try:
+            return datetime.strptime(value, fmt)
+        except ValueError:
+            continue
+    raise ValueError(f"invalid time {value!r}, expected YYYY-MM-DD[ HH:MM[:SS]]")
+
+
+def utcnow():
+    # Naive UTC, like the created_at strings in polls.
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+def floor_time(moment, bucket):
+    if bucket == "day":
+        return moment.replace(hour=0, minute=0, second=0, microsecond=0)
+    if bucket == "hour":
+        return moment.replace(minute=0, second=0, microsecond=0)
+    return moment.replace(second=0, microsecond=0)
+
+
+class TrendReader:
+    """Streams bucketed vote counts and raw votes out of SQLite.
+
+    trends() sums `polls_rollup` (hourly, older than the compaction
+    horizon) and `polls` (raw) into minute, hour or day buckets. Minute
+    buckets can only come from raw votes, so they cover the compaction
+    horizon and no further.
+
+    Nothing is loaded whole: the range is read one slice at a time (six
+    hours of minutes, a week of hours, 90 days of days), each slice's rows
+    are pulled with fetchmany() and the cursor is closed before the next
+    slice starts. A read transaction therefore spans one slice, not the
+    whole download, so the WAL can be checkpointed between slices (WAL
+    readers never block the vote writer in the first place). export()
+    pages through raw votes by id the same way.
+
+    `connect()` opens a dedicated connection for each stream, when the
+    stream starts. At most `max_streams` streams run at once per process:
+    acquire() returns False when they are all busy, and the caller hands
+    the slot back with release() once the response is closed (a generator
+    that never started would not run its own cleanup).
+    """
+
+    def __init__(self, connect, chunk_size=1000, export_page=5000, max_streams=2):
+        self.connect = connect
+        self.chunk_size = chunk_size
+        self.export_page = export_page
+        self.max_streams = max_streams
+        self._slots = threading.BoundedSemaphore(max_streams)
+        self._lock = threading.Lock()
+        self.active = 0
+        self.streams = 0
+        self.rows = 0
+        self.queries = 0
+        self.busy = 0
+        self.last_stream_ms = 0.0
+
+    # -------------------- ADMISSION --------------------
+
+    def acquire(self):
+        if not self._slots.acquire(blocking=False):
+            with self._lock:
+                self.busy += 1
+            return False
+        with self._lock:
+            self.active += 1
+            self.streams += 1
+        return True
+
+    def release(self):
+        with self._lock:
+            self.active -= 1
+        self._slots.release()
+
+    def _finished(self, started, rows):
+        with self._lock:
+            self.rows += rows
+            self.last_stream_ms = (time.perf_counter() - started) * 1000
+
+    def _open(self):
+        conn = self.connect()
+        conn.row_factory = None
+        # Streams only ever read; make sure of it.
+        conn.execute("PRAGMA query_only=1")
+        return conn
+
+    # -------------------- TRENDS --------------------
+
+    def trends(self, bucket, since, until, grouping="cell"):
+        """Generator of {"bucket": ..., <group columns>..., "count": n} in bucket order."""
+        fmt, span = BUCKETS[bucket]
+        columns = GROUPINGS[grouping]
+        group = ", ".join(columns)
+        raw = f"SELECT strftime('{fmt}', created_at) AS bucket, {group}, 1 AS c FROM polls " \
+              "WHERE created_at >= ? AND created_at < ?"
+        if bucket == "minute":
+            sources = raw
+        else:
+            sources = f"SELECT strftime('{fmt}', bucket_start) AS bucket, {group}, count AS c FROM polls_rollup " \
+                      f"WHERE bucket_start >= ? AND bucket_start < ? UNION ALL {raw}"
+        sql = f"SELECT bucket, {group}, SUM(c) FROM ({sources}) GROUP BY bucket, {group} ORDER BY bucket, {group}"
+        fields = ("bucket",) + columns + ("count",)
+
+        started = time.perf_counter()
+        rows = 0
+        conn = self._open()
+        try:
+            start = floor_time(since, bucket)
+            while start < until:
+                end = min(start + span, until)
+                bounds = (start.strftime(TIME_FORMAT), end.strftime(TIME_FORMAT))
+                params = bounds if bucket == "minute" else bounds + bounds
+                for row in self._stream(conn, sql, params):
+                    rows += 1
+                    yield dict(zip(fields, row))
+                start = end
+        finally:
+            conn.close()
+            self._finished(started, rows)
+
+    # -------------------- EXPORT --------------------
+
+    def export(self, since, until):
+        """Generator of raw votes with created_at in [since, until), by id."""
+        sql = f"SELECT {', '.join(EXPORT_FIELDS)} FROM polls " \
+              "WHERE id > ? AND created_at >= ? AND created_at < ? ORDER BY id LIMIT ?"
+        bounds = (since.strftime(TIME_FORMAT), until.strftime(TIME_FORMAT))
+        started = time.perf_counter()
+        rows = 0
+        conn = self._open()
+        try:
+            last_id = 0
+            while True:
+                page = 0
+                for row in self._stream(conn, sql, (last_id,) + bounds + (self.export_page,)):
+                    page += 1
+                    last_id = row[0]
+                    yield dict(zip(EXPORT_FIELDS, row))
+                rows += page
+                if page < self.export_page:
+                    break
+        finally:
+            conn.close()
+            self._finished(started, rows)
+
+    def _stream(self, conn, sql, params):
+        cur = conn.execute(sql, params)
+        with self._lock:
+            self.queries += 1
+        try:
+            while True:
+                chunk = cur.fetchmany(self.chunk_size)
+                if not chunk:
+                    return
+                yield from chunk
+        finally:
+            cur.close()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "active": self.active,
+                "max_streams": self.max_streams,
+                "streams": self.streams,
+                "rows": self.rows,
+                "queries": self.queries,
+                "busy": self.busy,
+                "last_stream_ms": round(self.last_stream_ms, 2),
+            }
+
+
+# -------------------- ENCODERS --------------------
+
+def encode_ndjson(rows, batch=500):
+    """NDJSON lines, joined into strings of up to `batch` rows."""
+    lines = []
+    for row in rows:
+        lines.append(json.dumps(row, separators=(",", ":")))
+        if len(lines) >= batch:
+            yield "\n".join(lines) + "\n"
+            lines = []
+    if lines:
+        yield "\n".join(lines) + "\n"
+
+
+def encode_csv(rows, fields, batch=500):
+    """CSV with a header line, in strings of up to `batch` rows."""
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+    writer.writerow(fields)
+    count = 0
+    for row in rows:
+        writer.writerow([row.get(field) for field in fields])
+        count += 1
+        if count >= batch:
+            yield buf.getvalue()
+            buf.seek(0)
+            buf.truncate()
+            count = 0
+    yield buf.getvalue()
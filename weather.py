@@ -0,0 +1,177 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from requests.adapters import HTTPAdapter
+
+
+OWM_BASE = "https://api.openweathermap.org/data/2.5"
+
+
+def build_payload(weather, air):
+    """Validate raw OWM weather/air responses into the cached payload shape."""
+    if not ("main" in weather and "weather" in weather and weather["weather"]):
+        raise ValueError(weather.get("message") or "unexpected weather payload")
+    if air is not None and not (air.get("list") or []):
+        air = None
+    return {"weather": weather, "air": air}
+
+
+class WeatherService:
+    """OpenWeatherMap client with a TTL cache and stale-while-revalidate refresh.
+
+    Entries are keyed by coordinates rounded to `precision` decimals (~1 km
+    at 2), so each site has its own entry and sites closer than that share
+    one. A fresh entry is served as-is, a stale one is served while a
+    background refresh runs, and a failed fetch is cached for `error_ttl`
+    so an OWM outage does not turn every page render into a timeout.
+    """
+
+    def __init__(self, api_key, ttl=600, stale_ttl=3600, error_ttl=60, precision=2, timeout=8, max_workers=4,
+                 observe=None):
+        self.api_key = api_key
+        # observe(endpoint, seconds, ok) after every upstream call.
+        self.observe = observe
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.error_ttl = error_ttl
+        self.precision = precision
+        self.timeout = timeout
+        self._session = requests.Session()
+        self._session.mount("https://", HTTPAdapter(pool_connections=2, pool_maxsize=max_workers))
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="owm")
+        self._refresher = ThreadPoolExecutor(max_workers=2, thread_name_prefix="owm-refresh")
+        self._lock = threading.Lock()
+        self._cache = {}
+        self._refreshing = set()
+        self._read_at = {}
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self.errors = 0
+
+    def _key(self, lat, lon):
+        return (round(float(lat), self.precision), round(float(lon), self.precision))
+
+    def current(self, lat, lon):
+        """Return {"weather": ..., "air": ...} raw OWM payloads, or None."""
+        key = self._key(lat, lon)
+        now = time.monotonic()
+        with self._lock:
+            self._read_at[key] = now
+            entry = self._cache.get(key)
+            if entry is not None:
+                age = now - entry["fetched_at"]
+                if entry["error"] is not None:
+                    if age < self.error_ttl:
+                        self.hits += 1
+                        return None
+                elif age < self.ttl:
+                    self.hits += 1
+                    return entry["data"]
+                elif age < self.stale_ttl:
+                    self.stale_hits += 1
+                    retry_wait = now - entry.get("failed_at", 0) < self.error_ttl
+                    if key not in self._refreshing and not retry_wait:
+                        self._refreshing.add(key)
+                        self._refresher.submit(self._refresh, key)
+                    return entry["data"]
+            self.misses += 1
+        return self._refresh(key)
+
+    def expires_in(self, lat, lon):
+        """Seconds until the cached entry turns stale; None when nothing is cached."""
+        with self._lock:
+            entry = self._cache.get(self._key(lat, lon))
+            if entry is None or entry["error"] is not None:
+                return None
+            return entry["fetched_at"] + self.ttl - time.monotonic()
+
+    def due(self, margin, idle):
+        """Rounded (lat, lon) of entries read in the last `idle` seconds that
+        are missing or turn stale within `margin` seconds."""
+        now = time.monotonic()
+        with self._lock:
+            keys = []
+            for key, read_at in list(self._read_at.items()):
+                if now - read_at > idle:
+                    # Sites nobody asks about are left to expire.
+                    del self._read_at[key]
+                    continue
+                entry = self._cache.get(key)
+                if entry is None or entry["error"] is not None or entry["fetched_at"] + self.ttl - now <= margin:
+                    keys.append(key)
+            return keys
+
+    def put(self, lat, lon, data):
+        """Store a payload fetched elsewhere (e.g. by the async server)."""
+        with self._lock:
+            self._cache[self._key(lat, lon)] = {"data": data, "error": None, "fetched_at": time.monotonic()}
+
+    def invalidate(self, lat=None, lon=None):
+        with self._lock:
+            if lat is None or lon is None:
+                self._cache.clear()
+            else:
+                self._cache.pop(self._key(lat, lon), None)
+
+    # -------------------- FETCH --------------------
+
+    def _refresh(self, key):
+        try:
+            data = self._fetch(*key)
+            error = None
+        except Exception as e:
+            data = None
+            error = str(e)
+        with self._lock:
+            self._refreshing.discard(key)
+            if error is not None:
+                self.errors += 1
+                stale = self._cache.get(key)
+                if (
+                    stale is not None
+                    and stale["error"] is None
+                    and time.monotonic() - stale["fetched_at"] < self.stale_ttl
+                ):
+                    # Keep serving the last good payload until it ages out.
+                    stale["failed_at"] = time.monotonic()
+                    return stale["data"]
+            self._cache[key] = {"data": data, "error": error, "fetched_at": time.monotonic()}
+        return data
+
+    def _fetch(self, lat, lon):
+        params = {"lat": lat, "lon": lon, "appid": self.api_key}
+        air_future = self._executor.submit(self._get_json, "air_pollution", params)
+        weather = self._get_json("weather", dict(params, units="metric"))
+        try:
+            air = air_future.result()
+        except Exception:
+            air = None
+        return build_payload(weather, air)
+
+    def _get_json(self, endpoint, params):
+        started = time.perf_counter()
+        ok = False
+        try:
+            res = self._session.get(f"{OWM_BASE}/{endpoint}", params=params, timeout=self.timeout)
+            data = res.json()
+            if not res.ok:
+                raise ValueError(data.get("message") or f"HTTP {res.status_code}")
+            ok = True
+            return data
+        finally:
+            if self.observe is not None:
+                self.observe(endpoint, time.perf_counter() - started, ok)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "entries": len(self._cache),
+                "hits": self.hits,
+                "stale_hits": self.stale_hits,
+                "misses": self.misses,
+                "errors": self.errors,
+                "refreshing": len(self._refreshing),
+            }